@@ -0,0 +1,223 @@
+"""Adaptive choice of download backend and connection count
+
+The best settings depend on the host: cloud storage scales well with many
+parallel connections, while smaller servers may throttle or slow down. The
+first large download from a host starts with a short ramp-up: a few MiB are
+fetched over 1, 2, 4, ... parallel Range requests until adding connections
+stops helping. Later downloads use that connection count.
+
+The backend is chosen from the measured throughput of real downloads, after
+each available backend was tried once. What was learned is saved per host in
+`hosts.json` in the metadata directory, so later runs start from the best
+known settings.
+"""
+
+import json
+import logging
+import threading
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+from .checksum import Hasher
+from .locking import exclusive
+from .segmented import _RemoteInfo
+from .util import atomic_write_text, host_of, metadata_dir
+
+HOSTS_NAME = "hosts.json"
+
+# Files smaller than this aren't worth probing, or measuring
+_PROBE_MIN_SIZE = 256 << 20
+# Bytes fetched by each connection in a ramp-up step
+_PROBE_BYTES = 4 << 20
+_MAX_CONNECTIONS = 16
+# Relative gain needed to keep adding connections
+_MIN_GAIN = 0.1
+# Re-probe hosts after this many seconds
+_PROBE_MAX_AGE = 30 * 24 * 3600
+# Weight of the newest measurement in the running average
+_SMOOTHING = 0.5
+_TIMEOUT = 60
+_DEFAULT_CONNECTIONS = 8
+
+
+@dataclass
+class HostProfile:
+    """What is known about downloading from one host
+
+    Attributes:
+    - ranges: whether the host supports Range requests
+    - connections: best number of parallel connections
+    - probed: time of the last ramp-up, or 0
+    - probe_rates: ramp-up throughput (bytes/s) by number of connections
+    - rates: average download throughput (bytes/s) by backend
+    """
+
+    ranges: bool = True
+    connections: int = _DEFAULT_CONNECTIONS
+    probed: float = 0
+    probe_rates: Dict[str, float] = field(default_factory=dict)
+    rates: Dict[str, float] = field(default_factory=dict)
+
+
+class HostProfiles:
+    "Persistent host profiles for one data_dir"
+
+    _lock = threading.Lock()
+
+    def __init__(self, data_dir: Path):
+        self.data_dir = data_dir
+        self.path = metadata_dir(data_dir) / HOSTS_NAME
+
+    def _load(self) -> Dict[str, Dict]:
+        try:
+            return json.loads(self.path.read_text())
+        except FileNotFoundError:
+            return {}
+
+    def get(self, host: str) -> Optional[HostProfile]:
+        with self._lock:
+            entry = self._load().get(host)
+        return HostProfile(**entry) if entry is not None else None
+
+    def save(self, host: str, profile: HostProfile) -> None:
+        with self._lock, exclusive(self.data_dir, "hosts"):
+            entries = self._load()
+            entries[host] = asdict(profile)
+            atomic_write_text(self.path, json.dumps(entries, indent=1))
+
+
+def _fetch_range(url: str, start: int, length: int) -> int:
+    request = urllib.request.Request(
+        url, headers={"Range": f"bytes={start}-{start + length - 1}"}
+    )
+    received = 0
+    with urllib.request.urlopen(request, timeout=_TIMEOUT) as response:
+        for data in iter(lambda: response.read(1 << 16), b""):
+            received += len(data)
+    return received
+
+
+def _measure(url: str, size: int, connections: int) -> float:
+    "Throughput of parallel range requests, spread over the file"
+    length = min(_PROBE_BYTES, size // connections)
+    starts = [i * (size // connections) for i in range(connections)]
+    begin = time.monotonic()
+    with ThreadPoolExecutor(connections) as pool:
+        received = sum(pool.map(lambda s: _fetch_range(url, s, length), starts))
+    return received / max(time.monotonic() - begin, 1e-9)
+
+
+def probe(url: str, size: int) -> HostProfile:
+    """Find the number of connections beyond which throughput stops improving
+
+    Args:
+    - url: a file on the host, supporting Range requests
+    - size: size of the file
+    """
+    profile = HostProfile(probed=time.time())
+    best_rate = 0.0
+    connections = 1
+    while connections <= _MAX_CONNECTIONS:
+        rate = _measure(url, size, connections)
+        profile.probe_rates[str(connections)] = rate
+        logging.debug(
+            f"{host_of(url)}: {connections} connections, {rate / 1e6:.1f} MB/s"
+        )
+        if best_rate and rate < best_rate * (1 + _MIN_GAIN):
+            break
+        best_rate = rate
+        profile.connections = connections
+        connections *= 2
+    return profile
+
+
+def choose_backend(profile: HostProfile, available: List[str]) -> str:
+    """Pick the backend for a host
+
+    Backends that suit the host are each tried once, in order of preference.
+    After that, the fastest one so far is used.
+    """
+    if profile.ranges and profile.connections > 1:
+        # curl only uses a single connection
+        candidates = [b for b in available if b != "curl"]
+    else:
+        candidates = [b for b in ("curl", "native") if b in available]
+    for backend in candidates:
+        if backend not in profile.rates:
+            return backend
+    return max(candidates, key=lambda backend: profile.rates[backend])
+
+
+class AdaptiveDownloader:
+    """Downloader choosing backend and connections per host
+
+    Instances can be used with `sources.set_downloader`.
+
+    Args:
+    - data_dir: install directory, where host profiles are saved
+    - backends: downloaders to choose from, by name, in order of preference.
+      All but curl must accept a `connections` argument.
+    """
+
+    def __init__(self, data_dir: Path, backends: Dict[str, Callable[..., None]]):
+        self.profiles = HostProfiles(data_dir)
+        self.backends = backends
+        self._host_locks: Dict[str, threading.Lock] = {}
+        self._lock = threading.Lock()
+
+    def _host_lock(self, host: str) -> threading.Lock:
+        with self._lock:
+            return self._host_locks.setdefault(host, threading.Lock())
+
+    def profile(self, url: str) -> HostProfile:
+        "Known profile of the host of url, probing it if needed"
+        host = host_of(url)
+        with self._host_lock(host):
+            profile = self.profiles.get(host)
+            if profile is not None and time.time() - profile.probed < _PROBE_MAX_AGE:
+                return profile
+            try:
+                remote = _RemoteInfo.fetch(url)
+            except (OSError, ValueError) as err:
+                logging.debug(f"Unable to probe {host}: {err}")
+                return profile or HostProfile()
+            if remote.size < _PROBE_MIN_SIZE:
+                return profile or HostProfile(ranges=remote.ranges)
+            rates = profile.rates if profile is not None else {}
+            if remote.ranges:
+                logging.info(f"Measuring download speed from {host}")
+                profile = probe(url, remote.size)
+            else:
+                profile = HostProfile(ranges=False, connections=1, probed=time.time())
+            profile.rates = rates
+            self.profiles.save(host, profile)
+            logging.info(f"Using {profile.connections} connections for {host}")
+            return profile
+
+    def _record(self, url: str, backend: str, rate: float) -> None:
+        host = host_of(url)
+        with self._host_lock(host):
+            profile = self.profiles.get(host)
+            if profile is None:
+                return  # only learn about probed hosts
+            old = profile.rates.get(backend)
+            if old is not None:
+                rate = _SMOOTHING * rate + (1 - _SMOOTHING) * old
+            profile.rates[backend] = rate
+            self.profiles.save(host, profile)
+
+    def __call__(self, url: str, dst: Path, hasher: Optional[Hasher] = None) -> None:
+        profile = self.profile(url)
+        backend = choose_backend(profile, list(self.backends))
+        download = self.backends[backend]
+        kwargs = {} if backend == "curl" else {"connections": profile.connections}
+        logging.debug(f"Downloading {url} with {backend} ({kwargs})")
+        start = time.monotonic()
+        download(url, dst, hasher=hasher, **kwargs)
+        size = dst.stat().st_size
+        if size >= _PROBE_MIN_SIZE:
+            self._record(url, backend, size / max(time.monotonic() - start, 1e-9))
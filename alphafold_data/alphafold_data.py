@@ -1,58 +1,473 @@
 """Main module."""
 
+import datetime
+import functools
 import itertools
 import logging
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from subprocess import CalledProcessError
-from typing import Dict
+from typing import Callable, Dict, Iterable, List, Optional, Sequence
 
-from .sources import Source, latest_sources
+from . import seekable, telemetry
+from .adaptive import AdaptiveDownloader
+from .cache import DownloadCache
+from .dedup import DedupReport, dedup
+from .discovery import SCRIPTS_URL, discover_sources
+from .engine import DISK, NETWORK, default_engine
+from .fasta import FastaIndex
+from .locking import Leases
+from .pagecache import WarmReport, residency, warm
+from .planner import Plan, PlanError, plan_update
+from .scheduler import Job, Scheduler
+from .sources import (
+    Source,
+    available_downloaders,
+    downloaders,
+    latest_sources,
+    set_download_cache,
+    set_downloader,
+    set_fasta_shards,
+)
+from .state import EXTRACTED, LINKED, StateDB
+from .throttle import Governor, set_governor
+from .util import host_of
+from .versions import latest_version, link_version
 
 
 class AFData:
     data_dir: Path
+    jobs: int
+    per_host: int
+    metrics_file: Optional[Path]
     _sources: Dict[str, Source]
 
-    def __init__(self, data_dir: Path):
+    def __init__(
+        self,
+        data_dir: Path,
+        jobs: int = 4,
+        per_host: int = 2,
+        metrics_file: Optional[Path] = None,
+        downloader: Optional[str] = None,
+        cache_dir: Optional[Path] = None,
+        discover=False,
+        discover_offline=False,
+        decompress_jobs: int = 2,
+        scripts_url: str = SCRIPTS_URL,
+        network_limit: str = "",
+        disk_limit: str = "",
+        threads: int = 0,
+        fasta_shards: int = 0,
+    ):
+        """
+        Args:
+        - data_dir: install directory
+        - jobs: maximum number of concurrent downloads
+        - per_host: maximum number of concurrent downloads from the same host
+        - metrics_file: Prometheus textfile for progress metrics. Defaults to
+          the metadata directory of data_dir.
+        - downloader: download backend, from `sources.downloaders`, or
+          "adaptive" to pick backend and connections per host based on
+          measurements (see `alphafold_data.adaptive`). By default the global
+          choice of `sources.download_file` is kept.
+        - cache_dir: download cache shared with other data directories, see
+          `alphafold_data.cache`
+        - discover: look up the latest upstream versions, instead of using the
+          pinned ones from `sources.latest_sources`
+        - discover_offline: with discover, only use the versions found by
+          earlier lookups, without sending any requests
+        - scripts_url: location of AlphaFold's download scripts, for discover
+        - decompress_jobs: maximum number of concurrent extractions. They
+          overlap with downloads, which are limited by jobs.
+        - network_limit: total download rate, e.g. "50M" or
+          "08:00-20:00=20M,200M" (see `throttle.Schedule`)
+        - disk_limit: total rate of writing extracted data, as network_limit
+        - threads: total decompression threads, 0 for no limit
+        - fasta_shards: also split FASTA databases into this many shards when
+          they are extracted (see `alphafold_data.shards`), 0 for none
+        """
         self.data_dir = data_dir
-        self._sources = latest_sources()
+        self.jobs = jobs
+        self.per_host = per_host
+        self.metrics_file = metrics_file
+        default_engine().configure(network=jobs, disk=decompress_jobs)
+        if discover:
+            self._sources = discover_sources(
+                Path(data_dir), scripts_url=scripts_url, offline=discover_offline
+            )
+        else:
+            self._sources = latest_sources()
+        if downloader == "adaptive":
+            set_downloader(AdaptiveDownloader(data_dir, available_downloaders()))
+        elif downloader is not None:
+            set_downloader(downloaders[downloader])
+        if cache_dir is not None:
+            set_download_cache(DownloadCache(Path(cache_dir)))
+        if network_limit or disk_limit or threads:
+            governor = Governor(network=network_limit, disk=disk_limit, threads=threads)
+            logging.info(
+                f"Limits: network {governor.schedules[NETWORK]},"
+                f" disk {governor.schedules[DISK]}, threads {threads or 'unlimited'}"
+            )
+            set_governor(governor)
+        if fasta_shards:
+            set_fasta_shards(fasta_shards)
+
+    def _session(self):
+        "Publish progress while work is running, see `alphafold_data.telemetry`"
+        return telemetry.session(Path(self.data_dir), metrics_file=self.metrics_file)
+
+    def _tracked(
+        self, name: str, action: Callable[[Source], None], db: Source, wait: bool
+    ) -> bool:
+        """Run action on db while holding the source's lease
+
+        Other workers on the same data_dir skip the source meanwhile, see
+        `alphafold_data.locking`.
+
+        Args:
+        - wait: wait for the lease if another worker holds it
+
+        Returns:
+            False if the source is claimed by another worker
+        """
+        leases = Leases(Path(self.data_dir))
+        lease = leases.acquire(name) if wait else leases.try_acquire(name)
+        if lease is None:
+            logging.info(f"{name} is claimed by another worker")
+            return False
+        with lease, telemetry.source(name):
+            action(db)
+        return True
+
+    def _run_parallel(
+        self,
+        verb: str,
+        action: Callable[[Source], None],
+        network=True,
+        plan: Optional[Plan] = None,
+        retry: Optional[Callable[[Source], None]] = None,
+    ) -> bool:
+        """Run action on every source using the scheduler
+
+        Sources claimed by other workers are skipped at first. Once everything
+        else is done, they are waited for and retry is run on them, which
+        normally finds the work already done.
+
+        Args:
+        - verb: description for error messages
+        - action: work to do for each source
+        - retry: work to do for sources another worker held, by default
+          action. Forced actions pass their unforced version, so that work
+          the other worker completed isn't done again.
+        - network: whether the action downloads. If not, the per-host limit
+          doesn't apply and jobs are ordered by local file size.
+        - plan: disk plan. Sources are only started while their archives fit
+          into the plan's capacity.
+
+        Returns:
+            True if all sources succeeded
+        """
+        capacity = plan.capacity if plan is not None else 0
+        costs = plan.costs() if plan is not None else {}
+        scheduler = Scheduler(
+            max_workers=self.jobs,
+            per_host=self.per_host if network else 0,
+            capacity=capacity,
+        )
+        busy: List[str] = []
+
+        def run(name: str, db: Source, wait: bool) -> None:
+            todo = retry or action if wait else action
+            if not self._tracked(name, todo, db, wait):
+                busy.append(name)
+
+        def size(db: Source) -> int:
+            if not network:
+                return db.local_size(self.data_dir)
+            if db.uncompressed_available(self.data_dir):
+                return 0  # nothing to download; don't ask the server
+            return db.remote_size()
+
+        def jobs(names: Iterable[str], wait: bool) -> List[Job]:
+            return [
+                Job(
+                    name=name,
+                    func=functools.partial(run, name, db, wait),
+                    host=host_of(db.url) if network else "",
+                    size=size(db),
+                    cost=costs.get(name, 0),
+                )
+                for name, db in self._sources.items()
+                if name in names
+            ]
 
-    def download(self, force=False):
-        # TODO parallelize
         complete = True
-        for name, db in self._sources.items():
+        with self._session():
             try:
-                db.download(self.data_dir, force=force)
-            except CalledProcessError as err:
-                logging.error(f"Error downloading {name}")
+                results = scheduler.run(jobs(self._sources, wait=False))
+                if busy:
+                    results.update(scheduler.run(jobs(busy, wait=True)))
+            except KeyboardInterrupt:
+                default_engine().cancel()
+                raise
+        for name, err in results.items():
+            if err is not None:
+                logging.error(f"Error {verb} {name}")
                 logging.error(str(err))
-                logging.error(str(err.stderr))
+                if isinstance(err, CalledProcessError):
+                    logging.error(str(err.stderr))
                 complete = False
         return complete
 
+    def download(self, force=False):
+        return self._run_parallel(
+            "downloading",
+            lambda db: db.download(self.data_dir, force=force),
+            retry=lambda db: db.download(self.data_dir),
+        )
+
+    def stream(self, keep_compressed=False, force=False):
+        "Download and decompress in one pass"
+        return self._run_parallel(
+            "streaming",
+            lambda db: db.stream(
+                self.data_dir, keep_compressed=keep_compressed, force=force
+            ),
+            retry=lambda db: db.stream(self.data_dir, keep_compressed=keep_compressed),
+        )
+
+    def verify(self, full=False):
+        """Check compressed files against their expected checksums
+
+        Only files changed since they were last hashed are read, unless full
+        is set. Files are hashed in parallel.
+        """
+        return self._run_parallel(
+            "verifying",
+            lambda db: db.verify(self.data_dir, full=full),
+            network=False,
+            retry=lambda db: db.verify(self.data_dir),
+        )
+
     def decompress(self, force=False):
-        complete = True
-        for name, db in self._sources.items():
-            try:
-                db.decompress(self.data_dir, force=force)
-            except CalledProcessError as err:
-                logging.error(f"Error decompressing {name}")
-                logging.error(str(err))
-                logging.error(str(err.stderr))
-                complete = False
+        """Extract all downloaded archives
 
-        return complete
+        Sources are extracted in parallel, at most decompress_jobs at a time
+        (see `alphafold_data.engine`). A failing source doesn't stop the
+        others.
+        """
+        return self._run_parallel(
+            "decompressing",
+            lambda db: db.decompress(self.data_dir, force=force),
+            network=False,
+            # another worker may have extracted it meanwhile
+            retry=lambda db: db.decompress(self.data_dir),
+        )
+
+    def validate(self, full=False):
+        """Check extracted HH-suite databases, see `Source.validate`
+
+        Sources are checked in parallel. Passed checks are reused until a
+        source is extracted again, unless full is set.
+        """
+        return self._run_parallel(
+            "validating",
+            lambda db: db.validate(self.data_dir, full=full),
+            network=False,
+            retry=lambda db: db.validate(self.data_dir),
+        )
+
+    def transcode(self, remove=False):
+        """Rewrite compressed files as seekable zstd
+
+        See `alphafold_data.seekable`. Needs the optional zstandard package.
+
+        Args:
+        - remove: delete the original compressed files afterwards
+        """
+        if not seekable.available():
+            logging.error(
+                "Transcoding needs the zstandard package"
+                " (pip install alphafold_data[zstd])"
+            )
+            return False
+        return self._run_parallel(
+            "transcoding",
+            lambda db: db.transcode(self.data_dir, remove=remove),
+            network=False,
+        )
 
     def prune(self):
+        "Delete compressed files of all extracted sources"
+        freed = sum(db.prune(self.data_dir) for db in self._sources.values())
+        logging.info(f"Pruned {freed / 1e9:.1f} GB")
+        return True
+
+    def link(self, name: Optional[str] = None) -> bool:
+        """Build a version tree of all sources and make it the latest
+
+        See `alphafold_data.versions`. Refuses to link unless every source is
+        extracted.
+
+        Args:
+        - name: version name. Defaults to today's date.
+        """
+        data_dir = Path(self.data_dir)
+        missing = [
+            name
+            for name, db in self._sources.items()
+            if not db.uncompressed_available(data_dir)
+            or not Path(data_dir, db.uncompressed).exists()
+        ]
+        if missing:
+            logging.error(f"Not linking, not extracted: {', '.join(missing)}")
+            return False
+        links = {
+            db.link_name or source: db.link_target(data_dir)
+            for source, db in self._sources.items()
+        }
+        tree = link_version(data_dir, links, name)
+        state = StateDB(data_dir)
         for db in self._sources.values():
-            db.prune(self.data_dir)
+            record = state.get(db.uncompressed, EXTRACTED)
+            size = record.size if record is not None else None
+            state.finish(db.uncompressed, LINKED, size or 0)
+        logging.info(f"Linked version {tree.name}")
         return True
 
-    def update(self):
-        return self.download() and self.decompress()
+    def _extracted(self, names: Optional[Sequence[str]]) -> Dict[str, Path]:
+        "Paths of the extracted sources among names (default: all)"
+        unknown = set(names or ()) - set(self._sources)
+        if unknown:
+            raise ValueError(f"Unknown sources: {', '.join(sorted(unknown))}")
+        data_dir = Path(self.data_dir)
+        return {
+            name: Path(data_dir, self._sources[name].uncompressed)
+            for name in names or self._sources
+            if self._sources[name].uncompressed_available(data_dir)
+        }
+
+    def warm(
+        self, names: Optional[Sequence[str]] = None, budget: Optional[int] = None
+    ) -> WarmReport:
+        """Load extracted sources into the page cache
+
+        See `alphafold_data.pagecache`.
+
+        Args:
+        - names: sources to load, most important first. Defaults to all.
+        - budget: maximum bytes to load. Defaults to half the available memory.
+        """
+        paths = self._extracted(names)
+        report = warm(list(paths.values()), budget=budget, jobs=self.jobs)
+        logging.info(str(report))
+        return report
+
+    def residency(self, names: Optional[Sequence[str]] = None) -> str:
+        "Table of how much of each extracted source is in the page cache"
+        header = ("Database", "Size (GB)", "Cached")
+        widths = 10, 10, 7
+        lines = [header]
+        for name, path in self._extracted(names).items():
+            cached = residency(path, jobs=self.jobs)
+            fraction = "?" if cached.fraction is None else f"{cached.fraction:.0%}"
+            lines.append((name, f"{cached.size / 1e9:.1f}", fraction))
+        return "\n".join(
+            " ".join(elem.rjust(width) for elem, width in zip(line, widths))
+            for line in lines
+        )
+
+    def dedup(self) -> DedupReport:
+        "Replace identical uncompressed files by links to a shared copy"
+        return dedup(Path(self.data_dir), jobs=self.jobs)
+
+    def fasta(self, name: str) -> FastaIndex:
+        """Open a FASTA database for lookups by record ID
+
+        Args:
+        - name: source name, e.g. "mgnify"
+        """
+        return self._sources[name].fasta(Path(self.data_dir))
+
+    def plan(
+        self,
+        budget: Optional[int] = None,
+        prune=False,
+        stream=False,
+        keep_compressed=True,
+    ) -> Plan:
+        "Estimate the disk space needed by update, see `alphafold_data.planner`"
+        return plan_update(
+            self._sources,
+            Path(self.data_dir),
+            budget=budget,
+            prune=prune,
+            stream=stream,
+            keep_compressed=keep_compressed,
+        )
+
+    def update(
+        self,
+        stream=False,
+        keep_compressed=True,
+        dedup=False,
+        prune=False,
+        disk_budget: Optional[int] = None,
+        allow_unknown=False,
+    ):
+        """Download and decompress all sources
+
+        Refuses to start if the update would not fit into the disk budget, or
+        if the size of some source is unknown and no budget was given.
+
+        Args:
+        - stream: decompress while downloading
+        - keep_compressed: with stream, also save the compressed files
+        - dedup: deduplicate identical files afterwards
+        - prune: delete each source's compressed files as soon as it is
+          extracted. Sources are then processed one after the other as far as
+          needed to stay within the budget.
+        - disk_budget: maximum bytes to use. Defaults to the free space.
+        - allow_unknown: start even if the size of some source is unknown
+        """
+        plan = self.plan(
+            budget=disk_budget,
+            prune=prune,
+            stream=stream,
+            keep_compressed=keep_compressed,
+        )
+        try:
+            plan.check(allow_unknown=allow_unknown or disk_budget is not None)
+        except PlanError as err:
+            logging.error(str(err))
+            logging.error(str(plan))
+            return False
+        logging.info(str(plan))
+
+        def process(db: Source):
+            # each source is extracted as soon as it is downloaded, overlapping
+            # with the other downloads (see `alphafold_data.engine`)
+            if stream:
+                db.stream(self.data_dir, keep_compressed=keep_compressed)
+            else:
+                db.download(self.data_dir)
+                db.decompress(self.data_dir)
+            db.validate(self.data_dir)
+            if prune:
+                db.prune(self.data_dir)
+
+        complete = self._run_parallel("updating", process, plan=plan if prune else None)
+        if complete and dedup:
+            self.dedup()
+        return complete
+
+    def status(self, deep=False):
+        """Print status about current versions
 
-    def status(self):
-        """Print status about current versions"""
+        By default this is answered from the state database. With deep, the
+        filesystem is re-checked (in parallel) and the database corrected.
+        """
 
         def avail_emoji(val: bool):
             return "✅" if val else "❌"
@@ -60,23 +475,70 @@ class AFData:
         def shorten(s, width):
             return s if len(s) <= width else s[: width - 1] + "…"
 
-        header = ("Database", "Version", "Compressed", "Uncompressed")
-        widths = 10, 10, 10, 13
+        def check(db: Source):
+            return (
+                db.compressed_available(self.data_dir, deep=deep),
+                db.verified(self.data_dir),
+                db.uncompressed_available(self.data_dir, deep=deep),
+            )
+
+        header = (
+            "Database",
+            "Version",
+            "Compressed",
+            "Verified",
+            "Uncompressed",
+            "Validated",
+        )
+        widths = 10, 10, 10, 8, 13, 9
+        with ThreadPoolExecutor(self.jobs) as pool:
+            checks = list(pool.map(check, self._sources.values()))
         lines = []
-        for name, db in self._sources.items():
+        for (name, db), flags in zip(self._sources.items(), checks):
+            # only HH-suite databases are validated
+            validated = avail_emoji(db.validated(self.data_dir)) if db.hhsuite else "-"
             lines.append(
-                (
-                    name,
-                    db.version,
-                    avail_emoji(db.compressed_available(self.data_dir)),
-                    avail_emoji(db.uncompressed_available(self.data_dir)),
-                )
+                (name, db.version, *(avail_emoji(f) for f in flags), validated)
             )
 
-        return "\n".join(
+        table = "\n".join(
             " ".join(
                 shorten(str(elem), widths[i]).rjust(widths[i], " ")
                 for i, elem in enumerate(line)
             )
             for line in itertools.chain([header], lines)
         )
+        running = [
+            stage
+            for stage in telemetry.read_progress(Path(self.data_dir))
+            if stage["status"] == "running"
+        ]
+        if running:
+            table += "\n\nIn progress:\n" + "\n".join(
+                _format_progress(stage) for stage in running
+            )
+        latest = latest_version(Path(self.data_dir))
+        if latest is not None:
+            table += f"\n\nLatest version: {latest}"
+        claims = Leases(Path(self.data_dir)).held()
+        if claims:
+            table += "\n\nClaimed by workers:\n" + "\n".join(
+                f"  {claim.key}: {claim.owner}" for claim in claims
+            )
+        return table
+
+
+def _format_progress(stage: Dict) -> str:
+    "One line of live progress for status"
+    done = f"{stage['done'] / 1e9:.2f}"
+    if stage["total"]:
+        done += f"/{stage['total'] / 1e9:.2f} GB ({stage['done'] / stage['total']:.0%})"
+    else:
+        done += " GB"
+    line = (
+        f"  {stage['source']} {stage['stage']} {stage['name']}: {done},"
+        f" {stage['rate'] / 1e6:.1f} MB/s"
+    )
+    if stage["eta"] is not None:
+        line += f", ETA {datetime.timedelta(seconds=int(stage['eta']))}"
+    return line
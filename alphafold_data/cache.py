@@ -0,0 +1,197 @@
+"""Download cache shared between data directories
+
+Nodes with their own data_dir can share a cache directory, e.g. on a cluster
+filesystem, so each file only crosses the WAN once. Entries are keyed by URL
+and the server's validator (the ETag, or else Last-Modified), so a changed
+upstream file never matches an old entry. Files from servers sending neither
+are not cached.
+
+Layout of the cache directory::
+
+    <key[:2]>/<key>       the file
+    <key[:2]>/<key>.json  url, validator, size and digests
+
+Entries are published atomically: the file is linked or copied to a
+temporary name and renamed, and the metadata is written last. Cached files
+are hardlinked into data_dir when both are on the same filesystem, otherwise
+copied. Nothing is ever evicted; old entries can be deleted by hand at any
+time.
+
+A hardlinked file shares its contents with the cache entry and with every
+other data_dir it was fetched into, so files fetched from the cache must
+never be modified in place: write a new file and rename it over the old one,
+as the downloaders do. Cache entries are made read-only to enforce this.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import shutil
+import threading
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+from typing import Dict, Optional
+
+from . import telemetry, throttle
+from .checksum import ChecksumError, Hasher, check_digests
+from .engine import DISK
+from .segmented import _RemoteInfo
+from .util import atomic_write_text, remove_path
+
+_CHUNK_SIZE = 16 << 20
+# Mode of cache entries, which may be hardlinked into many data_dirs
+_READ_ONLY = 0o444
+
+
+@dataclass
+class CacheEntry:
+    """Metadata of a cached file
+
+    Attributes:
+    - url: where the file was downloaded from
+    - validator: ETag or Last-Modified of the file when it was downloaded
+    - size: file size in bytes
+    - digests: hex digests of the file, by hashlib algorithm name
+    """
+
+    url: str
+    validator: str
+    size: int
+    digests: Dict[str, str] = field(default_factory=dict)
+
+
+def _read_only(path: Path) -> None:
+    "Make a cache entry read-only, if it isn't already"
+    try:
+        if path.stat().st_mode & 0o777 != _READ_ONLY:
+            os.chmod(path, _READ_ONLY)
+    except OSError as err:  # e.g. an entry added by another user
+        logging.debug(f"Unable to make {path} read-only: {err}")
+
+
+def validator(url: str) -> str:
+    """Identify the current version of a remote file
+
+    Returns:
+        the ETag or Last-Modified header, or "" if the server sends neither
+    """
+    try:
+        remote = _RemoteInfo.fetch(url)
+    except (OSError, ValueError) as err:
+        logging.debug(f"Unable to check {url}: {err}")
+        return ""
+    if remote.etag:
+        return f"etag:{remote.etag}"
+    if remote.last_modified:
+        return f"modified:{remote.last_modified}"
+    return ""
+
+
+class DownloadCache:
+    "A shared cache directory, see the module documentation"
+
+    root: Path
+
+    def __init__(self, root: Path):
+        self.root = Path(root)
+
+    def _path(self, url: str, validator: str) -> Path:
+        key = hashlib.sha256(f"{url}\0{validator}".encode()).hexdigest()
+        return self.root / key[:2] / key
+
+    def get(self, url: str, validator: str) -> Optional[CacheEntry]:
+        "The complete entry for url at validator, if cached"
+        path = self._path(url, validator)
+        try:
+            entry = CacheEntry(**json.loads(path.with_suffix(".json").read_text()))
+            if path.stat().st_size != entry.size:
+                return None
+        except (OSError, ValueError, TypeError):
+            return None
+        return entry
+
+    def fetch(
+        self, url: str, dst: Path, validator: str, hasher: Optional[Hasher] = None
+    ) -> bool:
+        """Get url from the cache
+
+        Args:
+        - url: url of the file
+        - dst: filename to save as
+        - validator: current validator of url, see `validator`
+        - hasher: if given, is fed the file contents
+
+        Returns:
+            True if the file was found in the cache and saved to dst
+        """
+        entry = self.get(url, validator) if validator else None
+        if entry is None:
+            return False
+        src = self._path(url, validator)
+        tmp = dst.with_name(dst.name + ".cache-partial")
+        dst.parent.mkdir(parents=True, exist_ok=True)
+        remove_path(tmp)
+        hasher = hasher or Hasher(entry.digests)
+        try:
+            os.link(src, tmp)
+            logging.info(f"Linking {dst.name} from the download cache")
+            _read_only(tmp)
+            hasher.update_from_file(tmp)
+        except OSError:
+            logging.info(f"Copying {dst.name} from the download cache")
+            self._copy(src, tmp, hasher)
+        try:
+            check_digests(tmp, hasher.hexdigests(), entry.digests)
+        except ChecksumError as err:
+            logging.warning(f"Dropping corrupt cache entry for {url}: {err}")
+            tmp.unlink()
+            hasher.reset()
+            remove_path(src.with_suffix(".json"))
+            remove_path(src)
+            return False
+        os.replace(tmp, dst)
+        return True
+
+    @staticmethod
+    def _copy(src: Path, dst: Path, hasher: Hasher) -> None:
+        with src.open("rb") as fin, dst.open("wb") as fout:
+            telemetry.report(fout.tell)
+            for data in iter(lambda: fin.read(_CHUNK_SIZE), b""):
+                hasher.update(data)
+                fout.write(data)
+                throttle.consume(DISK, len(data))
+
+    def publish(
+        self, url: str, src: Path, validator: str, digests: Dict[str, str]
+    ) -> None:
+        """Add a downloaded file to the cache
+
+        Does nothing if the server sent no validator. Failures are logged but
+        don't raise, since the download itself succeeded.
+
+        Args:
+        - url: url the file was downloaded from
+        - src: the downloaded file
+        - validator: validator of url before the download started
+        - digests: digests of src, if known
+        """
+        if not validator or self.get(url, validator) is not None:
+            return
+        path = self._path(url, validator)
+        tmp = path.with_name(f"{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            try:
+                os.link(src, tmp)
+            except OSError:
+                shutil.copyfile(src, tmp)
+            os.chmod(tmp, _READ_ONLY)
+            os.replace(tmp, path)
+            entry = CacheEntry(url, validator, path.stat().st_size, digests)
+            atomic_write_text(path.with_suffix(".json"), json.dumps(asdict(entry)))
+        except OSError as err:
+            logging.warning(f"Unable to add {src.name} to the download cache: {err}")
+            remove_path(tmp)
+            return
+        logging.debug(f"Added {url} to the download cache")
@@ -0,0 +1,201 @@
+"""Checksums and the hash manifest
+
+Checksums are computed while files are written where possible (see
+`Hasher` and `FileFollower`), and stored in a manifest keyed by path, size
+and mtime. Later verification only needs to re-read files which changed
+since they were hashed.
+"""
+
+import hashlib
+import json
+import threading
+import time
+from pathlib import Path
+from typing import Callable, Dict, Iterable, Optional
+
+from .locking import exclusive
+from .util import atomic_write_text, metadata_dir
+
+HASH_ALGORITHMS = ("md5", "sha256")
+
+_CHUNK_SIZE = 16 << 20
+
+
+class ChecksumError(IOError):
+    "A file does not match its expected checksum"
+
+
+class Hasher:
+    "Compute several hashes over the same data at once"
+
+    algorithms: Iterable[str]
+
+    def __init__(self, algorithms: Iterable[str] = HASH_ALGORITHMS):
+        self.algorithms = tuple(algorithms)
+        self.reset()
+
+    def reset(self) -> None:
+        self._hashes = {name: hashlib.new(name) for name in self.algorithms}
+
+    def update(self, data: bytes) -> None:
+        for h in self._hashes.values():
+            h.update(data)
+
+    def update_from_file(self, path: Path, start: int = 0, end: int = -1) -> int:
+        "Hash a range of a file. Returns the number of bytes read."
+        read = 0
+        with path.open("rb") as f:
+            f.seek(start)
+            while end < 0 or start + read < end:
+                if end < 0:
+                    data = f.read(_CHUNK_SIZE)
+                else:
+                    data = f.read(min(_CHUNK_SIZE, end - start - read))
+                if not data:
+                    break
+                self.update(data)
+                read += len(data)
+        return read
+
+    def hexdigests(self) -> Dict[str, str]:
+        return {name: h.hexdigest() for name, h in self._hashes.items()}
+
+
+def hash_file(path: Path, algorithms: Iterable[str] = HASH_ALGORITHMS):
+    "Hash a whole file, reading it once for all algorithms"
+    hasher = Hasher(algorithms)
+    hasher.update_from_file(path)
+    return hasher.hexdigests()
+
+
+class FileFollower:
+    """Hash a file while another writer is still filling it
+
+    `ready` returns the offset up to which the file is completely written.
+    Reading just behind the writer is normally served from the page cache, so
+    this avoids a second pass over the file after the download.
+    """
+
+    def __init__(self, path: Path, hasher: Hasher, ready: Callable[[], int]):
+        self.path = path
+        self.hasher = hasher
+        self.ready = ready
+        self.offset = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _advance(self, limit: int) -> None:
+        if limit > self.offset and self.path.exists():
+            self.offset += self.hasher.update_from_file(self.path, self.offset, limit)
+
+    def _run(self) -> None:
+        while not self._stop.wait(0.2):
+            self._advance(self.ready())
+
+    def start(self) -> "FileFollower":
+        self.hasher.reset()
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread.is_alive():
+            self._thread.join()
+
+    def __enter__(self) -> "FileFollower":
+        return self.start()
+
+    def __exit__(self, *exc) -> None:
+        self.stop()
+
+    def finish(self, size: Optional[int] = None) -> None:
+        "Hash whatever is left, once the writer is done"
+        self.stop()
+        self._advance(self.path.stat().st_size if size is None else size)
+
+
+def check_digests(path: Path, digests: Dict[str, str], expected: Dict[str, str]):
+    "Raise ChecksumError if any expected digest doesn't match"
+    for name, value in expected.items():
+        if name in digests and digests[name] != value.lower():
+            raise ChecksumError(
+                f"{name} mismatch for {path}: expected {value}, got {digests[name]}"
+            )
+
+
+class Manifest:
+    """Persistent record of file digests, keyed by path, size and mtime
+
+    Stored as JSON in the metadata directory of data_dir. Paths are relative
+    to data_dir. Updates hold the `manifest` lease, since other workers may
+    record digests at the same time (see `alphafold_data.locking`).
+    """
+
+    _lock = threading.Lock()
+
+    def __init__(self, data_dir: Path):
+        self.data_dir = Path(data_dir)
+        self.path = metadata_dir(data_dir) / "manifest.json"
+
+    def _load(self) -> Dict[str, Dict]:
+        try:
+            return json.loads(self.path.read_text())
+        except FileNotFoundError:
+            return {}
+
+    def _current(self, relpath: Path, entry: Optional[Dict]):
+        if entry is None:
+            return None
+        try:
+            stat = Path(self.data_dir, relpath).stat()
+        except FileNotFoundError:
+            return None
+        if entry["size"] != stat.st_size or entry["mtime_ns"] != stat.st_mtime_ns:
+            return None
+        return entry["digests"]
+
+    def get(self, relpath: Path) -> Optional[Dict[str, str]]:
+        "Recorded digests, if the file is unchanged since it was hashed"
+        with self._lock:
+            entry = self._load().get(str(relpath))
+        return self._current(relpath, entry)
+
+    def get_many(self, relpaths: Iterable[Path]) -> Dict[Path, Dict[str, str]]:
+        "Recorded digests of all unchanged files among relpaths"
+        with self._lock:
+            entries = self._load()
+        found = {}
+        for relpath in relpaths:
+            digests = self._current(relpath, entries.get(str(relpath)))
+            if digests is not None:
+                found[relpath] = digests
+        return found
+
+    def size(self, relpath: Path) -> Optional[int]:
+        "Size of the file when it was last hashed, even if since deleted"
+        with self._lock:
+            entry = self._load().get(str(relpath))
+        return entry["size"] if entry is not None else None
+
+    def record(self, relpath: Path, digests: Dict[str, str]) -> None:
+        self.record_many({relpath: digests})
+
+    def record_many(self, digests: Dict[Path, Dict[str, str]]) -> None:
+        now = time.time()
+        with self._lock, exclusive(self.data_dir, "manifest"):
+            entries = self._load()
+            for relpath, file_digests in digests.items():
+                stat = Path(self.data_dir, relpath).stat()
+                entries[str(relpath)] = {
+                    "size": stat.st_size,
+                    "mtime_ns": stat.st_mtime_ns,
+                    "digests": file_digests,
+                    "hashed": now,
+                }
+            atomic_write_text(self.path, json.dumps(entries, indent=1))
+
+    def remove(self, relpath: Path) -> None:
+        with self._lock, exclusive(self.data_dir, "manifest"):
+            entries = self._load()
+            if entries.pop(str(relpath), None) is not None:
+                atomic_write_text(self.path, json.dumps(entries, indent=1))
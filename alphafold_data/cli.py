@@ -8,10 +8,35 @@ import click
 import click_logging  # type: ignore
 
 from .alphafold_data import AFData
+from .discovery import SCRIPTS_URL
+from .sources import downloaders
+from .throttle import Schedule
+from .util import parse_size
 
 logger = logging.getLogger()
 click_logging.basic_config(logger)
 
+# Commands which look up new upstream versions by default. The others reuse
+# the versions found by the last lookup, without any requests.
+_DISCOVERING = ("update", "download")
+
+
+def _size(ctx, param, value):
+    if value is None:
+        return None
+    try:
+        return parse_size(value)
+    except ValueError as err:
+        raise click.BadParameter(str(err))
+
+
+def _schedule(ctx, param, value):
+    try:
+        Schedule(value)
+    except ValueError as err:
+        raise click.BadParameter(str(err))
+    return value
+
 
 @click.group()
 @click_logging.simple_verbosity_option(logger)
@@ -22,8 +47,111 @@ click_logging.basic_config(logger)
     required=True,
     type=click.Path(),
 )
+@click.option(
+    "--jobs",
+    "-j",
+    help="Maximum number of concurrent downloads",
+    default=4,
+    show_default=True,
+    type=click.IntRange(min=1),
+)
+@click.option(
+    "--decompress-jobs",
+    help="Maximum number of concurrent extractions",
+    default=2,
+    show_default=True,
+    type=click.IntRange(min=1),
+)
+@click.option(
+    "--network-limit",
+    help="Total download rate, e.g. 50M, or by time of day, e.g."
+    " '08:00-20:00=20M,200M' (default: unlimited)",
+    envvar="ALPHAFOLD_DATA_NETWORK_LIMIT",
+    default="",
+    callback=_schedule,
+)
+@click.option(
+    "--disk-limit",
+    help="Total rate of writing extracted data, as for --network-limit",
+    envvar="ALPHAFOLD_DATA_DISK_LIMIT",
+    default="",
+    callback=_schedule,
+)
+@click.option(
+    "--threads",
+    help="Total decompression threads (0 for no limit)",
+    default=0,
+    show_default=True,
+    type=click.IntRange(min=0),
+)
+@click.option(
+    "--fasta-shards",
+    help="Also split FASTA databases into this many shards for parallel"
+    " searches (0 for none)",
+    default=0,
+    show_default=True,
+    type=click.IntRange(min=0),
+)
+@click.option(
+    "--per-host",
+    help="Maximum number of concurrent downloads per host (0 for no limit)",
+    default=2,
+    show_default=True,
+    type=click.IntRange(min=0),
+)
+@click.option(
+    "--metrics-file",
+    help="Prometheus textfile for progress metrics"
+    " (default: in the metadata directory of --data-dir)",
+    envvar="ALPHAFOLD_DATA_METRICS",
+    type=click.Path(dir_okay=False),
+)
+@click.option(
+    "--downloader",
+    help="Download backend (default: aria2c if installed, else native). 'adaptive'"
+    " measures each host with test downloads and picks the backend and"
+    " number of connections.",
+    envvar="AFD_DOWNLOADER",
+    type=click.Choice(["adaptive", *downloaders]),
+)
+@click.option(
+    "--cache-dir",
+    help="Download cache shared between data directories, e.g. on a cluster"
+    " filesystem",
+    envvar="ALPHAFOLD_DATA_CACHE",
+    type=click.Path(file_okay=False),
+)
+@click.option(
+    "--discover/--no-discover",
+    help="Look up the latest upstream versions instead of using the pinned"
+    " ones (default: for update and download; other commands use the versions"
+    " found by the last lookup)",
+    default=None,
+)
+@click.option(
+    "--scripts-url",
+    help="Location of AlphaFold's download scripts, used to discover versions",
+    envvar="ALPHAFOLD_SCRIPTS_URL",
+    default=SCRIPTS_URL,
+    show_default=True,
+)
 @click.pass_context
-def main(ctx, data_dir):
+def main(
+    ctx,
+    data_dir,
+    jobs,
+    decompress_jobs,
+    network_limit,
+    disk_limit,
+    threads,
+    fasta_shards,
+    per_host,
+    metrics_file,
+    downloader,
+    cache_dir,
+    discover,
+    scripts_url,
+):
     """Shared parameters"""
     ctx.ensure_object(dict)
 
@@ -31,14 +159,75 @@ def main(ctx, data_dir):
     if not Path(data_dir).is_dir():
         logging.error(f"does not exist or not a directory: {data_dir}")
         return 1
-    ctx.obj["data"] = AFData(data_dir)
+    offline = False
+    if discover is None:
+        discover = True
+        offline = ctx.invoked_subcommand not in _DISCOVERING
+    ctx.obj["data"] = AFData(
+        data_dir,
+        jobs=jobs,
+        decompress_jobs=decompress_jobs,
+        network_limit=network_limit,
+        disk_limit=disk_limit,
+        threads=threads,
+        fasta_shards=fasta_shards,
+        per_host=per_host,
+        metrics_file=metrics_file,
+        downloader=downloader,
+        cache_dir=cache_dir,
+        discover=discover,
+        discover_offline=offline,
+        scripts_url=scripts_url,
+    )
 
 
 @main.command(help="Combine all steps")
+@click.option(
+    "--stream/--no-stream",
+    help="Decompress while downloading instead of staging compressed files",
+    default=False,
+    show_default=True,
+)
+@click.option(
+    "--keep-compressed/--no-keep-compressed",
+    help="With --stream, also save the compressed files",
+    default=True,
+    show_default=True,
+)
+@click.option(
+    "--dedup/--no-dedup",
+    help="Deduplicate identical files across versions afterwards",
+    default=False,
+    show_default=True,
+)
+@click.option(
+    "--prune/--no-prune",
+    help="Delete each compressed file as soon as it is extracted",
+    default=False,
+    show_default=True,
+)
+@click.option(
+    "--disk-budget",
+    help="Maximum disk space to use, e.g. 2T (default: the free space)",
+    callback=_size,
+)
+@click.option(
+    "--allow-unknown/--no-allow-unknown",
+    help="Start even if the size of some database is unknown",
+    default=False,
+    show_default=True,
+)
 @click.pass_context
-def update(ctx):
+def update(ctx, stream, keep_compressed, dedup, prune, disk_budget, allow_unknown):
     afd = ctx.obj["data"]
-    if afd.update():
+    if afd.update(
+        stream=stream,
+        keep_compressed=keep_compressed,
+        dedup=dedup,
+        prune=prune,
+        disk_budget=disk_budget,
+        allow_unknown=allow_unknown,
+    ):
         return 0
     else:
         return 1
@@ -55,6 +244,21 @@ def download(ctx):
         return 1
 
 
+@main.command(help="Check compressed files against expected checksums")
+@click.option(
+    "--full",
+    is_flag=True,
+    help="Re-hash all files instead of trusting the manifest for unchanged files",
+)
+@click.pass_context
+def verify(ctx, full):
+    afd = ctx.obj["data"]
+    if afd.verify(full=full):
+        return 0
+    else:
+        return 1
+
+
 @main.command(help="Decompress files")
 @click.pass_context
 def decompress(ctx):
@@ -65,7 +269,38 @@ def decompress(ctx):
         return 1
 
 
-@main.command(help="Clean up compressed data")
+@main.command(help="Check extracted HH-suite databases (PDB70, UniRef30)")
+@click.option(
+    "--full",
+    is_flag=True,
+    help="Re-check databases which passed before",
+)
+@click.pass_context
+def validate(ctx, full):
+    afd = ctx.obj["data"]
+    if afd.validate(full=full):
+        return 0
+    else:
+        return 1
+
+
+@main.command(help="Rewrite compressed files as seekable zstd (needs zstandard)")
+@click.option(
+    "--remove-original/--keep-original",
+    help="Delete the original compressed files afterwards",
+    default=False,
+    show_default=True,
+)
+@click.pass_context
+def transcode(ctx, remove_original):
+    afd = ctx.obj["data"]
+    if afd.transcode(remove=remove_original):
+        return 0
+    else:
+        return 1
+
+
+@main.command(help="Delete compressed files which have been extracted")
 @click.pass_context
 def prune(ctx):
     afd = ctx.obj["data"]
@@ -75,21 +310,73 @@ def prune(ctx):
         return 1
 
 
+@main.command(help="Deduplicate identical files across versions")
+@click.pass_context
+def dedup(ctx):
+    afd = ctx.obj["data"]
+    logging.info(afd.dedup())
+    return 0
+
+
 @main.command(help="Link new version")
+@click.option("--name", help="Version name (default: today's date)")
+@click.option(
+    "--warm/--no-warm",
+    help="Load the databases into the page cache afterwards (see 'warm')",
+    default=False,
+    show_default=True,
+)
 @click.pass_context
-def link(ctx):
+def link(ctx, name, warm):
     afd = ctx.obj["data"]
-    if afd.link():
-        return 0
-    else:
+    if not afd.link(name=name):
         return 1
+    if warm:
+        afd.warm()
+    return 0
+
+
+@main.command(help="Load databases into the page cache")
+@click.option(
+    "--db",
+    "names",
+    multiple=True,
+    help="Database to load, most important first; repeatable (default: all)",
+)
+@click.option(
+    "--memory-budget",
+    help="Maximum memory to fill, e.g. 64G (default: half the available memory)",
+    callback=_size,
+)
+@click.pass_context
+def warm(ctx, names, memory_budget):
+    afd = ctx.obj["data"]
+    try:
+        afd.warm(names or None, budget=memory_budget)
+        logging.info(afd.residency(names or None))
+    except ValueError as err:
+        raise click.BadParameter(str(err), param_hint="--db")
+    return 0
+
+
+@main.command(help="Report how much of each database is in the page cache")
+@click.pass_context
+def residency(ctx):
+    afd = ctx.obj["data"]
+    logging.info(afd.residency())
+    return 0
 
 
 @main.command(help="Summarize installation status")
+@click.option(
+    "--deep",
+    is_flag=True,
+    help="Re-check the filesystem instead of trusting the state database",
+)
 @click.pass_context
-def status(ctx):
+def status(ctx, deep):
     afd = ctx.obj["data"]
-    logging.info(afd.status())
+    logging.info(afd.status(deep=deep))
     return 0
 
 
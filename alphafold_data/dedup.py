@@ -0,0 +1,212 @@
+"""Deduplicate identical files across uncompressed versions
+
+Files under `uncompressed/` are hashed (sha256) and kept in a content-addressed
+store under `store/sha256/`. Duplicates are replaced by reflinks (copy-on-write
+clones) or hardlinks to the store object. Which methods work is remembered per
+filesystem, so e.g. hardlinks are used directly once reflinks failed on a
+device.
+
+Store objects are read-only, since writing to a hardlinked file in place would
+change every version sharing it. Extraction replaces files instead.
+
+Only files whose size matches another file (or a store object) are hashed.
+Digests are cached in the manifest, so unchanged files aren't re-read.
+"""
+
+import errno
+import fcntl
+import logging
+import os
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Dict, List, Sequence, Set, Tuple
+
+from .checksum import Manifest, hash_file
+from .untar import JOURNAL_NAME
+
+STORE_DIR = Path("store/sha256")
+METHODS = ("reflink", "hardlink")
+
+# Mode of store objects (and so of files hardlinked to them)
+_READ_ONLY = 0o444
+# Smaller files aren't worth the bookkeeping
+_MIN_SIZE = 64 << 10
+# ioctl to clone a file on btrfs/xfs
+_FICLONE = 0x40049409
+# errors meaning "this method doesn't work on this filesystem"
+_UNSUPPORTED = {errno.EXDEV, errno.EOPNOTSUPP, errno.ENOTTY, errno.EINVAL, errno.EPERM}
+
+
+@dataclass
+class DedupReport:
+    """Result of a dedup pass
+
+    Attributes:
+    - files: number of files considered
+    - hashed: number of files which had to be hashed
+    - duplicates: number of files replaced by a link
+    - bytes_saved: total size of the replaced files
+    - methods: number of files replaced by each method
+    """
+
+    files: int = 0
+    hashed: int = 0
+    duplicates: int = 0
+    bytes_saved: int = 0
+    methods: Dict[str, int] = field(default_factory=dict)
+
+    def __str__(self) -> str:
+        methods = ", ".join(f"{n} {m}" for m, n in sorted(self.methods.items()))
+        return (
+            f"{self.duplicates} of {self.files} files deduplicated"
+            f" ({methods or 'none'}), {self.bytes_saved / 1e9:.2f} GB saved"
+        )
+
+
+def _reflink(src: Path, dst: Path) -> None:
+    with src.open("rb") as s, dst.open("wb") as d:
+        fcntl.ioctl(d.fileno(), _FICLONE, s.fileno())
+
+
+def _hardlink(src: Path, dst: Path) -> None:
+    os.link(src, dst)
+
+
+_LINKERS = {"reflink": _reflink, "hardlink": _hardlink}
+
+
+class _Linker:
+    "Replace files by links, remembering which methods fail on which device"
+
+    def __init__(self, methods: Sequence[str]):
+        self.methods = list(methods)
+        self.unsupported: Set[Tuple[int, str]] = set()
+
+    def link(self, src: Path, dst: Path) -> str:
+        """Atomically replace dst by a link to src
+
+        Returns:
+            the method used, or "" if none worked
+        """
+        device = dst.parent.stat().st_dev
+        tmp = dst.with_name(dst.name + ".dedup")
+        for method in self.methods:
+            if (device, method) in self.unsupported:
+                continue
+            try:
+                _LINKERS[method](src, tmp)
+            except OSError as err:
+                if tmp.exists():
+                    tmp.unlink()
+                if err.errno not in _UNSUPPORTED:
+                    raise
+                logging.debug(f"{method} not supported for {dst}: {err}")
+                self.unsupported.add((device, method))
+                continue
+            os.replace(tmp, dst)
+            return method
+        return ""
+
+
+def _scan(root: Path) -> List[Path]:
+    files = []
+    for dirpath, _dirnames, filenames in os.walk(root):
+        if JOURNAL_NAME in filenames:
+            continue  # extraction in progress
+        for name in filenames:
+            path = Path(dirpath, name)
+            if name.endswith(".partial") or path.is_symlink():
+                continue
+            files.append(path)
+    return files
+
+
+def dedup(
+    data_dir: Path, jobs: int = 4, methods: Sequence[str] = METHODS
+) -> DedupReport:
+    """Deduplicate files under data_dir/uncompressed
+
+    Args:
+    - data_dir: install directory
+    - jobs: number of files hashed in parallel
+    - methods: link methods to try, in order ("reflink", "hardlink")
+    """
+    data_dir = Path(data_dir)
+    store = data_dir / STORE_DIR
+    report = DedupReport()
+
+    files = _scan(data_dir / "uncompressed")
+    report.files = len(files)
+    stats = {path: path.stat() for path in files}
+    stored = {
+        path.name: path.stat().st_size
+        for path in store.glob("*/*")
+        if len(path.name) == 64
+    }
+
+    by_size: Dict[int, List[Path]] = defaultdict(list)
+    for path, stat in stats.items():
+        if stat.st_size >= _MIN_SIZE:
+            by_size[stat.st_size].append(path)
+    stored_sizes = set(stored.values())
+    candidates = [
+        path
+        for size, paths in by_size.items()
+        for path in paths
+        if len(paths) > 1 or size in stored_sizes
+    ]
+
+    # hash candidates, reusing cached digests
+    manifest = Manifest(data_dir)
+    relpaths = {path: path.relative_to(data_dir) for path in candidates}
+    cached = manifest.get_many(relpaths.values())
+    digests: Dict[Path, str] = {}
+    to_hash = []
+    for path, relpath in relpaths.items():
+        if relpath in cached and "sha256" in cached[relpath]:
+            digests[path] = cached[relpath]["sha256"]
+        else:
+            to_hash.append(path)
+    with ThreadPoolExecutor(jobs) as pool:
+        hashed = dict(zip(to_hash, pool.map(hash_file, to_hash)))
+    report.hashed = len(hashed)
+    manifest.record_many({relpaths[p]: d for p, d in hashed.items()})
+    digests.update((path, d["sha256"]) for path, d in hashed.items())
+
+    by_digest: Dict[str, List[Path]] = defaultdict(list)
+    for path in candidates:
+        by_digest[digests[path]].append(path)
+
+    linker = _Linker(methods)
+    relinked = {}
+    for digest, paths in by_digest.items():
+        obj = store / digest[:2] / digest
+        if digest not in stored:
+            if len(paths) < 2:
+                continue
+            # the first copy becomes the store object
+            obj.parent.mkdir(parents=True, exist_ok=True)
+            if not linker.link(paths[0], obj):
+                continue
+            paths = paths[1:]
+        obj_stat = obj.stat()
+        if obj_stat.st_mode & 0o777 != _READ_ONLY:
+            os.chmod(obj, _READ_ONLY)
+        for path in paths:
+            stat = stats[path]
+            if (stat.st_dev, stat.st_ino) == (obj_stat.st_dev, obj_stat.st_ino):
+                continue  # already a hardlink to the store
+            method = linker.link(obj, path)
+            if not method:
+                continue
+            if method == "reflink":
+                os.chmod(path, stat.st_mode & 0o7777)
+            relinked[relpaths[path]] = {"sha256": digest}
+            report.duplicates += 1
+            report.methods[method] = report.methods.get(method, 0) + 1
+            report.bytes_saved += stat.st_size
+    manifest.record_many(relinked)
+    logging.info(f"dedup: {report}")
+    return report
@@ -0,0 +1,222 @@
+"""Discovery of the latest upstream versions
+
+Versions are resolved from the download scripts in DeepMind's AlphaFold
+repository (the same source `latest_sources` is maintained from by hand), and
+from UniProt's release notes. All of these are fetched with conditional
+requests (If-None-Match / If-Modified-Since) against a cache in the metadata
+directory, so checking for updates normally costs a handful of 304 responses.
+
+If a lookup fails, the cached response is used, or else the pinned version
+from `latest_sources`. Offline lookups only use the cache, so commands which
+don't download anything see the versions found by the last update without
+sending any requests.
+"""
+
+import json
+import logging
+import re
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Callable, Dict, Optional
+
+from .locking import exclusive
+from .sources import (
+    UNIPROT_URL,
+    MgnifySource,
+    ParamSource,
+    PDB70Source,
+    Source,
+    Uniclust30Source,
+    UniprotSource,
+    latest_sources,
+)
+from .util import atomic_write_text, metadata_dir
+
+SCRIPTS_URL = "https://raw.githubusercontent.com/google-deepmind/alphafold/main/scripts"
+CACHE_NAME = "discovery.json"
+
+_TIMEOUT = 30
+
+
+class DiscoveryError(IOError):
+    "A version could not be determined"
+
+
+class ConditionalCache:
+    """Small text documents, revalidated with conditional requests
+
+    Entries are stored in a JSON file with the body, ETag, Last-Modified and
+    time of the last check.
+    """
+
+    _lock = threading.Lock()
+
+    def __init__(self, data_dir: Path):
+        self.data_dir = data_dir
+        self.path = metadata_dir(data_dir) / CACHE_NAME
+
+    def _load(self) -> Dict[str, Dict]:
+        try:
+            return json.loads(self.path.read_text())
+        except (FileNotFoundError, ValueError):
+            return {}
+
+    def _store(self, url: str, entry: Dict) -> None:
+        with self._lock, exclusive(self.data_dir, "discovery"):
+            entries = self._load()
+            entries[url] = entry
+            atomic_write_text(self.path, json.dumps(entries, indent=1))
+
+    def cached(self, url: str) -> str:
+        """Contents of url when it was last fetched
+
+        Raises:
+            DiscoveryError if url isn't cached
+        """
+        with self._lock:
+            entry = self._load().get(url)
+        if entry is None:
+            raise DiscoveryError(f"{url} not cached")
+        return entry["body"]
+
+    def fetch(self, url: str) -> str:
+        """Current contents of url
+
+        Falls back to the cached copy if the server can't be reached.
+
+        Raises:
+            DiscoveryError if url is neither reachable nor cached
+        """
+        with self._lock:
+            entry = self._load().get(url)
+        headers = {}
+        if entry is not None:
+            if entry.get("etag"):
+                headers["If-None-Match"] = entry["etag"]
+            if entry.get("last_modified"):
+                headers["If-Modified-Since"] = entry["last_modified"]
+        request = urllib.request.Request(url, headers=headers)
+        try:
+            with urllib.request.urlopen(request, timeout=_TIMEOUT) as response:
+                entry = {
+                    "body": response.read().decode(errors="replace"),
+                    "etag": response.headers.get("ETag", ""),
+                    "last_modified": response.headers.get("Last-Modified", ""),
+                }
+        except urllib.error.HTTPError as err:
+            if err.code != 304 or entry is None:
+                return self._stale(url, entry, err)
+            logging.debug(f"{url} not modified")
+        except OSError as err:
+            return self._stale(url, entry, err)
+        entry["checked"] = time.time()
+        self._store(url, entry)
+        return entry["body"]
+
+    @staticmethod
+    def _stale(url: str, entry: Optional[Dict], err: BaseException) -> str:
+        if entry is None:
+            raise DiscoveryError(f"Unable to fetch {url}: {err}")
+        logging.warning(f"Unable to fetch {url}, using the cached copy: {err}")
+        return entry["body"]
+
+
+def _search(pattern: str, text: str, url: str) -> "re.Match":
+    match = re.search(pattern, text)
+    if match is None:
+        raise DiscoveryError(f"No match for {pattern!r} in {url}")
+    return match
+
+
+# Resolvers, by source name. Each gets a fetch function, the scripts URL and
+# the UniProt URL, and returns the latest Source.
+Resolver = Callable[[Callable[[str], str], str, str], Source]
+
+
+def _params(fetch: Callable[[str], str], scripts: str, uniprot: str) -> Source:
+    url = f"{scripts}/download_alphafold_params.sh"
+    match = _search(r"alphafold_params_([\w-]+)\.tar", fetch(url), url)
+    return ParamSource(match.group(1))
+
+
+def _mgnify(fetch: Callable[[str], str], scripts: str, uniprot: str) -> Source:
+    url = f"{scripts}/download_mgnify.sh"
+    match = _search(
+        r"alphafold-databases/([\w.]+)/mgy_clusters_(\w+)\.fa", fetch(url), url
+    )
+    return MgnifySource(match.group(2), alphafold_version=match.group(1))
+
+
+def _pdb70(fetch: Callable[[str], str], scripts: str, uniprot: str) -> Source:
+    url = f"{scripts}/download_pdb70.sh"
+    match = _search(r"pdb70_from_mmcif_(\w+)\.tar\.gz", fetch(url), url)
+    return PDB70Source(match.group(1))
+
+
+def _uniref30(fetch: Callable[[str], str], scripts: str, uniprot: str) -> Source:
+    url = f"{scripts}/download_uniref30.sh"
+    match = _search(
+        r"alphafold-databases/([\w.]+)/UniRef30_(\w+)\.tar\.gz", fetch(url), url
+    )
+    return Uniclust30Source(match.group(2), alphafold_version=match.group(1))
+
+
+def _uniprot(fetch: Callable[[str], str], scripts: str, uniprot: str) -> Source:
+    url = f"{uniprot}/reldate.txt"
+    match = _search(r"Release (\d+_\d+)", fetch(url), url)
+    return UniprotSource(match.group(1), url_base=uniprot)
+
+
+RESOLVERS: Dict[str, Resolver] = {
+    "params": _params,
+    "mgnify": _mgnify,
+    "pdb70": _pdb70,
+    "uniprot": _uniprot,
+    "uniref30": _uniref30,
+}
+
+
+def discover_sources(
+    data_dir: Path,
+    scripts_url: str = SCRIPTS_URL,
+    uniprot_url: str = UNIPROT_URL,
+    offline=False,
+) -> Dict[str, Source]:
+    """Latest version of every source
+
+    Sources without a resolver (BFD, which is not updated, and the weekly
+    mmCIF snapshots) keep their pinned versions. Only sources pinned in
+    `latest_sources` are looked up, so discovery never adds a database (e.g.
+    UniProt, which is left out on purpose). Lookups run in parallel.
+
+    Args:
+    - data_dir: install directory, holding the cache
+    - scripts_url: location of AlphaFold's download scripts
+    - uniprot_url: location of the current UniProt release
+    - offline: only use cached documents, sending no requests
+    """
+    cache = ConditionalCache(data_dir)
+    fetch = cache.cached if offline else cache.fetch
+    sources = latest_sources()
+
+    def resolve(name: str) -> Optional[Source]:
+        try:
+            return RESOLVERS[name](fetch, scripts_url, uniprot_url)
+        except DiscoveryError as err:
+            if offline:
+                logging.debug(f"Using the pinned {name}: {err}")
+            else:
+                logging.warning(f"Unable to discover the latest {name}: {err}")
+            return None
+
+    names = [name for name in RESOLVERS if name in sources]
+    with ThreadPoolExecutor(max(1, len(names))) as pool:
+        found = dict(zip(names, pool.map(resolve, names)))
+    for name, source in found.items():
+        if source is not None:
+            sources[name] = source
+    return sources
@@ -0,0 +1,219 @@
+"""Execution engine for external tools
+
+External tools (curl, aria2c, rsync, tar) are run by an asyncio event loop
+on a background thread, so any number of them can be in flight while the
+calling threads simply wait for their own. The engine provides:
+
+- back-pressure: each stage has a kind, "network" or "disk", with its own
+  limit on concurrent processes, so downloads and extractions overlap
+  without either saturating its resource. In-process work (e.g. Python
+  gunzip) takes the same slots with `slot`.
+- logging: stdout and stderr are streamed line by line into the log (debug
+  level), and the end of stderr is kept for error reports.
+- cancellation: `cancel` terminates every running process, and a caller
+  interrupted while waiting terminates its own.
+
+`run` is a drop-in for `subprocess.run(cmd).check_returncode()` style code:
+it returns a CompletedProcess whose `stderr` holds the last lines of output.
+"""
+
+import asyncio
+import logging
+import re
+import subprocess
+import threading
+from collections import deque
+from contextlib import contextmanager
+from typing import Deque, Dict, Iterator, List, Optional, Set
+
+NETWORK = "network"
+DISK = "disk"
+
+# Lines of stderr kept for error messages
+_TAIL_LINES = 20
+# Seconds between SIGTERM and SIGKILL on cancellation
+_KILL_GRACE = 10.0
+
+
+class Engine:
+    """Runs subprocesses on a shared event loop
+
+    Args:
+    - network: maximum concurrent network-bound processes
+    - disk: maximum concurrent disk-bound stages
+    """
+
+    def __init__(self, network: int = 4, disk: int = 2):
+        self.limits = {NETWORK: network, DISK: disk}
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._semaphores: Dict[str, asyncio.Semaphore] = {}
+        self._procs: Set[subprocess.Popen] = set()
+        self._lock = threading.Lock()
+
+    def configure(self, network: Optional[int] = None, disk: Optional[int] = None):
+        "Change the limits. Only affects stages started afterwards."
+        with self._lock:
+            if network is not None:
+                self.limits[NETWORK] = network
+            if disk is not None:
+                self.limits[DISK] = disk
+            self._semaphores = {}
+
+    def _ensure_loop(self) -> asyncio.AbstractEventLoop:
+        with self._lock:
+            if self._loop is None:
+                loop = asyncio.new_event_loop()
+                thread = threading.Thread(
+                    target=loop.run_forever, name="afd-engine", daemon=True
+                )
+                thread.start()
+                self._loop = loop
+            return self._loop
+
+    async def _semaphore(self, kind: str) -> asyncio.Semaphore:
+        # created on the loop, as older Pythons bind semaphores to a loop
+        with self._lock:
+            if kind not in self._semaphores:
+                self._semaphores[kind] = asyncio.Semaphore(self.limits[kind])
+            return self._semaphores[kind]
+
+    async def _pump(self, pipe, name: str, tail: Optional[Deque[str]]) -> None:
+        "Log a pipe line by line (progress meters use \\r)"
+        loop = asyncio.get_event_loop()
+        reader = asyncio.StreamReader()
+        transport, _ = await loop.connect_read_pipe(
+            lambda: asyncio.StreamReaderProtocol(reader), pipe
+        )
+        pending = b""
+        try:
+            while True:
+                data = await reader.read(1 << 16)
+                if not data:
+                    break
+                *lines, pending = re.split(rb"[\r\n]", pending + data)
+                for line in lines:
+                    text = line.decode(errors="replace").rstrip()
+                    if text:
+                        logging.debug(f"{name}: {text}")
+                        if tail is not None:
+                            tail.append(text)
+            if pending.strip():
+                text = pending.decode(errors="replace").rstrip()
+                logging.debug(f"{name}: {text}")
+                if tail is not None:
+                    tail.append(text)
+        finally:
+            transport.close()
+
+    async def _exec(self, cmd: List[str], kind: str) -> subprocess.CompletedProcess:
+        name = cmd[0].rsplit("/", 1)[-1]
+        tail: Deque[str] = deque(maxlen=_TAIL_LINES)
+        loop = asyncio.get_event_loop()
+        async with await self._semaphore(kind):
+            logging.debug("Running: " + " ".join(cmd))
+            # Popen and a waiting thread rather than create_subprocess_exec,
+            # which needs a child watcher bound to the main thread before 3.8
+            proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+            self._procs.add(proc)
+            try:
+                pumps = asyncio.gather(
+                    self._pump(proc.stdout, name, None),
+                    self._pump(proc.stderr, name, tail),
+                )
+                returncode = await loop.run_in_executor(None, proc.wait)
+                await pumps
+            except asyncio.CancelledError:
+                await loop.run_in_executor(None, _terminate, proc)
+                raise
+            finally:
+                self._procs.discard(proc)
+        return subprocess.CompletedProcess(cmd, returncode, None, "\n".join(tail))
+
+    def run(self, cmd: List[str], kind: str = DISK) -> subprocess.CompletedProcess:
+        """Run cmd and wait for it
+
+        Blocks until a slot of the given kind is free and the process exits.
+
+        Raises:
+            FileNotFoundError if the executable doesn't exist
+        """
+        future = asyncio.run_coroutine_threadsafe(
+            self._exec(cmd, kind), self._ensure_loop()
+        )
+        try:
+            return future.result()
+        except BaseException:
+            future.cancel()
+            raise
+
+    @contextmanager
+    def slot(self, kind: str = DISK) -> Iterator[None]:
+        "Hold a slot of kind for in-process work"
+        loop = self._ensure_loop()
+        held: List[asyncio.Semaphore] = []
+        abandoned = False
+
+        async def acquire() -> asyncio.Semaphore:
+            semaphore = await self._semaphore(kind)
+            await semaphore.acquire()
+            if abandoned:
+                semaphore.release()
+            else:
+                held.append(semaphore)
+            return semaphore
+
+        def abandon() -> None:
+            # runs on the loop, so it can't interleave with acquire: either the
+            # slot was granted and is handed back, or the request is cancelled
+            nonlocal abandoned
+            abandoned = True
+            if held:
+                held.pop().release()
+            else:
+                future.cancel()
+
+        future = asyncio.run_coroutine_threadsafe(acquire(), loop)
+        try:
+            semaphore = future.result()
+        except BaseException:
+            # interrupted while waiting
+            loop.call_soon_threadsafe(abandon)
+            raise
+        try:
+            yield
+        finally:
+            loop.call_soon_threadsafe(semaphore.release)
+
+    def cancel(self) -> None:
+        "Terminate all running processes"
+        for proc in list(self._procs):
+            _terminate(proc)
+
+
+def _terminate(proc: subprocess.Popen) -> None:
+    if proc.poll() is not None:
+        return
+    proc.terminate()
+    try:
+        proc.wait(_KILL_GRACE)
+    except subprocess.TimeoutExpired:
+        proc.kill()
+        proc.wait()
+
+
+_engine = Engine()
+
+
+def default_engine() -> Engine:
+    "The engine shared by all sources"
+    return _engine
+
+
+def run(cmd: List[str], kind: str = DISK) -> subprocess.CompletedProcess:
+    "Run cmd on the default engine, see `Engine.run`"
+    return _engine.run(cmd, kind)
+
+
+def slot(kind: str = DISK):
+    "Hold a slot of the default engine, see `Engine.slot`"
+    return _engine.slot(kind)
@@ -0,0 +1,266 @@
+"""Offset index for large FASTA files
+
+The index maps record IDs (the first word of the header line) to the byte
+offset and length of the record. It is built from the decompressed data as it
+is written (see `FastaIndexer`), so indexing doesn't need another pass over
+the file, and saved next to the FASTA as `<name>.afdidx`.
+
+The index file is a small header followed by fixed-size records
+`(key, offset, length)`, sorted by key. Keys are 64-bit hashes of the IDs;
+collisions are resolved by checking the header line in the FASTA. Large
+inputs are sorted in runs which are spilled to disk and merged.
+
+`FastaIndex` memory-maps both files and looks records up by binary search.
+The header stores the size and mtime of the FASTA, so a stale index is
+detected and rebuilt.
+"""
+
+import hashlib
+import heapq
+import logging
+import mmap
+import os
+import struct
+import tempfile
+from pathlib import Path
+from typing import BinaryIO, Iterator, List, Optional, Tuple
+
+INDEX_SUFFIX = ".afdidx"
+
+_MAGIC = b"AFDIDX01"
+_HEADER = struct.Struct("<8sQQQ")  # magic, fasta size, fasta mtime_ns, count
+_RECORD = struct.Struct("<QQQ")  # key, offset, length
+# Records kept in memory before a sorted run is spilled to disk
+_RUN_RECORDS = 1 << 20
+# Only the start of a header line is kept; IDs are short
+_MAX_HEADER = 4096
+_CHUNK_SIZE = 16 << 20
+
+Record = Tuple[int, int, int]
+
+
+def index_path(fasta: Path) -> Path:
+    return fasta.with_name(fasta.name + INDEX_SUFFIX)
+
+
+def _key(record_id: bytes) -> int:
+    return int.from_bytes(hashlib.blake2b(record_id, digest_size=8).digest(), "little")
+
+
+def _record_id(header: bytes) -> bytes:
+    "ID from a header line, without the leading >"
+    words = header.split(maxsplit=1)
+    return words[0] if words else b""
+
+
+def _read_run(f: BinaryIO) -> Iterator[Record]:
+    while True:
+        data = f.read(_RECORD.size * 4096)
+        if not data:
+            return
+        yield from _RECORD.iter_unpack(data)
+
+
+class FastaIndexer:
+    """Collect record offsets from FASTA data written in arbitrary chunks
+
+    Pass `write` as a tee to the decompressor, then call `save` once the
+    FASTA is complete.
+    """
+
+    def __init__(self) -> None:
+        self.offset = 0
+        self._last_newline = True
+        self._header: Optional[bytearray] = None
+        self._start = -1
+        self._key = 0
+        self._records: List[Record] = []
+        self._runs: List[BinaryIO] = []
+        self.count = 0
+
+    def write(self, data: bytes) -> None:
+        pos = 0
+        if self._header is not None:
+            pos = self._finish_header(data, 0)
+        elif self._last_newline and data[:1] == b">":
+            pos = self._start_record(data, 0)
+        while pos >= 0:
+            hit = data.find(b"\n>", pos)
+            if hit < 0:
+                break
+            pos = self._start_record(data, hit + 1)
+        self.offset += len(data)
+        if data:
+            self._last_newline = data[-1:] == b"\n"
+
+    def _start_record(self, data: bytes, start: int) -> int:
+        self._close(self.offset + start)
+        self._start = self.offset + start
+        self._header = bytearray()
+        return self._finish_header(data, start + 1)
+
+    def _finish_header(self, data: bytes, pos: int) -> int:
+        "Position of the end of the header line, or -1 if it isn't in data"
+        assert self._header is not None
+        end = data.find(b"\n", pos)
+        if len(self._header) < _MAX_HEADER:
+            self._header += data[pos : end if end >= 0 else len(data)]
+        if end < 0:
+            return -1
+        self._key = _key(_record_id(bytes(self._header[:_MAX_HEADER])))
+        self._header = None
+        return end
+
+    def _close(self, end: int) -> None:
+        if self._start < 0:
+            return
+        self._records.append((self._key, self._start, end - self._start))
+        self.count += 1
+        if len(self._records) >= _RUN_RECORDS:
+            self._spill()
+
+    def _spill(self) -> None:
+        self._records.sort()
+        run = tempfile.TemporaryFile()
+        for record in self._records:
+            run.write(_RECORD.pack(*record))
+        run.seek(0)
+        self._runs.append(run)
+        self._records = []
+
+    def save(self, fasta: Path) -> Path:
+        """Write the index for the completed FASTA file
+
+        Returns the path of the index.
+        """
+        if self._header is not None:
+            self._finish_header(b"\n", 0)
+        self._close(self.offset)
+        self._start = -1
+        stat = fasta.stat()
+        if stat.st_size != self.offset:
+            raise ValueError(
+                f"{fasta} has {stat.st_size} bytes, but {self.offset} were indexed"
+            )
+        self._records.sort()
+        dst = index_path(fasta)
+        tmp = dst.with_name(dst.name + ".partial")
+        try:
+            with tmp.open("wb") as out:
+                out.write(
+                    _HEADER.pack(_MAGIC, stat.st_size, stat.st_mtime_ns, self.count)
+                )
+                records = heapq.merge(self._records, *map(_read_run, self._runs))
+                for record in records:
+                    out.write(_RECORD.pack(*record))
+        finally:
+            for run in self._runs:
+                run.close()
+            self._runs = []
+        tmp.rename(dst)
+        logging.info(f"Indexed {self.count} records of {fasta}")
+        return dst
+
+
+def build_index(fasta: Path) -> Path:
+    "Index an existing FASTA file"
+    indexer = FastaIndexer()
+    with fasta.open("rb") as f:
+        for data in iter(lambda: f.read(_CHUNK_SIZE), b""):
+            indexer.write(data)
+    return indexer.save(fasta)
+
+
+def index_current(fasta: Path) -> bool:
+    "Check whether the index of fasta exists and matches the file"
+    try:
+        with index_path(fasta).open("rb") as f:
+            header = f.read(_HEADER.size)
+        stat = fasta.stat()
+    except FileNotFoundError:
+        return False
+    if len(header) != _HEADER.size:
+        return False
+    magic, size, mtime_ns, _count = _HEADER.unpack(header)
+    return magic == _MAGIC and (size, mtime_ns) == (stat.st_size, stat.st_mtime_ns)
+
+
+def ensure_index(fasta: Path) -> Path:
+    "Build the index of fasta, unless it is up to date"
+    if not index_current(fasta):
+        logging.info(f"Index of {fasta} is missing or outdated, rebuilding")
+        build_index(fasta)
+    return index_path(fasta)
+
+
+def _mmap(path: Path) -> Optional[mmap.mmap]:
+    with path.open("rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return None
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+class FastaIndex:
+    """Random access to the records of an indexed FASTA file
+
+    The index is (re)built first if it is missing or outdated. Both files are
+    memory-mapped, so only the pages needed for a lookup are read.
+    """
+
+    def __init__(self, fasta: Path):
+        self.fasta = Path(fasta)
+        ensure_index(self.fasta)
+        index = _mmap(index_path(self.fasta))
+        assert index is not None  # there is always a header
+        self._index: mmap.mmap = index
+        self._data = _mmap(self.fasta)
+        self.count = _HEADER.unpack_from(self._index)[3]
+
+    def close(self) -> None:
+        self._index.close()
+        if self._data is not None:
+            self._data.close()
+
+    def __enter__(self) -> "FastaIndex":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def __len__(self) -> int:
+        return self.count
+
+    def _record(self, i: int) -> Record:
+        return _RECORD.unpack_from(self._index, _HEADER.size + i * _RECORD.size)
+
+    def get(self, record_id: str) -> Optional[bytes]:
+        "The record (header line and sequence), or None if not found"
+        raw_id = record_id.encode()
+        key = _key(raw_id)
+        lo, hi = 0, self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._record(mid)[0] < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        assert self._data is not None or self.count == 0
+        for i in range(lo, self.count):
+            found, offset, length = self._record(i)
+            if found != key:
+                break
+            assert self._data is not None
+            end = self._data.find(b"\n", offset, offset + length)
+            header = self._data[offset + 1 : end if end >= 0 else offset + length]
+            if _record_id(header) == raw_id:
+                return self._data[offset : offset + length]
+        return None
+
+    def __getitem__(self, record_id: str) -> bytes:
+        record = self.get(record_id)
+        if record is None:
+            raise KeyError(record_id)
+        return record
+
+    def __contains__(self, record_id: str) -> bool:
+        return self.get(record_id) is not None
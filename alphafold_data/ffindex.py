@@ -0,0 +1,233 @@
+"""Consistency checks of HH-suite databases
+
+HH-suite databases (PDB70, UniRef30) are pairs of files: `.ffdata` holds the
+records, each terminated by a NUL byte, and `.ffindex` lists one record per
+line as `name<TAB>offset<TAB>length`, sorted by name so that records can be
+looked up by binary search. A truncated ffdata or an unsorted ffindex only
+shows up when hhblits fails in the middle of a run, so `validate` checks
+every entry against the memory-mapped ffdata:
+
+- the record lies within the ffdata
+- its last byte is the NUL terminator
+
+Index files which aren't sorted are rewritten sorted. Pairs are checked in
+parallel, each index in blocks so that memory use is bounded even for BFD's
+huge indexes. The checks are vectorized with numpy if it is installed (`pip
+install alphafold_data[numpy]`), with a pure Python fallback otherwise.
+"""
+
+import contextlib
+import logging
+import mmap
+import os
+import shutil
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Iterator, List, Sequence, Tuple
+
+try:
+    import numpy  # type: ignore
+except ImportError:  # optional dependency, only for speed
+    numpy = None
+
+# Errors reported per pair; the rest are only counted
+_MAX_ERRORS = 10
+# Index files are checked in blocks of this size
+_CHUNK_SIZE = 4 << 20
+# Larger index files are resorted with sort(1) if possible
+_SORT_IN_MEMORY = 64 << 20
+
+
+class FFIndexError(IOError):
+    "An HH-suite database is inconsistent"
+
+
+@dataclass
+class PairReport:
+    """Result of checking one ffindex/ffdata pair
+
+    Attributes:
+    - ffindex: the index file
+    - entries: number of index entries
+    - errors: descriptions of the first inconsistent entries
+    - invalid: number of inconsistent entries
+    - resorted: whether the index was rewritten sorted
+    """
+
+    ffindex: Path
+    entries: int = 0
+    errors: List[str] = field(default_factory=list)
+    invalid: int = 0
+    resorted: bool = False
+
+    @property
+    def ok(self) -> bool:
+        return not self.invalid
+
+    def __str__(self) -> str:
+        if self.ok:
+            status = "ok, resorted" if self.resorted else "ok"
+        else:
+            status = f"{self.invalid} invalid entries: " + "; ".join(self.errors)
+        return f"{self.ffindex.name}: {self.entries} entries, {status}"
+
+
+def _malformed(path: Path, number: int, lines: List[bytes]) -> FFIndexError:
+    "Error for the first malformed line in lines, which start at line number"
+    for line in lines:
+        fields = line.split(b"\t")
+        if len(fields) != 3 or not (fields[1].isdigit() and fields[2].isdigit()):
+            break
+        number += 1
+    return FFIndexError(f"{path}: malformed line {number}")
+
+
+def _chunks(path: Path) -> Iterator[bytes]:
+    "Blocks of whole lines of path, each ending in a newline"
+    with path.open("rb") as f:
+        rest = b""
+        for block in iter(lambda: f.read(_CHUNK_SIZE), b""):
+            block = rest + block
+            cut = block.rfind(b"\n") + 1
+            if cut:
+                yield block[:cut]
+            rest = block[cut:]
+        if rest:
+            # so that the last line stays separate when lines are reordered
+            yield rest + b"\n"
+
+
+def _parse(path: Path, number: int, chunk: bytes) -> Tuple[List[bytes], Any, Any]:
+    """Names, offsets and lengths of the lines in chunk
+
+    Offsets and lengths are numpy arrays if numpy is installed, lists
+    otherwise.
+    """
+    # split all columns at once instead of line by line
+    fields = chunk[:-1].replace(b"\t", b"\n").split(b"\n")
+    lines = chunk.count(b"\n")
+    if len(fields) != 3 * lines:
+        raise _malformed(path, number, chunk[:-1].split(b"\n"))
+    names, offsets, lengths = fields[0::3], fields[1::3], fields[2::3]
+    del fields
+    if not (all(map(bytes.isdigit, offsets)) and all(map(bytes.isdigit, lengths))):
+        raise _malformed(path, number, chunk[:-1].split(b"\n"))
+    if numpy is not None:
+        return (
+            names,
+            numpy.fromiter(map(int, offsets), numpy.int64, lines),
+            numpy.fromiter(map(int, lengths), numpy.int64, lines),
+        )
+    return names, list(map(int, offsets)), list(map(int, lengths))
+
+
+def _bad_entries(
+    offsets: Sequence[int], lengths: Sequence[int], data: mmap.mmap, size: int
+) -> List[int]:
+    "Indices of entries outside the ffdata or not ending in a NUL byte"
+    if numpy is not None:
+        end = offsets + lengths  # type: ignore
+        inside = (lengths > 0) & (end <= size)  # type: ignore
+        valid = inside.copy()
+        view = numpy.frombuffer(data, dtype=numpy.uint8)
+        valid[inside] = view[end[inside] - 1] == 0
+        return numpy.flatnonzero(~valid).tolist()
+    return [
+        i
+        for i, (offset, length) in enumerate(zip(offsets, lengths))
+        if length <= 0 or offset + length > size or data[offset + length - 1] != 0
+    ]
+
+
+def _sort(path: Path) -> None:
+    "Rewrite an index sorted by name (byte order, as ffindex compares names)"
+    tmp = path.with_name(path.name + ".partial")
+    sort = shutil.which("sort")
+    if sort is not None and path.stat().st_size > _SORT_IN_MEMORY:
+        # sort spills to disk, so memory stays bounded for huge indexes
+        with tmp.open("wb") as out:
+            subprocess.run(
+                [sort, "-s", "-t", "\t", "-k1,1", str(path)],
+                stdout=out,
+                stderr=subprocess.PIPE,
+                env={**os.environ, "LC_ALL": "C"},
+                check=True,
+            )
+    else:
+        lines = [line for chunk in _chunks(path) for line in chunk.splitlines(True)]
+        lines.sort(key=lambda line: line.split(b"\t", 1)[0])
+        tmp.write_bytes(b"".join(lines))
+    os.replace(tmp, path)
+
+
+def validate_pair(ffindex: Path, ffdata: Path, repair=True) -> PairReport:
+    """Check every entry of ffindex against ffdata
+
+    The index is read in blocks, so memory use doesn't grow with its size.
+
+    Args:
+    - repair: rewrite the index sorted by name if it isn't
+
+    Raises:
+        FFIndexError for unparseable index files
+    """
+    report = PairReport(ffindex)
+    size = ffdata.stat().st_size
+    unsorted = False
+    last = b""
+    with ffdata.open("rb") as f, contextlib.ExitStack() as stack:
+        data = None
+        if size:
+            data = stack.enter_context(
+                mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            )
+        for chunk in _chunks(ffindex):
+            names, offsets, lengths = _parse(ffindex, report.entries + 1, chunk)
+            if data is None:
+                bad = list(range(len(names)))
+            else:
+                bad = _bad_entries(offsets, lengths, data, size)
+            report.invalid += len(bad)
+            report.errors += [
+                f"{names[i].decode(errors='replace')} at {offsets[i]}+{lengths[i]}"
+                f" of {size} bytes"
+                for i in bad[: _MAX_ERRORS - len(report.errors)]
+            ]
+            # sorted() is linear on sorted input
+            unsorted = unsorted or last > names[0] or names != sorted(names)
+            last = names[-1]
+            report.entries += len(names)
+    if repair and unsorted:
+        logging.info(f"Sorting {ffindex}")
+        _sort(ffindex)
+        report.resorted = True
+    return report
+
+
+def pairs(directory: Path) -> List[Tuple[Path, Path]]:
+    "The ffindex/ffdata pairs below directory"
+    return [
+        (ffindex, ffindex.with_suffix(".ffdata"))
+        for ffindex in sorted(directory.rglob("*.ffindex"))
+        if ffindex.with_suffix(".ffdata").is_file()
+    ]
+
+
+def validate(directory: Path, repair=True, jobs: int = 4) -> List[PairReport]:
+    """Check all ffindex/ffdata pairs below directory in parallel
+
+    See `validate_pair`. Each of the jobs holds one block of an index
+    (`_CHUNK_SIZE`) in memory, however large the index is.
+
+    Raises:
+        FFIndexError if there are no pairs
+    """
+    found = pairs(directory)
+    if not found:
+        raise FFIndexError(f"No ffindex/ffdata pairs in {directory}")
+    with ThreadPoolExecutor(max(1, min(jobs, len(found)))) as pool:
+        return list(
+            pool.map(lambda pair: validate_pair(pair[0], pair[1], repair), found)
+        )
@@ -0,0 +1,450 @@
+"""Multi-core gunzip
+
+Three backends are available:
+
+- pigz: uses the external `pigz` tool (`PIGZ_EXE`), with separate threads for
+  reading, inflating, writing and checksumming.
+- threaded: in-process. Reading, inflating and writing overlap in different
+  threads (zlib releases the GIL). Files made of independent, indexed blocks
+  (BGZF, as written by `bgzip`) are inflated in parallel on all cores.
+- serial: the single-threaded `gzip` module, mostly as a baseline.
+
+The default is pigz if available, otherwise threaded. It can be overridden
+with the `AFD_GUNZIP` environment variable.
+"""
+
+import gzip
+import logging
+import os
+import queue
+import struct
+import threading
+import time
+import zlib
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
+from dataclasses import dataclass
+from pathlib import Path
+from subprocess import PIPE, CalledProcessError, Popen, run
+from typing import BinaryIO, Callable, Deque, Iterator, List, Optional
+
+from . import telemetry, throttle
+from .engine import DISK
+from .util import remove_path
+
+_BLOCK_SIZE = 16 << 20
+# Maximum number of queued writes before the producer blocks
+_WRITE_AHEAD = 4
+
+Writer = Callable[[bytes], object]
+
+
+@dataclass
+class GunzipStats:
+    """Throughput report for a decompression
+
+    Attributes:
+    - backend: backend name
+    - compressed_bytes: bytes read
+    - uncompressed_bytes: bytes written
+    - seconds: wall time
+    """
+
+    backend: str
+    compressed_bytes: int
+    uncompressed_bytes: int
+    seconds: float
+
+    @property
+    def rate(self) -> float:
+        "Output throughput in MB/s"
+        return self.uncompressed_bytes / 1e6 / max(self.seconds, 1e-9)
+
+    def __str__(self) -> str:
+        return (
+            f"{self.backend}: {self.compressed_bytes} -> {self.uncompressed_bytes}"
+            f" bytes in {self.seconds:.1f}s ({self.rate:.1f} MB/s)"
+        )
+
+
+def _has_pigz():
+    if "PIGZ_EXE" in os.environ:
+        return True
+    try:
+        run(["pigz", "--version"], capture_output=True)
+        return True
+    except FileNotFoundError:
+        return False
+
+
+def _default_threads() -> int:
+    return os.cpu_count() or 1
+
+
+def _inflate_pigz(src: Path, write: Writer, threads: int) -> None:
+    pigz = os.environ.get("PIGZ_EXE", "pigz")
+    cmd = [pigz, "-d", "-c", "-p", str(threads), str(src)]
+    logging.debug("Running: " + " ".join(cmd))
+    with Popen(cmd, stdout=PIPE) as proc:
+        assert proc.stdout is not None
+        for chunk in iter(lambda: proc.stdout.read(_BLOCK_SIZE), b""):  # type: ignore
+            write(chunk)
+    if proc.returncode != 0:
+        raise CalledProcessError(proc.returncode, cmd)
+
+
+def _inflate_serial(src: Path, write: Writer) -> None:
+    with gzip.open(src, "rb") as gz:
+        for chunk in iter(lambda: gz.read(_BLOCK_SIZE), b""):
+            write(chunk)
+
+
+class _OrderedWriter:
+    "Write chunks on a background thread, keeping a bounded queue"
+
+    def __init__(self, executor: ThreadPoolExecutor, write: Writer):
+        self.executor = executor
+        self.write = write
+        self.pending: Deque[Future] = deque()
+
+    def submit(self, data: bytes) -> None:
+        self.pending.append(self.executor.submit(self.write, data))
+        while len(self.pending) > _WRITE_AHEAD:
+            self.pending.popleft().result()
+
+    def flush(self) -> None:
+        while self.pending:
+            self.pending.popleft().result()
+
+
+def _inflate_pipelined(f: BinaryIO, write: Writer) -> None:
+    "Inflate a (multi-member) gzip stream, overlapping read, inflate and write"
+    with ThreadPoolExecutor(1) as reader, ThreadPoolExecutor(1) as writer:
+        out = _OrderedWriter(writer, write)
+        next_read = reader.submit(f.read, _BLOCK_SIZE)
+        inflater = zlib.decompressobj(wbits=31)
+        in_member = False
+        while True:
+            data = next_read.result()
+            if not data:
+                break
+            next_read = reader.submit(f.read, _BLOCK_SIZE)
+            while data:
+                if not in_member:
+                    # zero padding between or after members, as gzip allows
+                    data = data.lstrip(b"\0")
+                    if not data:
+                        break
+                in_member = True
+                chunk = inflater.decompress(data)
+                if chunk:
+                    out.submit(chunk)
+                if inflater.eof:
+                    # start of the next gzip member, if any
+                    data = inflater.unused_data
+                    inflater = zlib.decompressobj(wbits=31)
+                    in_member = False
+                else:
+                    data = b""
+        if in_member:
+            raise EOFError(
+                "Compressed file ended before the end-of-stream marker was reached"
+            )
+        out.flush()
+
+
+def _bgzf_block_size(header: bytes) -> Optional[int]:
+    """Total size of a BGZF block, given its first 18 bytes
+
+    Returns None if the header is not a BGZF header.
+    """
+    if len(header) < 18 or header[:4] != b"\x1f\x8b\x08\x04":
+        return None
+    _xlen, subfield, slen, bsize = struct.unpack("<H2sHH", header[10:18])
+    if subfield != b"BC" or slen != 2:
+        return None
+    return bsize + 1
+
+
+def _only_zeros(f: BinaryIO) -> bool:
+    "Whether the rest of f is zero padding"
+    for data in iter(lambda: f.read(_BLOCK_SIZE), b""):
+        if data.strip(b"\0"):
+            return False
+    return True
+
+
+def _bgzf_batches(f: BinaryIO) -> Iterator[List[bytes]]:
+    "Split a BGZF file into batches of whole blocks, without inflating"
+    batch: List[bytes] = []
+    batch_size = 0
+    while True:
+        header = f.read(18)
+        if not header:
+            break
+        if not header.strip(b"\0") and _only_zeros(f):
+            break  # zero padding, as gzip allows
+        size = _bgzf_block_size(header)
+        if size is None:
+            raise zlib.error("Invalid BGZF block header")
+        block = header + f.read(size - 18)
+        if len(block) != size:
+            raise EOFError("BGZF file truncated")
+        batch.append(block)
+        batch_size += size
+        if batch_size >= _BLOCK_SIZE:
+            yield batch
+            batch, batch_size = [], 0
+    if batch:
+        yield batch
+
+
+def _inflate_blocks(blocks: List[bytes]) -> bytes:
+    return b"".join(zlib.decompress(block, wbits=31) for block in blocks)
+
+
+def _inflate_bgzf(f: BinaryIO, write: Writer, threads: int) -> None:
+    "Inflate BGZF blocks in parallel, writing them in order"
+    with ThreadPoolExecutor(threads) as pool, ThreadPoolExecutor(1) as writer:
+        out = _OrderedWriter(writer, write)
+        inflating: Deque[Future] = deque()
+        for batch in _bgzf_batches(f):
+            inflating.append(pool.submit(_inflate_blocks, batch))
+            if len(inflating) > 2 * threads:
+                out.submit(inflating.popleft().result())
+        while inflating:
+            out.submit(inflating.popleft().result())
+        out.flush()
+
+
+def _is_bgzf(src: Path) -> bool:
+    with src.open("rb") as f:
+        return _bgzf_block_size(f.read(18)) is not None
+
+
+def _inflate_threaded(src: Path, write: Writer, threads: int) -> None:
+    with src.open("rb") as f:
+        if threads > 1 and _is_bgzf(src):
+            _inflate_bgzf(f, write, threads)
+        else:
+            _inflate_pipelined(f, write)
+
+
+def default_backend() -> str:
+    backend = os.environ.get("AFD_GUNZIP")
+    if backend:
+        return backend
+    return "pigz" if _has_pigz() else "threaded"
+
+
+def inflate(
+    src: Path,
+    write: Writer,
+    backend: Optional[str] = None,
+    threads: Optional[int] = None,
+) -> GunzipStats:
+    """Decompress a gzip file, passing the uncompressed data to write
+
+    Args:
+    - src: gzip file
+    - write: called with consecutive chunks of uncompressed data
+    - backend: "pigz", "threaded" or "serial". Defaults to default_backend()
+    - threads: number of threads. Defaults to the number of CPUs. Limited by
+      the thread budget, and the output by the disk rate, of the governor
+      (see `alphafold_data.throttle`).
+    """
+    backend = backend or default_backend()
+    written = 0
+
+    def counting_write(data: bytes) -> None:
+        nonlocal written
+        write(data)
+        written += len(data)
+        throttle.consume(DISK, len(data))
+
+    start = time.monotonic()
+    with throttle.governor().threads(threads or _default_threads()) as threads:
+        if backend == "pigz":
+            _inflate_pigz(src, counting_write, threads)
+        elif backend == "threaded":
+            _inflate_threaded(src, counting_write, threads)
+        elif backend == "serial":
+            _inflate_serial(src, counting_write)
+        else:
+            raise ValueError(f"Unknown gunzip backend {backend}")
+    return GunzipStats(
+        backend=backend,
+        compressed_bytes=src.stat().st_size,
+        uncompressed_bytes=written,
+        seconds=time.monotonic() - start,
+    )
+
+
+def _tee_writer(write: Writer, tee: Optional[Writer]) -> Writer:
+    if tee is None:
+        return write
+
+    def both(data: bytes) -> None:
+        write(data)
+        tee(data)
+
+    return both
+
+
+def gunzip(
+    src: Path,
+    dst: Path,
+    backend: Optional[str] = None,
+    threads: Optional[int] = None,
+    tee: Optional[Writer] = None,
+) -> GunzipStats:
+    """Decompress the gzip file src to dst
+
+    The output is written to a `.partial` file, which is renamed on success
+    and removed on failure.
+
+    Args:
+    - tee: if given, also called with every chunk of decompressed data
+    """
+    dst.parent.mkdir(parents=True, exist_ok=True)
+    tmp = dst.with_name(dst.name + ".partial")
+    try:
+        with tmp.open("wb") as out:
+            telemetry.report(out.tell)
+            write = _tee_writer(out.write, tee)
+            stats = inflate(src, write, backend=backend, threads=threads)
+    except BaseException:
+        remove_path(tmp)
+        raise
+    tmp.rename(dst)
+    logging.info(f"gunzip {src.name} with {stats}")
+    return stats
+
+
+class _Abandoned(Exception):
+    "The reading side of a _Pipe went away"
+
+
+class _Pipe:
+    """Bounded in-memory pipe from a producer thread to a file-like reader
+
+    Only read() is supported, which is enough for tarfile's stream mode.
+    """
+
+    _EOF = object()
+
+    def __init__(self, maxsize: int = 8):
+        self._queue: "queue.Queue[object]" = queue.Queue(maxsize)
+        self._chunk = b""
+        self._pos = 0
+        self._eof = False
+        self._abandoned = threading.Event()
+
+    def write(self, data: bytes) -> None:
+        while True:
+            if self._abandoned.is_set():
+                raise _Abandoned()
+            try:
+                self._queue.put(data, timeout=0.1)
+                return
+            except queue.Full:
+                pass
+
+    def produce(self, func: Callable[[], object]) -> None:
+        "Run func (which calls write) and signal EOF or its error to the reader"
+        result: object = self._EOF
+        try:
+            func()
+        except _Abandoned:
+            return
+        except BaseException as err:
+            result = err
+        while not self._abandoned.is_set():
+            try:
+                self._queue.put(result, timeout=0.1)
+                return
+            except queue.Full:
+                pass
+
+    def abandon(self) -> None:
+        self._abandoned.set()
+
+    def read(self, size: int = -1) -> bytes:
+        parts = []
+        while size != 0:
+            if self._pos >= len(self._chunk):
+                if self._eof:
+                    break
+                item = self._queue.get()
+                if item is self._EOF:
+                    self._eof = True
+                    break
+                if isinstance(item, BaseException):
+                    self._eof = True
+                    raise item
+                self._chunk, self._pos = item, 0  # type: ignore
+                continue
+            end = len(self._chunk) if size < 0 else self._pos + size
+            part = self._chunk[self._pos : end]
+            self._pos += len(part)
+            if size > 0:
+                size -= len(part)
+            parts.append(part)
+        return b"".join(parts)
+
+
+@contextmanager
+def open_inflated(
+    src: Path,
+    backend: Optional[str] = None,
+    threads: Optional[int] = None,
+) -> Iterator[BinaryIO]:
+    """Open a gzip file as a readable stream of uncompressed data
+
+    Decompression runs on background threads with the selected backend.
+    Errors (e.g. truncated input) are raised from read().
+    """
+    pipe = _Pipe()
+    thread = threading.Thread(
+        target=pipe.produce,
+        args=(lambda: inflate(src, pipe.write, backend=backend, threads=threads),),
+        name=f"inflate-{src.name}",
+        daemon=True,
+    )
+    thread.start()
+    try:
+        yield pipe  # type: ignore
+    finally:
+        pipe.abandon()
+        thread.join()
+
+
+def gunzip_concat(
+    srcs: List[Path],
+    dst: Path,
+    backend: Optional[str] = None,
+    threads: Optional[int] = None,
+    tee: Optional[Writer] = None,
+) -> List[GunzipStats]:
+    """Decompress several gzip files, in order, into a single file
+
+    Each input is inflated with the multi-threaded backend directly into the
+    output, without intermediate copies. tee is as for `gunzip`.
+    """
+    dst.parent.mkdir(parents=True, exist_ok=True)
+    tmp = dst.with_name(dst.name + ".partial")
+    stats = []
+    try:
+        with tmp.open("wb") as out:
+            telemetry.report(out.tell)
+            write = _tee_writer(out.write, tee)
+            for src in srcs:
+                part = inflate(src, write, backend=backend, threads=threads)
+                logging.info(f"gunzip {src.name} with {part}")
+                stats.append(part)
+    except BaseException:
+        remove_path(tmp)
+        raise
+    tmp.rename(dst)
+    return stats
@@ -0,0 +1,222 @@
+"""Coordination between workers sharing a data_dir
+
+Several `alphafold_data` processes, on one host or on many hosts sharing
+data_dir over NFS, can update the same installation. Each source is claimed
+by one worker at a time with a lease: a lock file in the `locks` directory of
+the metadata directory, created with O_EXCL and holding the owner's host, pid
+and a random id. While the lease is held, a heartbeat thread touches the
+file. A lease whose file has not been touched for `ttl` seconds belongs to a
+dead worker and may be broken by anyone.
+
+fcntl locks are avoided for leases, since they are unreliable across NFS
+clients (and a no-op on `nolock` mounts). The state database still relies
+on them, see `alphafold_data.state`. Shared JSON files in the metadata
+directory (e.g. the digest manifest) are rewritten while holding a lease,
+see `exclusive`.
+"""
+
+import json
+import logging
+import os
+import socket
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Iterator, List, Optional
+
+from .util import metadata_dir
+
+LOCKS_NAME = "locks"
+
+# Seconds without heartbeat after which a lease is considered abandoned
+_TTL = 120.0
+# Seconds between polls while waiting for a lease
+_POLL = 1.0
+# Polls are more frequent for leases only held for a short update
+_SHORT_POLL = 0.02
+
+
+def _owner_id() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+
+@dataclass
+class LeaseInfo:
+    """A lease currently held by some worker
+
+    Attributes:
+    - key: what is claimed, usually a source name
+    - owner: host:pid:id of the holder
+    - age: seconds since the last heartbeat
+    """
+
+    key: str
+    owner: str
+    age: float
+
+
+class Lease:
+    """A claimed key, kept alive by a heartbeat until released
+
+    Use as a context manager, or call `release`. If the lease was broken by
+    another worker in the meantime, `lost` is set and leaving the context
+    raises an IOError, since the work may have been done twice.
+    """
+
+    def __init__(self, path: Path, key: str, owner: str, ttl: float):
+        self.path = path
+        self.key = key
+        self.owner = owner
+        self.ttl = ttl
+        self.lost = False
+        self._stop = threading.Event()
+        self._thread = threading.Thread(
+            target=self._heartbeat, name=f"afd-lease-{key}", daemon=True
+        )
+        self._thread.start()
+
+    def _still_ours(self) -> bool:
+        try:
+            return json.loads(self.path.read_text())["owner"] == self.owner
+        except (OSError, ValueError, KeyError):
+            return False
+
+    def _heartbeat(self) -> None:
+        while not self._stop.wait(self.ttl / 4):
+            if not self._still_ours():
+                logging.warning(f"Lost the lock on {self.key}")
+                self.lost = True
+                return
+            try:
+                os.utime(self.path)
+            except OSError as err:
+                logging.debug(f"Heartbeat on {self.path} failed: {err}")
+
+    def release(self) -> None:
+        self._stop.set()
+        self._thread.join()
+        if self._still_ours():
+            self.path.unlink()
+        else:
+            self.lost = True
+
+    def __enter__(self) -> "Lease":
+        return self
+
+    def __exit__(self, exc_type, *exc) -> None:
+        self.release()
+        if self.lost and exc_type is None:
+            raise IOError(f"Lost the lock on {self.key} while working on it")
+
+
+class Leases:
+    """Leases on keys within one data_dir
+
+    Args:
+    - data_dir: install directory
+    - ttl: seconds without heartbeat after which a lease may be broken
+    """
+
+    def __init__(self, data_dir: Path, ttl: float = _TTL):
+        self.directory = metadata_dir(data_dir) / LOCKS_NAME
+        self.directory.mkdir(exist_ok=True)
+        self.ttl = ttl
+
+    def _path(self, key: str) -> Path:
+        return self.directory / f"{key}.lock"
+
+    def _break_stale(self, path: Path) -> bool:
+        """Remove an abandoned lock file
+
+        The file is first renamed to a unique name, so that of several
+        workers noticing the same stale lock only one breaks it.
+
+        Returns:
+            True if the lock is gone (broken by us or released meanwhile)
+        """
+        try:
+            if time.time() - path.stat().st_mtime < self.ttl:
+                return False
+        except FileNotFoundError:
+            return True
+        stale = path.with_name(f"{path.name}.{uuid.uuid4().hex}.stale")
+        try:
+            os.rename(path, stale)
+        except FileNotFoundError:
+            return True
+        if time.time() - stale.stat().st_mtime < self.ttl:
+            # a heartbeat came in between; put it back unless already replaced
+            try:
+                os.link(stale, path)
+            except FileExistsError:
+                pass
+            stale.unlink()
+            return False
+        logging.warning(f"Breaking abandoned lock {path.name}: {stale.read_text()}")
+        stale.unlink()
+        return True
+
+    def try_acquire(self, key: str) -> Optional[Lease]:
+        "Claim key, or return None if another worker holds it"
+        path = self._path(key)
+        owner = _owner_id()
+        for _attempt in range(2):
+            try:
+                fd = os.open(str(path), os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o644)
+            except FileExistsError:
+                if not self._break_stale(path):
+                    return None
+                continue
+            with os.fdopen(fd, "w") as f:
+                json.dump({"owner": owner, "key": key, "acquired": time.time()}, f)
+            return Lease(path, key, owner, self.ttl)
+        return None
+
+    def acquire(
+        self, key: str, timeout: Optional[float] = None, poll: float = _POLL
+    ) -> Lease:
+        """Claim key, waiting for other workers to release it
+
+        Args:
+        - timeout: seconds to wait at most, None for no limit
+        - poll: seconds between attempts
+
+        Raises:
+            TimeoutError if key wasn't free within timeout seconds
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            lease = self.try_acquire(key)
+            if lease is not None:
+                return lease
+            if deadline is not None and time.monotonic() > deadline:
+                raise TimeoutError(f"{key} is still locked by another worker")
+            time.sleep(poll)
+
+    def held(self) -> List[LeaseInfo]:
+        "Leases currently held by live workers"
+        found = []
+        now = time.time()
+        for path in sorted(self.directory.glob("*.lock")):
+            try:
+                age = now - path.stat().st_mtime
+                owner = json.loads(path.read_text())["owner"]
+            except (OSError, ValueError, KeyError):
+                continue
+            if age < self.ttl:
+                found.append(LeaseInfo(path.name[: -len(".lock")], owner, age))
+        return found
+
+
+@contextmanager
+def exclusive(data_dir: Path, key: str) -> Iterator[None]:
+    """Hold the lease on key during a short read-modify-write of a shared file
+
+    Workers in other processes, or on other hosts, may rewrite the same file
+    at the same time; a thread lock alone only covers this process.
+    """
+    with Leases(data_dir).acquire(key, poll=_SHORT_POLL):
+        yield
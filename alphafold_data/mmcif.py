@@ -0,0 +1,166 @@
+"""Incremental mirror of the divided mmCIF tree
+
+The PDB distributes ~200k gzipped mmCIF files in a "divided" layout
+(`ab/1abc.cif.gz`), of which only a few change every week. The mirror is
+synced with rsync, hardlinking files that didn't change since the previous
+version (`--link-dest`). Decompression into the flat `mmcif_files/` layout
+only expands new or changed files; everything else is hardlinked from the
+previous version or kept from an earlier run, based on an index of what was
+already expanded.
+"""
+
+import gzip
+import json
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from . import engine, throttle
+from .util import atomic_write_text
+
+INDEX_NAME = ".afd-mmcif-index.json"
+
+# Save progress to the index every this many files
+_SAVE_EVERY = 5000
+
+
+def download_rsync(url: str, dst: Path, link_dest: Optional[Path] = None) -> None:
+    """Mirror a remote directory with rsync
+
+    Only changed files are transferred. Files deleted upstream are deleted.
+
+    Args:
+    - url: rsync url of a directory (should end with a /)
+    - dst: local directory
+    - link_dest: previous copy of the mirror. Unchanged files are hardlinked
+      from there instead of being transferred.
+    """
+    dst.mkdir(parents=True, exist_ok=True)
+    rsync = os.environ.get("RSYNC_EXE", "rsync")
+    cmd = [
+        rsync,
+        "--recursive",
+        "--links",
+        "--perms",
+        "--times",
+        "--compress",
+        "--delete",
+    ]
+    if link_dest is not None:
+        cmd.append(f"--link-dest={link_dest.resolve()}")
+    cmd += [url, os.path.join(dst, "")]
+    with throttle.governor().tool(engine.NETWORK) as rate:
+        if rate:
+            cmd.insert(1, f"--bwlimit={max(1, rate // 1024)}")  # KiB/s
+        result = engine.run(cmd, engine.NETWORK)
+    result.check_returncode()
+
+
+def previous_version(path: Path) -> Optional[Path]:
+    """Find the same path in the most recent older version
+
+    Versions are sibling directories, e.g. for
+    `compressed/pdb/2023-01-04/raw` this might return
+    `compressed/pdb/2022-12-28/raw`.
+    """
+    version = path.parent.name
+    root = path.parent.parent
+    if not root.is_dir():
+        return None
+    versions = sorted((p.name for p in root.iterdir() if p.name < version))
+    for name in reversed(versions):
+        candidate = root / name / path.name
+        if candidate.is_dir():
+            return candidate
+    return None
+
+
+Index = Dict[str, Tuple[int, int]]
+
+
+def _load_index(directory: Path) -> Index:
+    try:
+        data = json.loads((directory / INDEX_NAME).read_text())
+    except (OSError, ValueError):
+        return {}
+    return {name: (size, mtime) for name, (size, mtime) in data.items()}
+
+
+def _expand(src: Path, dst: Path) -> None:
+    tmp = dst.with_name(dst.name + ".partial")
+    with gzip.open(src, "rb") as f:
+        data = f.read()
+    tmp.write_bytes(data)
+    throttle.consume(engine.DISK, len(data))
+    tmp.rename(dst)
+
+
+def decompress_mmcif(
+    src: Path, dst: Path, previous: Optional[Path] = None, workers: int = 8
+) -> None:
+    """Expand a divided mmCIF mirror into a flat directory
+
+    Args:
+    - src: mirror with `*/*.cif.gz` files
+    - dst: output directory for the `.cif` files
+    - previous: output directory of an older version. Unchanged files are
+      hardlinked from there.
+    - workers: number of files decompressed in parallel, within the
+      governor's thread budget
+    """
+    dst.mkdir(parents=True, exist_ok=True)
+    done = _load_index(dst)
+    old = _load_index(previous) if previous is not None else {}
+
+    current: Index = {}
+    expanded: Index = {}  # what is in dst, saved as the index
+    todo: List[Tuple[Path, Path, Tuple[int, int]]] = []
+    linked = 0
+    for gz in src.glob("*/*.cif.gz"):
+        stat = gz.stat()
+        key = (stat.st_size, stat.st_mtime_ns)
+        name = gz.name[: -len(".gz")]
+        out = dst / name
+        current[name] = key
+        if done.get(name) == key and out.exists():
+            expanded[name] = key
+            continue
+        if previous is not None and old.get(name) == key:
+            try:
+                if out.exists():
+                    out.unlink()
+                os.link(previous / name, out)
+                expanded[name] = key
+                linked += 1
+                continue
+            except OSError:
+                pass  # fall back to decompressing
+        todo.append((gz, out, key))
+
+    threads = throttle.governor().threads(workers)
+    with threads as workers, ThreadPoolExecutor(workers) as pool:
+        futures = {
+            pool.submit(_expand, gz, out): (out.name, key) for gz, out, key in todo
+        }
+        for i, future in enumerate(as_completed(futures), 1):
+            future.result()
+            name, key = futures[future]
+            expanded[name] = key
+            if i % _SAVE_EVERY == 0:
+                atomic_write_text(dst / INDEX_NAME, json.dumps(expanded))
+
+    removed = 0
+    for name in set(done) - set(current):
+        try:
+            (dst / name).unlink()
+            removed += 1
+        except FileNotFoundError:
+            pass
+
+    atomic_write_text(dst / INDEX_NAME, json.dumps(expanded))
+    logging.info(
+        f"mmCIF: {len(todo)} expanded, {linked} linked from previous version,"
+        f" {removed} removed, {len(expanded)} total"
+    )
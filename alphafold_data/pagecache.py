@@ -0,0 +1,237 @@
+"""Page cache warm-up and residency of installed databases
+
+The first AlphaFold jobs after switching to a new version read the databases
+from disk. `warm` loads them into the page cache beforehand: files are
+split into ranges which are read in parallel, each after a readahead hint
+(`posix_fadvise(WILLNEED)`), until a memory budget is used up. Databases
+are warmed in the order given, so the most important ones come first.
+
+`residency` tells how much of a file or directory is cached, using
+`mincore` on a read-only mapping, which doesn't load anything. Both are
+Linux-specific; elsewhere nothing is warmed and the residency is unknown.
+"""
+
+import ctypes
+import logging
+import mmap
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+from typing import List, Optional, Sequence, Tuple
+
+# Files are warmed in ranges of this size, so large files use all workers
+_RANGE_SIZE = 256 << 20
+_BUFFER_SIZE = 8 << 20
+# mincore is called on mappings of at most this size
+_WINDOW_SIZE = 1 << 30
+_MAP_FAILED = ctypes.c_void_p(-1).value
+
+
+def _load_libc():
+    try:
+        libc = ctypes.CDLL(None, use_errno=True)
+        libc.mmap.restype = ctypes.c_void_p
+        libc.mmap.argtypes = [
+            ctypes.c_void_p,
+            ctypes.c_size_t,
+            ctypes.c_int,
+            ctypes.c_int,
+            ctypes.c_int,
+            ctypes.c_int64,
+        ]
+        libc.munmap.argtypes = [ctypes.c_void_p, ctypes.c_size_t]
+        libc.mincore.argtypes = [ctypes.c_void_p, ctypes.c_size_t, ctypes.c_void_p]
+    except (OSError, AttributeError):
+        return None
+    return libc
+
+
+_libc = _load_libc()
+
+
+def supported() -> bool:
+    "Whether residency can be measured here"
+    return _libc is not None
+
+
+@dataclass
+class Residency:
+    """How much of a file or directory is in the page cache
+
+    Attributes:
+    - path: the file or directory
+    - size: total size of its files
+    - cached: bytes in the page cache, or None if unknown
+    """
+
+    path: Path
+    size: int
+    cached: Optional[int]
+
+    @property
+    def fraction(self) -> Optional[float]:
+        if self.cached is None:
+            return None
+        return self.cached / self.size if self.size else 1.0
+
+    def __str__(self) -> str:
+        if self.cached is None:
+            return f"{self.path}: {self.size / 1e9:.2f} GB, residency unknown"
+        return (
+            f"{self.path}: {self.cached / 1e9:.2f}/{self.size / 1e9:.2f} GB"
+            f" cached ({self.fraction:.0%})"
+        )
+
+
+@dataclass
+class WarmReport:
+    """Result of `warm`
+
+    Attributes:
+    - files: number of files (partly) read
+    - bytes: bytes read
+    - skipped: bytes left out to stay within the budget
+    - seconds: time taken
+    """
+
+    files: int = 0
+    bytes: int = 0
+    skipped: int = 0
+    seconds: float = 0.0
+
+    def __str__(self) -> str:
+        text = (
+            f"Warmed {self.bytes / 1e9:.2f} GB in {self.files} files"
+            f" in {self.seconds:.1f}s"
+        )
+        if self.skipped:
+            text += f", {self.skipped / 1e9:.2f} GB left out (memory budget)"
+        return text
+
+
+def _files(path: Path) -> List[Path]:
+    "Regular files at or below path, in a stable order"
+    if path.is_file():
+        return [path]
+    found = []
+    for root, dirs, files in os.walk(path):
+        dirs.sort()
+        for name in sorted(files):
+            file = Path(root, name)
+            if file.is_file():
+                found.append(file)
+    return found
+
+
+def _mincore(fd: int, offset: int, length: int) -> int:
+    "Cached pages of a file range"
+    assert _libc is not None
+    addr = _libc.mmap(None, length, mmap.PROT_READ, mmap.MAP_SHARED, fd, offset)
+    if addr == _MAP_FAILED:
+        err = ctypes.get_errno()
+        raise OSError(err, os.strerror(err))
+    try:
+        pages = -(-length // mmap.PAGESIZE)
+        vec = ctypes.create_string_buffer(pages)
+        if _libc.mincore(addr, length, vec) != 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err))
+        # the low bit of each byte tells whether the page is cached
+        return pages - vec.raw[:pages].count(0)
+    finally:
+        _libc.munmap(addr, length)
+
+
+def file_residency(path: Path) -> Optional[int]:
+    "Bytes of a file in the page cache, or None if unknown"
+    if _libc is None:
+        return None
+    with path.open("rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        pages = 0
+        try:
+            for offset in range(0, size, _WINDOW_SIZE):
+                length = min(_WINDOW_SIZE, size - offset)
+                pages += _mincore(f.fileno(), offset, length)
+        except OSError as err:
+            logging.debug(f"Residency of {path} unknown: {err}")
+            return None
+    return min(pages * mmap.PAGESIZE, size)
+
+
+def residency(path: Path, jobs: int = 4) -> Residency:
+    "How much of a file or directory is in the page cache"
+    files = _files(path)
+    size = sum(file.stat().st_size for file in files)
+    with ThreadPoolExecutor(jobs) as pool:
+        cached = list(pool.map(file_residency, files))
+    if any(c is None for c in cached):
+        return Residency(path, size, None)
+    return Residency(path, size, sum(cached))  # type: ignore
+
+
+def available_memory() -> int:
+    "Memory available without swapping (MemAvailable), in bytes"
+    try:
+        with open("/proc/meminfo") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_AVPHYS_PAGES")
+
+
+def _warm_range(path: Path, offset: int, length: int) -> int:
+    buf = bytearray(min(_BUFFER_SIZE, length))
+    done = 0
+    with path.open("rb", buffering=0) as f:
+        if hasattr(os, "posix_fadvise"):
+            os.posix_fadvise(f.fileno(), offset, length, os.POSIX_FADV_WILLNEED)
+        f.seek(offset)
+        view = memoryview(buf)
+        while done < length:
+            n = f.readinto(view[: length - done])  # type: ignore
+            if not n:
+                break
+            done += n
+    return done
+
+
+def warm(
+    paths: Sequence[Path], budget: Optional[int] = None, jobs: int = 4
+) -> WarmReport:
+    """Load files into the page cache
+
+    Args:
+    - paths: files or directories, most important first
+    - budget: maximum bytes to load. Defaults to half the available memory,
+      since more would evict other cached data, e.g. of running jobs.
+    - jobs: number of ranges read in parallel
+    """
+    if budget is None:
+        budget = available_memory() // 2
+    ranges: List[Tuple[Path, int, int]] = []
+    report = WarmReport()
+    left = budget
+    for path in paths:
+        for file in _files(path):
+            size = file.stat().st_size
+            length = min(size, left)
+            report.skipped += size - length
+            if length <= 0:
+                continue
+            left -= length
+            report.files += 1
+            ranges.extend(
+                (file, offset, min(_RANGE_SIZE, length - offset))
+                for offset in range(0, length, _RANGE_SIZE)
+            )
+    start = time.monotonic()
+    logging.info(f"Warming {budget - left} bytes in {report.files} files")
+    with ThreadPoolExecutor(jobs) as pool:
+        report.bytes = sum(pool.map(lambda r: _warm_range(*r), ranges))
+    report.seconds = time.monotonic() - start
+    return report
@@ -0,0 +1,213 @@
+"""Disk space planning for updates
+
+Before an update starts, the space it needs is estimated from the archive
+sizes (the local file, Content-Length, or the size recorded in the manifest)
+and the typical expansion ratio of each source (`Source.expansion`). The
+size of rsync mirrors is estimated (`Source.estimated_size`). For archives
+transcoded to seekable zstd, the exact size is in the seek table.
+
+Without pruning, every archive stays next to its extracted copy. With eager
+pruning, each archive is deleted as soon as its extraction is verified, so
+only the archives currently being processed need room on top of the
+extracted data. Sources are then processed largest archive first, while
+little has been extracted yet, and a source is only started while its
+archive fits into the space not reserved for extracted data.
+"""
+
+import logging
+import shutil
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from .seekable import SeekTable
+from .sources import Source, fasta_shards
+
+# Fraction of the filesystem left free by default
+_RESERVE = 0.01
+
+
+class PlanError(IOError):
+    "The update does not fit into the disk budget"
+
+
+def _gb(size: int) -> str:
+    return f"{size / 1e9:.1f} GB"
+
+
+@dataclass
+class PlanItem:
+    """Space needed by one source
+
+    Attributes:
+    - name: source name
+    - download: bytes of compressed files still to be written
+    - extract: estimated bytes still to be extracted
+    - prune: whether the compressed files are deleted once extracted
+    - known: whether the archive size is known
+    """
+
+    name: str
+    download: int = 0
+    extract: int = 0
+    prune: bool = False
+    known: bool = True
+
+    @property
+    def permanent(self) -> int:
+        "Bytes still in use once this source is done"
+        return self.extract if self.prune else self.extract + self.download
+
+    @property
+    def transient(self) -> int:
+        "Bytes only in use while this source is processed"
+        return self.download if self.prune else 0
+
+
+@dataclass
+class Plan:
+    """Estimated disk usage of an update
+
+    Attributes:
+    - items: sources in processing order, largest archive first
+    - budget: bytes the update may use
+    """
+
+    items: List[PlanItem]
+    budget: int
+
+    @property
+    def permanent(self) -> int:
+        "Bytes in use after the update"
+        return sum(item.permanent for item in self.items)
+
+    @property
+    def capacity(self) -> int:
+        "Bytes available to archives while they are being processed"
+        return self.budget - self.permanent
+
+    @property
+    def peak(self) -> int:
+        "Estimated peak usage, processing sources one at a time"
+        return self.permanent + max((i.transient for i in self.items), default=0)
+
+    @property
+    def fits(self) -> bool:
+        return self.peak <= self.budget
+
+    def costs(self) -> Dict[str, int]:
+        "Transient bytes by source, for `Scheduler` jobs"
+        return {item.name: item.transient for item in self.items}
+
+    @property
+    def unknown(self) -> List[str]:
+        "Sources whose archive size is unknown, so the plan underestimates"
+        return [item.name for item in self.items if not item.known]
+
+    def check(self, allow_unknown=False) -> None:
+        """Refuse plans which don't fit
+
+        Args:
+        - allow_unknown: accept plans with sources of unknown size, which are
+          counted as needing no space
+
+        Raises:
+            PlanError if the peak usage exceeds the budget, or if sizes are
+            unknown and allow_unknown isn't set
+        """
+        if self.unknown and not allow_unknown:
+            raise PlanError(
+                f"Size of {', '.join(self.unknown)} unknown, so the disk space"
+                " needed can't be estimated"
+            )
+        if not self.fits:
+            raise PlanError(
+                f"Not enough disk space: the update needs up to {_gb(self.peak)}"
+                f" but only {_gb(self.budget)} are available"
+            )
+
+    def __str__(self):
+        lines = [f"{'Database':>10} {'Download':>12} {'Extract':>12} {'Prune':>6}"]
+        for item in self.items:
+            if not (item.download or item.extract):
+                continue
+            download = _gb(item.download) if item.known else "unknown"
+            lines.append(
+                f"{item.name:>10} {download:>12} {_gb(item.extract):>12}"
+                f" {'yes' if item.prune else 'no':>6}"
+            )
+        lines.append(f"Peak disk usage {_gb(self.peak)} of {_gb(self.budget)}")
+        return "\n".join(lines)
+
+
+def _expansion(db: Source) -> float:
+    "Expansion including the FASTA shards, which take as much space again"
+    if db.index_fasta and fasta_shards():
+        return 2 * db.expansion
+    return db.expansion
+
+
+def _item(
+    name: str,
+    db: Source,
+    data_dir: Path,
+    prune: bool,
+    stream: bool,
+    keep_compressed: bool,
+) -> PlanItem:
+    if db.uncompressed_available(data_dir):
+        return PlanItem(name)
+    prune = prune and db.prunable
+    if db.transcoded_available(data_dir):
+        # the seek table of the zstd copy records the exact uncompressed size
+        try:
+            size = SeekTable.load(Path(data_dir, db.transcoded)).size
+        except (OSError, ValueError) as err:
+            logging.warning(f"Size of {name} unknown: {err}")
+            return PlanItem(name, prune=prune, known=False)
+        if db.index_fasta and fasta_shards():
+            size *= 2
+        return PlanItem(name, extract=size, prune=prune)
+    if db.compressed_available(data_dir):
+        # already on disk, so only the extracted copy is new
+        size = db.local_size(data_dir)
+        return PlanItem(name, extract=int(size * _expansion(db)), prune=prune)
+    size = db.remote_size() or db.recorded_size(data_dir) or db.estimated_size(data_dir)
+    if not size:
+        logging.warning(f"Size of {name} unknown")
+    download = size
+    if stream and db.streamable and not keep_compressed:
+        download = 0
+    return PlanItem(
+        name, download, int(size * _expansion(db)), prune=prune, known=bool(size)
+    )
+
+
+def plan_update(
+    sources: Dict[str, Source],
+    data_dir: Path,
+    budget: Optional[int] = None,
+    prune=False,
+    stream=False,
+    keep_compressed=True,
+) -> Plan:
+    """Estimate the disk space an update of sources needs
+
+    Args:
+    - sources: sources to update, by name
+    - data_dir: install directory
+    - budget: maximum number of bytes the update may use. Defaults to the free
+      space, less 1% of the filesystem. Never more than the free space.
+    - prune: delete archives as soon as they are extracted
+    - stream, keep_compressed: as for `AFData.update`
+    """
+    usage = shutil.disk_usage(str(data_dir))
+    available = max(0, usage.free - int(usage.total * _RESERVE))
+    if budget is not None:
+        available = min(budget, usage.free)
+    items = [
+        _item(name, db, Path(data_dir), prune, stream, keep_compressed)
+        for name, db in sources.items()
+    ]
+    items.sort(key=lambda item: item.download, reverse=True)
+    return Plan(items, available)
@@ -0,0 +1,118 @@
+"""Bounded-concurrency job scheduler"""
+
+import threading
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional
+
+
+@dataclass
+class Job:
+    """A unit of work for the Scheduler
+
+    Attributes:
+    - name: unique name, used as key in the results
+    - func: callable doing the work. Exceptions are reported as failures.
+    - host: jobs with the same host share the per-host limit
+    - size: expected size in bytes. Larger jobs are started first.
+    - cost: amount of the scheduler's capacity (e.g. disk space) held while
+      the job runs
+    """
+
+    name: str
+    func: Callable[[], None]
+    host: str = ""
+    size: int = 0
+    cost: int = 0
+
+
+class Scheduler:
+    """Run jobs in parallel with a global and a per-host concurrency limit
+
+    Pending jobs are started largest-first, skipping over jobs whose host is
+    already saturated, so that the longest transfers don't end up as a long
+    tail after everything else has finished. With a capacity, jobs also wait
+    until their cost fits next to the jobs already running.
+    """
+
+    max_workers: int
+    per_host: int
+    capacity: int
+
+    def __init__(self, max_workers: int = 4, per_host: int = 2, capacity: int = 0):
+        """
+        Args:
+        - max_workers: maximum number of jobs running at once
+        - per_host: maximum number of jobs per host. 0 for no limit.
+        - capacity: maximum total cost of the running jobs. 0 for no limit.
+        """
+        if max_workers < 1:
+            raise ValueError(f"max_workers must be positive, got {max_workers}")
+        self.max_workers = max_workers
+        self.per_host = per_host
+        self.capacity = capacity
+
+    def _host_free(self, host: str, running: Dict[str, int]) -> bool:
+        return self.per_host <= 0 or running.get(host, 0) < self.per_host
+
+    def _fits(self, cost: int, used: int) -> bool:
+        return self.capacity <= 0 or used + cost <= self.capacity
+
+    def run(self, jobs: List[Job]) -> Dict[str, Optional[BaseException]]:
+        """Run all jobs and wait for them to finish
+
+        Jobs costing more than the whole capacity fail with a ValueError
+        without being run.
+
+        Returns:
+            dict mapping job name to the exception it raised, or None on success
+        """
+        results: Dict[str, Optional[BaseException]] = {}
+        pending = sorted(jobs, key=lambda job: job.size, reverse=True)
+        for oversized in [j for j in pending if not self._fits(j.cost, 0)]:
+            pending.remove(oversized)
+            results[oversized.name] = ValueError(
+                f"{oversized.name} needs {oversized.cost}, more than the capacity"
+                f" of {self.capacity}"
+            )
+        running: Dict[str, int] = {}
+        used = 0
+        cond = threading.Condition()
+
+        def work(job: Job):
+            nonlocal used
+            error: Optional[BaseException] = None
+            try:
+                job.func()
+            except Exception as err:
+                error = err
+            with cond:
+                results[job.name] = error
+                running[job.host] -= 1
+                used -= job.cost
+                cond.notify_all()
+
+        with cond:
+            while pending or sum(running.values()) > 0:
+                job = None
+                if sum(running.values()) < self.max_workers:
+                    job = next(
+                        (
+                            j
+                            for j in pending
+                            if self._host_free(j.host, running)
+                            and self._fits(j.cost, used)
+                        ),
+                        None,
+                    )
+                if job is None:
+                    cond.wait()
+                    continue
+                pending.remove(job)
+                running[job.host] = running.get(job.host, 0) + 1
+                used += job.cost
+                thread = threading.Thread(
+                    target=work, args=(job,), name=f"afd-{job.name}", daemon=True
+                )
+                thread.start()
+
+        return results
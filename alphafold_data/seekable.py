@@ -0,0 +1,462 @@
+"""Seekable zstd archives
+
+Upstream archives are gzip, which inflates on a single core and can only be
+read from the start. `transcode` rewrites an archive (gzip or uncompressed)
+as independent zstd frames of `FRAME_SIZE` uncompressed bytes each, followed
+by a seek table in zstd's seekable format, so that:
+
+- it decompresses with all cores, frames being independent
+  (`decompress`, `open_decompressed`)
+- any byte range of the uncompressed data can be read by decoding only the
+  frames it spans (`read_range`, `SeekableReader`), e.g. a FASTA record at an
+  offset from its index
+- single members of a tar archive can be read without extracting the rest
+  (`read_member`), using a member list saved next to the archive
+
+The output is a valid zstd file for other tools too (`zstd -d`, or
+`t2sz`-aware readers for random access).
+
+Requires the optional `zstandard` package (`pip install
+alphafold_data[zstd]`); `available()` tells whether it is installed.
+"""
+
+import io
+import json
+import logging
+import os
+import struct
+import tarfile
+import threading
+import time
+from bisect import bisect_right
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Deque, Dict, Iterator, List, Optional, Tuple
+
+from . import gunzip, telemetry, throttle
+from .engine import DISK
+from .gunzip import GunzipStats, Writer, _Pipe, _tee_writer
+from .util import remove_path
+
+try:
+    import zstandard  # type: ignore
+except ImportError:  # optional dependency, see available()
+    zstandard = None
+
+# Uncompressed bytes per frame: the unit of parallelism and of random access
+FRAME_SIZE = 4 << 20
+LEVEL = 9
+MEMBERS_SUFFIX = ".members.json"
+
+_SKIPPABLE_MAGIC = 0x184D2A5E
+_SEEKABLE_MAGIC = 0x8F92EAB1
+_FOOTER = struct.Struct("<IBI")  # number of frames, descriptor, magic
+_ENTRY = struct.Struct("<II")  # compressed size, decompressed size
+_CHECKSUM_FLAG = 0x80
+_CHUNK_SIZE = 16 << 20
+
+
+def available() -> bool:
+    "Whether the zstandard package is installed"
+    return zstandard is not None
+
+
+def _require() -> None:
+    if zstandard is None:
+        raise ImportError(
+            "Seekable zstd needs the zstandard package"
+            " (pip install alphafold_data[zstd])"
+        )
+
+
+def _default_threads() -> int:
+    return os.cpu_count() or 1
+
+
+@dataclass
+class SeekTable:
+    """Frame offsets of a seekable zstd file
+
+    Attributes:
+    - compressed: offset of each frame in the file, plus the end of the last
+    - uncompressed: offset of each frame in the uncompressed data, plus the
+      total size
+    """
+
+    compressed: List[int]
+    uncompressed: List[int]
+
+    @property
+    def frames(self) -> int:
+        return len(self.compressed) - 1
+
+    @property
+    def size(self) -> int:
+        "Uncompressed size"
+        return self.uncompressed[-1]
+
+    def frame_at(self, offset: int) -> int:
+        "Index of the frame containing the uncompressed offset"
+        return bisect_right(self.uncompressed, offset) - 1
+
+    @classmethod
+    def from_sizes(kls, sizes: List[Tuple[int, int]]) -> "SeekTable":
+        "From (compressed, uncompressed) sizes of consecutive frames"
+        table = kls([0], [0])
+        for compressed, uncompressed in sizes:
+            table.compressed.append(table.compressed[-1] + compressed)
+            table.uncompressed.append(table.uncompressed[-1] + uncompressed)
+        return table
+
+    def to_bytes(self) -> bytes:
+        "The table as a skippable frame, to append to the file"
+        entries = b"".join(
+            _ENTRY.pack(
+                self.compressed[i + 1] - self.compressed[i],
+                self.uncompressed[i + 1] - self.uncompressed[i],
+            )
+            for i in range(self.frames)
+        )
+        body = entries + _FOOTER.pack(self.frames, 0, _SEEKABLE_MAGIC)
+        return struct.pack("<II", _SKIPPABLE_MAGIC, len(body)) + body
+
+    @classmethod
+    def load(kls, path: Path) -> "SeekTable":
+        """Read the seek table from the end of a file
+
+        Raises:
+            ValueError if the file has no seek table
+        """
+        with path.open("rb") as f:
+            end = f.seek(0, io.SEEK_END)
+            if end < _FOOTER.size + 8:
+                raise ValueError(f"{path} is not a seekable zstd file")
+            f.seek(end - _FOOTER.size)
+            frames, descriptor, magic = _FOOTER.unpack(f.read(_FOOTER.size))
+            if magic != _SEEKABLE_MAGIC:
+                raise ValueError(f"{path} is not a seekable zstd file")
+            entry_size = _ENTRY.size + (4 if descriptor & _CHECKSUM_FLAG else 0)
+            body = frames * entry_size + _FOOTER.size
+            if end < body + 8:
+                raise ValueError(f"Truncated seek table in {path}")
+            f.seek(end - body - 8)
+            magic, size = struct.unpack("<II", f.read(8))
+            if magic != _SKIPPABLE_MAGIC or size != body:
+                raise ValueError(f"Corrupt seek table in {path}")
+            entries = f.read(frames * entry_size)
+        sizes = [_ENTRY.unpack_from(entries, i * entry_size) for i in range(frames)]
+        table = kls.from_sizes(sizes)
+        if table.compressed[-1] != end - body - 8:
+            raise ValueError(f"Seek table of {path} doesn't match its frames")
+        return table
+
+
+def _compress(data: bytes, level: int) -> bytes:
+    # compressors aren't thread-safe, so one per frame
+    compressor = zstandard.ZstdCompressor(
+        level=level, write_checksum=True, write_content_size=True
+    )
+    return compressor.compress(data)
+
+
+def _is_gzip(path: Path) -> bool:
+    with path.open("rb") as f:
+        return f.read(2) == b"\x1f\x8b"
+
+
+def transcode(
+    src: Path,
+    dst: Path,
+    level: int = LEVEL,
+    frame_size: int = FRAME_SIZE,
+    threads: Optional[int] = None,
+) -> GunzipStats:
+    """Rewrite src (gzip or uncompressed) as seekable zstd
+
+    Frames are compressed in parallel. The output is written to a `.partial`
+    file and renamed on success. Tar archives also get a member list, see
+    `read_member`.
+
+    Args:
+    - src: input file
+    - dst: output file, usually named `*.zst`
+    - level: zstd compression level
+    - frame_size: uncompressed bytes per frame
+    - threads: compression threads. Defaults to the number of CPUs, within
+      the governor's thread budget (see `alphafold_data.throttle`).
+
+    Returns:
+        sizes and time, with backend "zstd"
+    """
+    _require()
+    dst.parent.mkdir(parents=True, exist_ok=True)
+    tmp = dst.with_name(dst.name + ".partial")
+    sizes: List[Tuple[int, int]] = []
+    start = time.monotonic()
+    try:
+        with throttle.governor().threads(threads or _default_threads()) as threads:
+            with tmp.open("wb") as out, ThreadPoolExecutor(threads) as pool:
+                telemetry.report(out.tell)
+                pending: Deque[Future] = deque()
+                buffer = bytearray()
+
+                def flush(limit: int) -> None:
+                    while len(pending) > limit:
+                        data, frame = pending.popleft().result()
+                        out.write(frame)
+                        sizes.append((len(frame), len(data)))
+
+                def submit(data: bytes) -> None:
+                    pending.append(pool.submit(lambda: (data, _compress(data, level))))
+                    flush(2 * threads)
+
+                def write(data: bytes) -> None:
+                    buffer.extend(data)
+                    while len(buffer) >= frame_size:
+                        submit(bytes(buffer[:frame_size]))
+                        del buffer[:frame_size]
+
+                if _is_gzip(src):
+                    gunzip.inflate(src, write)
+                else:
+                    with src.open("rb") as f:
+                        for data in iter(lambda: f.read(_CHUNK_SIZE), b""):
+                            write(data)
+                            throttle.consume(DISK, len(data))
+                if buffer:
+                    submit(bytes(buffer))
+                flush(0)
+                table = SeekTable.from_sizes(sizes)
+                out.write(table.to_bytes())
+    except BaseException:
+        remove_path(tmp)
+        raise
+    tmp.rename(dst)
+    stats = GunzipStats(
+        backend="zstd",
+        compressed_bytes=table.compressed[-1],
+        uncompressed_bytes=table.size,
+        seconds=time.monotonic() - start,
+    )
+    logging.info(f"Transcoded {src.name} to {dst.name}: {stats}")
+    _save_members(dst)
+    return stats
+
+
+def _decode_frame(fd: int, offset: int, size: int) -> bytes:
+    frame = os.pread(fd, size, offset)
+    if len(frame) != size:
+        raise EOFError("Seekable zstd file truncated")
+    return zstandard.ZstdDecompressor().decompress(frame)
+
+
+class SeekableReader(io.RawIOBase):
+    """Random access to the uncompressed data of a seekable zstd file
+
+    Only the frames covering what is read are decoded; the last one is kept.
+    Not thread-safe; open one reader per thread.
+    """
+
+    def __init__(self, path: Path):
+        _require()
+        super().__init__()
+        self.path = Path(path)
+        self.table = SeekTable.load(self.path)
+        self._fd = os.open(str(self.path), os.O_RDONLY)
+        self._pos = 0
+        self._frame = -1
+        self._data = b""
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self._pos
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_CUR:
+            offset += self._pos
+        elif whence == io.SEEK_END:
+            offset += self.table.size
+        if offset < 0:
+            raise ValueError(f"Negative seek position {offset}")
+        self._pos = offset
+        return offset
+
+    def _load(self, frame: int) -> bytes:
+        if frame != self._frame:
+            table = self.table
+            self._data = _decode_frame(
+                self._fd,
+                table.compressed[frame],
+                table.compressed[frame + 1] - table.compressed[frame],
+            )
+            self._frame = frame
+        return self._data
+
+    def readinto(self, buffer) -> int:
+        if self._pos >= self.table.size:
+            return 0
+        frame = self.table.frame_at(self._pos)
+        data = self._load(frame)
+        start = self._pos - self.table.uncompressed[frame]
+        count = min(len(buffer), len(data) - start)
+        buffer[:count] = data[start : start + count]
+        self._pos += count
+        return count
+
+    def close(self) -> None:
+        if not self.closed:
+            os.close(self._fd)
+        super().close()
+
+
+def open_seekable(path: Path) -> io.BufferedReader:
+    "Open the uncompressed data of a seekable zstd file for random access"
+    return io.BufferedReader(SeekableReader(path))
+
+
+def read_range(path: Path, offset: int, length: int) -> bytes:
+    "Read length bytes at offset of the uncompressed data"
+    with open_seekable(path) as f:
+        f.seek(offset)
+        return f.read(length)
+
+
+def inflate(src: Path, write: Writer, threads: Optional[int] = None) -> GunzipStats:
+    """Decompress a seekable zstd file in parallel, passing the data to write
+
+    Args:
+    - src: seekable zstd file
+    - write: called with consecutive chunks of uncompressed data
+    - threads: number of threads, as for `transcode`
+    """
+    _require()
+    table = SeekTable.load(src)
+    start = time.monotonic()
+    fd = os.open(str(src), os.O_RDONLY)
+    try:
+        with throttle.governor().threads(threads or _default_threads()) as threads:
+            with ThreadPoolExecutor(threads) as pool:
+                decoding: Deque[Future] = deque()
+                for i in range(table.frames):
+                    offset = table.compressed[i]
+                    size = table.compressed[i + 1] - offset
+                    decoding.append(pool.submit(_decode_frame, fd, offset, size))
+                    if len(decoding) > 2 * threads:
+                        _write_frame(decoding.popleft().result(), write)
+                while decoding:
+                    _write_frame(decoding.popleft().result(), write)
+    finally:
+        os.close(fd)
+    return GunzipStats(
+        backend="zstd",
+        compressed_bytes=src.stat().st_size,
+        uncompressed_bytes=table.size,
+        seconds=time.monotonic() - start,
+    )
+
+
+def _write_frame(data: bytes, write: Writer) -> None:
+    write(data)
+    throttle.consume(DISK, len(data))
+
+
+def decompress(
+    src: Path,
+    dst: Path,
+    threads: Optional[int] = None,
+    tee: Optional[Writer] = None,
+) -> GunzipStats:
+    """Decompress the seekable zstd file src to dst
+
+    As `gunzip.gunzip`: the output goes to a `.partial` file first, and tee
+    is also called with every chunk.
+    """
+    dst.parent.mkdir(parents=True, exist_ok=True)
+    tmp = dst.with_name(dst.name + ".partial")
+    try:
+        with tmp.open("wb") as out:
+            telemetry.report(out.tell)
+            stats = inflate(src, _tee_writer(out.write, tee), threads=threads)
+    except BaseException:
+        remove_path(tmp)
+        raise
+    tmp.rename(dst)
+    logging.info(f"Decompressed {src.name} with {stats}")
+    return stats
+
+
+@contextmanager
+def open_decompressed(
+    src: Path, threads: Optional[int] = None
+) -> Iterator[io.RawIOBase]:
+    """Open a seekable zstd file as a readable stream, decoded in parallel
+
+    The counterpart of `gunzip.open_inflated`, for sequential reading (e.g.
+    tar extraction) at full speed.
+    """
+    pipe = _Pipe()
+    thread = threading.Thread(
+        target=pipe.produce,
+        args=(lambda: inflate(src, pipe.write, threads=threads),),
+        name=f"unzstd-{src.name}",
+        daemon=True,
+    )
+    thread.start()
+    try:
+        yield pipe  # type: ignore
+    finally:
+        pipe.abandon()
+        thread.join()
+
+
+def _members_path(path: Path) -> Path:
+    return path.with_name(path.name + MEMBERS_SUFFIX)
+
+
+def _save_members(path: Path) -> None:
+    "Save the member list of a tar archive, if path is one"
+    members = {}
+    try:
+        with open_seekable(path) as f, tarfile.open(fileobj=f, mode="r:") as tar:
+            for member in tar:
+                if member.isfile():
+                    members[member.name] = (member.offset_data, member.size)
+    except tarfile.ReadError:
+        return  # not a tar archive
+    _members_path(path).write_text(json.dumps(members))
+
+
+def members(path: Path) -> Dict[str, Tuple[int, int]]:
+    """Files in a transcoded tar archive
+
+    Returns:
+        offset and size in the uncompressed data, by member name; empty if
+        the archive is no tar archive
+    """
+    try:
+        data = json.loads(_members_path(path).read_text())
+    except FileNotFoundError:
+        _save_members(path)
+        try:
+            data = json.loads(_members_path(path).read_text())
+        except FileNotFoundError:
+            return {}
+    return {name: (offset, size) for name, (offset, size) in data.items()}
+
+
+def read_member(path: Path, name: str) -> bytes:
+    """Read one file from a transcoded tar archive
+
+    Raises:
+        KeyError if there is no such file
+    """
+    offset, size = members(path)[name]
+    return read_range(path, offset, size)
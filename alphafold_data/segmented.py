@@ -0,0 +1,261 @@
+"""Built-in segmented HTTP downloader
+
+Downloads a file over several parallel connections using Range requests.
+Segments are written with positional writes into a preallocated `.partial`
+file. Their progress is saved periodically in a `.partial.state` sidecar, so
+an interrupted download resumes where it stopped, as long as the remote file
+is unchanged (same size, ETag and Last-Modified).
+
+Servers without Range support fall back to a single stream.
+"""
+
+import contextvars
+import http.client
+import json
+import logging
+import os
+import threading
+import time
+import urllib.error
+import urllib.request
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from . import telemetry, throttle
+from .checksum import FileFollower, Hasher
+from .engine import NETWORK
+from .util import atomic_write_text, preallocate
+
+_CHUNK_SIZE = 1 << 20
+_MIN_SEGMENT_SIZE = 8 << 20
+# Segments per connection, so that fast connections can pick up more work
+_SEGMENTS_PER_CONNECTION = 4
+_SAVE_INTERVAL = 2.0
+_RETRIES = 5
+_TIMEOUT = 60
+
+
+@dataclass
+class _Segment:
+    start: int
+    end: int  # exclusive
+    pos: int
+
+    @property
+    def done(self) -> bool:
+        return self.pos >= self.end
+
+
+@dataclass
+class _RemoteInfo:
+    size: int
+    ranges: bool
+    etag: str
+    last_modified: str
+
+    @classmethod
+    def fetch(kls, url: str) -> "_RemoteInfo":
+        request = urllib.request.Request(url, method="HEAD")
+        with urllib.request.urlopen(request, timeout=_TIMEOUT) as response:
+            headers = response.headers
+            return kls(
+                size=int(headers.get("Content-Length", -1)),
+                ranges=headers.get("Accept-Ranges", "none").lower() == "bytes",
+                etag=headers.get("ETag", ""),
+                last_modified=headers.get("Last-Modified", ""),
+            )
+
+
+class _State:
+    "Segment progress, persisted in a sidecar file"
+
+    def __init__(self, path: Path, url: str, remote: _RemoteInfo, segments):
+        self.path = path
+        self.url = url
+        self.remote = remote
+        self.segments: List[_Segment] = segments
+        self.lock = threading.Lock()
+
+    @classmethod
+    def plan(kls, path: Path, url: str, remote: _RemoteInfo, connections: int):
+        count = max(1, connections * _SEGMENTS_PER_CONNECTION)
+        size = max(_MIN_SEGMENT_SIZE, -(-remote.size // count))
+        segments = [
+            _Segment(start, min(start + size, remote.size), start)
+            for start in range(0, remote.size, size)
+        ]
+        return kls(path, url, remote, segments)
+
+    @classmethod
+    def load(kls, path: Path, url: str, remote: _RemoteInfo) -> Optional["_State"]:
+        "Load saved state, if it belongs to the same remote file"
+        try:
+            data = json.loads(path.read_text())
+        except (OSError, ValueError):
+            return None
+        if data.get("url") != url or data.get("remote") != asdict(remote):
+            return None
+        return kls(path, url, remote, [_Segment(**seg) for seg in data["segments"]])
+
+    def save(self) -> None:
+        with self.lock:
+            data: Dict = {
+                "url": self.url,
+                "remote": asdict(self.remote),
+                "segments": [asdict(seg) for seg in self.segments],
+            }
+        atomic_write_text(self.path, json.dumps(data))
+
+    @property
+    def done(self) -> bool:
+        return all(seg.done for seg in self.segments)
+
+    def downloaded(self) -> int:
+        "Number of bytes downloaded"
+        with self.lock:
+            return sum(seg.pos - seg.start for seg in self.segments)
+
+    def contiguous(self) -> int:
+        "Offset up to which the file is completely downloaded"
+        with self.lock:
+            for seg in sorted(self.segments, key=lambda seg: seg.start):
+                if not seg.done:
+                    return seg.pos
+        return self.remote.size
+
+
+def _fetch_segment(url: str, fd: int, segment: _Segment, state: _State) -> None:
+    request = urllib.request.Request(
+        url, headers={"Range": f"bytes={segment.pos}-{segment.end - 1}"}
+    )
+    with urllib.request.urlopen(request, timeout=_TIMEOUT) as response:
+        if response.status != 206:
+            raise IOError(f"Server ignored range request for {url}")
+        while not segment.done:
+            data = response.read(min(_CHUNK_SIZE, segment.end - segment.pos))
+            if not data:
+                raise http.client.IncompleteRead(b"", segment.end - segment.pos)
+            os.pwrite(fd, data, segment.pos)
+            throttle.consume(NETWORK, len(data))
+            with state.lock:
+                segment.pos += len(data)
+
+
+def _worker(url: str, fd: int, state: _State, queue: List[_Segment], errors):
+    while True:
+        with state.lock:
+            if not queue or errors:
+                return
+            segment = queue.pop(0)
+        for attempt in range(_RETRIES + 1):
+            try:
+                _fetch_segment(url, fd, segment, state)
+                break
+            except (OSError, http.client.HTTPException) as err:
+                if attempt >= _RETRIES:
+                    with state.lock:
+                        errors.append(err)
+                    return
+                logging.debug(f"Retrying segment {segment} of {url}: {err}")
+                telemetry.retry(url, attempt + 1, err)
+                time.sleep(min(2**attempt, 30))
+
+
+def _download_segmented(
+    url: str,
+    tmp: Path,
+    remote: _RemoteInfo,
+    connections: int,
+    hasher: Optional[Hasher] = None,
+):
+    state_path = tmp.with_name(tmp.name + ".state")
+    state = None
+    if tmp.exists() and tmp.stat().st_size == remote.size:
+        state = _State.load(state_path, url, remote)
+    if state is None:
+        state = _State.plan(state_path, url, remote, connections)
+        fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+        preallocate(fd, remote.size)
+    else:
+        logging.info(f"Resuming download of {url}")
+        fd = os.open(tmp, os.O_WRONLY)
+
+    follower = None
+    if hasher is not None:
+        follower = FileFollower(tmp, hasher, state.contiguous).start()
+    try:
+        queue = [seg for seg in state.segments if not seg.done]
+        errors: List[BaseException] = []
+        telemetry.report(state.downloaded, total=remote.size)
+        threads = [
+            threading.Thread(
+                target=contextvars.copy_context().run,
+                args=(_worker, url, fd, state, queue, errors),
+                daemon=True,
+            )
+            for _ in range(min(connections, len(queue)))
+        ]
+        for thread in threads:
+            thread.start()
+        while any(thread.is_alive() for thread in threads):
+            state.save()
+            for thread in threads:
+                thread.join(_SAVE_INTERVAL / len(threads))
+        state.save()
+        if errors:
+            raise errors[0]
+        if not state.done:
+            raise IOError(f"Incomplete download of {url}")
+        os.fsync(fd)
+        if follower is not None:
+            follower.finish(remote.size)
+    finally:
+        os.close(fd)
+        if follower is not None:
+            follower.stop()
+    state_path.unlink()
+
+
+def _download_single(url: str, tmp: Path, hasher: Optional[Hasher] = None) -> None:
+    if hasher is not None:
+        hasher.reset()
+    with urllib.request.urlopen(url, timeout=_TIMEOUT) as response:
+        expected = int(response.headers.get("Content-Length", -1))
+        received = 0
+        with tmp.open("wb") as out:
+            telemetry.report(out.tell, total=expected if expected >= 0 else None)
+            for data in iter(lambda: response.read(_CHUNK_SIZE), b""):
+                out.write(data)
+                throttle.consume(NETWORK, len(data))
+                if hasher is not None:
+                    hasher.update(data)
+                received += len(data)
+    if expected >= 0 and received != expected:
+        raise http.client.IncompleteRead(b"", expected - received)
+
+
+def download_native(
+    url: str, dst: Path, connections: int = 8, hasher: Optional[Hasher] = None
+) -> None:
+    """Download a file with the built-in segmented downloader
+
+    Args:
+    - url: url of the file
+    - dst: filename to save as. Must be a file, not a directory.
+    - connections: number of parallel connections
+    - hasher: if given, the file is hashed while it is downloaded
+    """
+    dst.parent.mkdir(parents=True, exist_ok=True)
+    tmp = dst.with_name(dst.name + ".partial")
+    try:
+        remote = _RemoteInfo.fetch(url)
+    except (urllib.error.HTTPError, ValueError):
+        # e.g. HEAD not allowed
+        remote = _RemoteInfo(size=-1, ranges=False, etag="", last_modified="")
+    logging.debug(f"Downloading {url} with {connections} connections")
+    if remote.ranges and remote.size > 0:
+        _download_segmented(url, tmp, remote, connections, hasher)
+    else:
+        _download_single(url, tmp, hasher)
+    tmp.rename(dst)
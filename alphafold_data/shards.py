@@ -0,0 +1,202 @@
+"""Sharded copies of large FASTA files
+
+Searches like jackhmmer are parallelized by splitting the database into
+shards. `FastaSharder` writes the shards while the FASTA is decompressed, so
+they are ready without another pass over the file. Shards are contiguous
+pieces of the FASTA, split at record boundaries, and balanced by size: shard
+i starts at the first record after i/N of the expected size. The expected
+size is exact for seekable zstd archives and estimated for gzip, so the last
+shards may be somewhat larger or smaller than the others.
+
+Shards go into a directory next to the FASTA, with a manifest::
+
+    mgy_clusters_2022_05.fa
+    mgy_clusters_2022_05.shards/
+        mgy_clusters_2022_05.000.fa
+        ...
+        manifest.json
+
+The manifest lists each shard's file name, number of records and byte range
+`[start, end)` in the FASTA, as well as the size and mtime of the FASTA, so
+that outdated shards are detected (see `shards_current`). Files with fewer
+records than requested shards get fewer shards.
+"""
+
+import json
+import logging
+import os
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import BinaryIO, List, Optional
+
+from .util import atomic_write_text, remove_path
+
+MANIFEST_NAME = "manifest.json"
+
+_CHUNK_SIZE = 16 << 20
+
+
+@dataclass
+class Shard:
+    """One piece of a sharded FASTA
+
+    Attributes:
+    - path: file name, relative to the shards directory
+    - records: number of records
+    - start: offset of the first byte in the FASTA
+    - end: offset after the last byte in the FASTA
+    """
+
+    path: str
+    records: int
+    start: int
+    end: int
+
+
+def shards_dir(fasta: Path) -> Path:
+    "Directory holding the shards of fasta"
+    return fasta.with_name(fasta.stem + ".shards")
+
+
+def read_manifest(fasta: Path) -> Optional[List[Shard]]:
+    "The shards of fasta, or None if it was not sharded"
+    try:
+        data = json.loads((shards_dir(fasta) / MANIFEST_NAME).read_text())
+    except (FileNotFoundError, ValueError):
+        return None
+    return [Shard(**shard) for shard in data["shards"]]
+
+
+class FastaSharder:
+    """Split FASTA data written in arbitrary chunks into shards
+
+    Pass `write` as a tee to the decompressor, then call `save` once the
+    FASTA is complete. Shards are written to a temporary directory which
+    replaces the shards directory on `save`.
+
+    Args:
+    - fasta: the FASTA file being written
+    - shards: number of shards
+    - expected: expected size of the FASTA in bytes
+    """
+
+    def __init__(self, fasta: Path, shards: int, expected: int):
+        self.fasta = fasta
+        self.directory = shards_dir(fasta)
+        self.tmp = self.directory.with_name(self.directory.name + ".partial")
+        remove_path(self.tmp)
+        self.tmp.mkdir(parents=True)
+        self.requested = shards
+        self.boundaries = [expected * i // shards for i in range(1, shards)]
+        # minimum shard size, in case expected was too small
+        self.minimum = expected // shards // 2
+        self.shards: List[Shard] = []
+        self.offset = 0
+        self._last_newline = True
+        self._file: Optional[BinaryIO] = None
+        self._open()
+
+    def _open(self) -> None:
+        if self._file is not None:
+            self._file.close()
+        name = f"{self.fasta.stem}.{len(self.shards):03d}{self.fasta.suffix}"
+        self._file = (self.tmp / name).open("wb")
+        self.shards.append(Shard(name, 0, self.offset, self.offset))
+
+    def _append(self, data: bytes) -> None:
+        if not data:
+            return
+        assert self._file is not None
+        self._file.write(data)
+        shard = self.shards[-1]
+        shard.records += data.count(b"\n>")
+        if self._last_newline and data[:1] == b">":
+            shard.records += 1
+        shard.end += len(data)
+        self.offset += len(data)
+        self._last_newline = data[-1:] == b"\n"
+
+    def _split(self, data: bytes) -> int:
+        "Position in data where the next shard starts, or -1"
+        if len(self.shards) > len(self.boundaries):
+            return -1
+        current = self.shards[-1]
+        boundary = self.boundaries[len(self.shards) - 1]
+        start = max(boundary, current.start + self.minimum) - self.offset
+        if start >= len(data):
+            return -1
+        if current.records == 0:
+            # keep at least one record per shard
+            start = max(start, 1)
+        elif start <= 0 and self._last_newline and data[:1] == b">":
+            return 0
+        hit = data.find(b"\n>", max(0, start - 1))
+        return hit + 1 if hit >= 0 else -1
+
+    def write(self, data: bytes) -> None:
+        while True:
+            split = self._split(data)
+            if split < 0:
+                break
+            self._append(data[:split])
+            data = data[split:]
+            self._open()
+        self._append(data)
+
+    def save(self) -> List[Shard]:
+        """Finish the shards of the completed FASTA and write the manifest
+
+        Returns:
+            the shards
+        """
+        assert self._file is not None
+        self._file.close()
+        stat = self.fasta.stat()
+        if stat.st_size != self.offset:
+            raise ValueError(
+                f"{self.fasta} has {stat.st_size} bytes, but {self.offset}"
+                " were sharded"
+            )
+        manifest = {
+            "fasta": self.fasta.name,
+            "size": stat.st_size,
+            "mtime_ns": stat.st_mtime_ns,
+            "records": sum(shard.records for shard in self.shards),
+            "requested": self.requested,
+            "shards": [asdict(shard) for shard in self.shards],
+        }
+        atomic_write_text(self.tmp / MANIFEST_NAME, json.dumps(manifest, indent=1))
+        remove_path(self.directory)
+        os.rename(self.tmp, self.directory)
+        logging.info(f"Wrote {len(self.shards)} shards of {self.fasta}")
+        return self.shards
+
+
+def shard_fasta(fasta: Path, shards: int) -> List[Shard]:
+    "Shard an existing FASTA file"
+    sharder = FastaSharder(fasta, shards, fasta.stat().st_size)
+    with fasta.open("rb") as f:
+        for data in iter(lambda: f.read(_CHUNK_SIZE), b""):
+            sharder.write(data)
+    return sharder.save()
+
+
+def shards_current(fasta: Path, shards: int) -> bool:
+    "Check whether fasta has as many shards as requested, matching the file"
+    try:
+        manifest = json.loads((shards_dir(fasta) / MANIFEST_NAME).read_text())
+        stat = fasta.stat()
+    except (FileNotFoundError, ValueError):
+        return False
+    return (
+        manifest.get("size") == stat.st_size
+        and manifest.get("mtime_ns") == stat.st_mtime_ns
+        and manifest.get("requested") == shards
+    )
+
+
+def ensure_shards(fasta: Path, shards: int) -> None:
+    "Shard fasta, unless the shards are up to date"
+    if not shards_current(fasta, shards):
+        logging.info(f"Shards of {fasta} are missing or outdated, rebuilding")
+        shard_fasta(fasta, shards)
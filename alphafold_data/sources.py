@@ -1,83 +1,220 @@
+import contextvars
+import datetime
+import functools
 import logging
 import os
-from dataclasses import dataclass
+import shutil
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
 from pathlib import Path
-from subprocess import run
-from typing import Dict
+from typing import Callable, ClassVar, Dict, List, Optional
 
+from . import engine, ffindex, seekable, telemetry, throttle
+from .cache import DownloadCache, validator
+from .checksum import (
+    ChecksumError,
+    FileFollower,
+    Hasher,
+    Manifest,
+    check_digests,
+    hash_file,
+)
+from .fasta import FastaIndex, FastaIndexer, ensure_index
+from .ffindex import FFIndexError
+from .gunzip import GunzipStats, gunzip, gunzip_concat
+from .mmcif import decompress_mmcif, download_rsync, previous_version
+from .segmented import download_native
+from .shards import FastaSharder, Shard, ensure_shards, read_manifest
+from .state import (
+    DOWNLOADED,
+    EXTRACTED,
+    TRANSCODED,
+    VALIDATED,
+    VERIFIED,
+    StateDB,
+    path_size,
+)
+from .streaming import stream_gunzip, stream_tar, stream_tgz
+from .untar import extract_tar_stream, extract_tgz, extraction_incomplete
+from .util import remove_path, url_size
 
-def download_rsync(url: str, dst: Path) -> None:
-    dst.parent.mkdir(parents=True, exist_ok=True)
-    cmd = [
-        "rsync",
-        url,
-        str(dst),
-    ]
-    logging.info(" ".join(cmd))
-    raise IOError("Not implemented")
 
+def _partial_size(path: Path) -> int:
+    try:
+        return path.stat().st_size
+    except FileNotFoundError:
+        return 0
 
-def download_curl(url: str, dst: Path) -> None:
+
+def download_curl(url: str, dst: Path, hasher: Optional[Hasher] = None) -> None:
     dst.parent.mkdir(parents=True, exist_ok=True)
     tmp = dst.with_name(dst.name + ".partial")
     curl = os.environ.get("CURL_EXE", "curl")
-    cmd = [curl, "-o", str(tmp), url]
-    logging.debug("Running: " + " ".join(cmd))
-    result = run(cmd)
-    result.check_returncode()
+    cmd = [curl, "--silent", "--show-error", "--fail", "-o", str(tmp), url]
+    telemetry.report(lambda: _partial_size(tmp))
+    with throttle.governor().tool(engine.NETWORK) as rate:
+        if rate:
+            cmd[1:1] = ["--limit-rate", str(rate)]
+        if hasher is not None:
+            # curl writes sequentially, so hash behind it
+            with FileFollower(tmp, hasher, lambda: _partial_size(tmp)) as follower:
+                result = engine.run(cmd, engine.NETWORK)
+                result.check_returncode()
+                follower.finish()
+        else:
+            result = engine.run(cmd, engine.NETWORK)
+            result.check_returncode()
     tmp.rename(dst)
 
 
+@functools.lru_cache(maxsize=None)
 def _has_aria2c():
     if "ARIA2C_EXE" in os.environ:
         return True
     try:
-        run(["aria2c", "--version"], capture_output=True)
+        # not through the engine, which would queue it behind extractions
+        subprocess.run(["aria2c", "--version"], capture_output=True)
         return True
     except FileNotFoundError:
         return False
 
 
-def download_aria2c(url: str, dst: Path) -> None:
+def download_aria2c(
+    url: str, dst: Path, hasher: Optional[Hasher] = None, connections: int = 5
+) -> None:
     dst.parent.mkdir(parents=True, exist_ok=True)
     tmp = dst.with_name(dst.name + ".partial")
     aria2c = os.environ.get("ARIA2C_EXE", "aria2c")
+    connections = max(1, min(connections, 16))  # aria2c's limit
     cmd = [
         aria2c,
         url,
         "--out",
         str(tmp),
-        "--max-connection-per-server=5",
+        f"--max-connection-per-server={connections}",
+        f"--split={connections}",
+        "--summary-interval=0",
     ]
-    logging.debug("Running: " + " ".join(cmd))
-    result = run(cmd)
+    with throttle.governor().tool(engine.NETWORK) as rate:
+        if rate:
+            cmd.append(f"--max-overall-download-limit={rate}")
+        result = engine.run(cmd, engine.NETWORK)
     result.check_returncode()
+    if hasher is not None:
+        # aria2c writes out of order; hash afterwards
+        hasher.reset()
+        hasher.update_from_file(tmp)
     tmp.rename(dst)
 
 
-_file_downloader = None
+MMCIF_RSYNC_URL = "rsync://rsync.rcsb.org:33444/ftp_data/structures/divided/mmCIF/"
+
+UNIPROT_URL = (
+    "https://ftp.ebi.ac.uk/pub/databases/uniprot/current_release/"
+    "knowledgebase/complete"
+)
+
+_file_downloader: Optional[Callable[..., None]] = None
+_download_cache: Optional[DownloadCache] = None
+_fasta_shards = 0
+
+# Available backends for download_file, by name
+downloaders: Dict[str, Callable[..., None]] = {
+    "aria2c": download_aria2c,
+    "curl": download_curl,
+    "native": download_native,
+}
+
+
+def available_downloaders() -> Dict[str, Callable[..., None]]:
+    "Backends from `downloaders` which can run here, in order of preference"
+    available = dict(downloaders)
+    if not _has_aria2c():
+        del available["aria2c"]
+    if shutil.which(os.environ.get("CURL_EXE", "curl")) is None:
+        del available["curl"]
+    return available
+
+
+def set_downloader(downloader: Optional[Callable[..., None]]) -> None:
+    """Use downloader for all following downloads
+
+    None restores the default choice. See `alphafold_data.adaptive` for a
+    downloader which adapts to each host.
+    """
+    global _file_downloader
+    _file_downloader = downloader
+
+
+def set_download_cache(cache: Optional[DownloadCache]) -> None:
+    "Share downloads through cache (see `alphafold_data.cache`), or None"
+    global _download_cache
+    _download_cache = cache
+
 
+def set_fasta_shards(shards: int) -> None:
+    """Also split indexed FASTA databases into this many shards, 0 for none
 
-def download_file(url: str, dst: Path) -> None:
+    See `alphafold_data.shards`.
+    """
+    global _fasta_shards
+    _fasta_shards = shards
+
+
+def fasta_shards() -> int:
+    "Number of shards set with `set_fasta_shards`"
+    return _fasta_shards
+
+
+def download_file(url: str, dst: Path, hasher: Optional[Hasher] = None) -> None:
     """Download a file
 
-    Uses aria2c if possible, otherwise curl
+    Uses the downloader given to `set_downloader`. By default that is aria2c
+    if possible, otherwise the built-in segmented downloader. A specific
+    backend from `downloaders` can be chosen with the AFD_DOWNLOADER
+    environment variable. With a download cache (`set_download_cache`), the
+    file is taken from the cache if it holds the current version, and
+    published to it otherwise.
 
     Args:
     - url: url of the file
     - dst: filename to save as. Must be a file, not a directory.
+    - hasher: if given, is fed the file contents (during the download, if the
+      backend supports it)
     """
     global _file_downloader
     if _file_downloader is None:
-        if _has_aria2c():
+        if "AFD_DOWNLOADER" in os.environ:
+            _file_downloader = downloaders[os.environ["AFD_DOWNLOADER"]]
+        elif _has_aria2c():
             _file_downloader = download_aria2c
         else:
-            _file_downloader = download_curl
-    _file_downloader(url, dst)
+            _file_downloader = download_native
+    cache = _download_cache
+    with telemetry.stage("download", dst.name, total=url_size(url)):
+        current = validator(url) if cache is not None else ""
+        if cache is not None and cache.fetch(url, dst, current, hasher=hasher):
+            return
+        _file_downloader(url, dst, hasher=hasher)
+        if cache is not None:
+            digests = hasher.hexdigests() if hasher is not None else {}
+            cache.publish(url, dst, current, digests)
 
 
 def decompress_tar(src: Path, dst: Path) -> None:
+    """Extract an uncompressed tar archive
+
+    Uses tar, or the built-in extractor if the disk rate is limited, since
+    tar can't be throttled.
+    """
     dst.mkdir(parents=True, exist_ok=True)
+    if throttle.governor().limited(engine.DISK):
+        with engine.slot(engine.DISK), telemetry.stage("decompress", src.name):
+            with src.open("rb") as f:
+                reader = throttle.Throttled(f, engine.DISK)
+                extract_tar_stream(reader, dst)  # type: ignore
+        return
     cmd = [
         "tar",
         "-xvf",
@@ -86,19 +223,102 @@ def decompress_tar(src: Path, dst: Path) -> None:
         os.path.join(dst, ""),
         "--preserve-permissions",
     ]
-    logging.debug("Running: " + " ".join(cmd))
-    result = run(cmd)
+    with telemetry.stage("decompress", src.name, probe=lambda: path_size(dst)):
+        result = engine.run(cmd, engine.DISK)
     result.check_returncode()
 
 
-def decompress_gunzip(src: Path, dst: Path) -> None:
-    raise NotImplementedError()
+class _FastaOutput:
+    """Index a FASTA while it is written, and shard it if enabled
+
+    Args:
+    - dst: the FASTA file
+    - expected: expected size of the FASTA, to balance the shards
+    """
+
+    def __init__(self, dst: Path, expected: int):
+        self.dst = dst
+        self.indexer = FastaIndexer()
+        self.sharder: Optional[FastaSharder] = None
+        if _fasta_shards:
+            self.sharder = FastaSharder(dst, _fasta_shards, expected)
+
+    def write(self, data: bytes) -> None:
+        self.indexer.write(data)
+        if self.sharder is not None:
+            self.sharder.write(data)
+
+    def save(self) -> None:
+        self.indexer.save(self.dst)
+        if self.sharder is not None:
+            self.sharder.save()
+
+
+def decompress_gunzip(
+    src: Path, dst: Path, index=False, expected: int = 0
+) -> GunzipStats:
+    """Decompress a .gz file
+
+    Uses pigz if possible, otherwise a multi-threaded in-process inflate.
+    See `alphafold_data.gunzip`.
+
+    Args:
+    - index: build a FASTA offset index in the same pass (see
+      `alphafold_data.fasta`), and the shards if enabled (see
+      `set_fasta_shards`)
+    - expected: estimated uncompressed size, to balance the shards.
+      Defaults to three times the compressed size.
+    """
+    with engine.slot(engine.DISK), telemetry.stage("decompress", src.name):
+        if not index:
+            return gunzip(src, dst)
+        output = _FastaOutput(dst, expected or 3 * src.stat().st_size)
+        stats = gunzip(src, dst, tee=output.write)
+        output.save()
+        return stats
 
 
 def decompress_tgz(src: Path, dst: Path) -> None:
-    dst.parent.mkdir(parents=True, exist_ok=True)
-    logging.info("decompress tgz")
-    raise NotImplementedError()
+    """Extract a .tar.gz archive
+
+    Decompresses in a single pass and writes members in parallel. Interrupted
+    extractions resume after the last completed member. See
+    `alphafold_data.untar`.
+    """
+    logging.info(f"Extracting {src} to {dst}")
+    with engine.slot(engine.DISK), telemetry.stage("decompress", src.name):
+        extract_tgz(src, dst)
+
+
+def decompress_zstd(src: Path, dst: Path, index=False) -> GunzipStats:
+    """Decompress a seekable zstd file on all cores
+
+    See `alphafold_data.seekable`. index is as for `decompress_gunzip`.
+    """
+    with engine.slot(engine.DISK), telemetry.stage("decompress", src.name):
+        if not index:
+            return seekable.decompress(src, dst)
+        output = _FastaOutput(dst, seekable.SeekTable.load(src).size)
+        stats = seekable.decompress(src, dst, tee=output.write)
+        output.save()
+        return stats
+
+
+def decompress_zstd_tar(src: Path, dst: Path) -> None:
+    "Extract a tar archive transcoded to seekable zstd, as `decompress_tgz`"
+    logging.info(f"Extracting {src} to {dst}")
+    with engine.slot(engine.DISK), telemetry.stage("decompress", src.name):
+        with seekable.open_decompressed(src) as stream:
+            extract_tar_stream(stream, dst)  # type: ignore
+
+
+def _on_disk(path: Path) -> bool:
+    "Check for a complete file or non-empty directory"
+    if path.is_dir():
+        if extraction_incomplete(path):
+            return False
+        return next(path.iterdir(), None) is not None
+    return path.is_file()
 
 
 @dataclass
@@ -107,53 +327,393 @@ class Source:
     url: str
     compressed: Path
     uncompressed: Path
+    # Expected digests of the compressed file, by hashlib algorithm name
+    checksums: Dict[str, str] = field(default_factory=dict)
+    # Whether `uncompressed` is a FASTA file to index for lookups by ID
+    index_fasta: ClassVar[bool] = False
+    # Typical ratio of uncompressed to compressed size, for disk planning
+    expansion: ClassVar[float] = 3.0
+    # Whether the compressed files can be deleted once extracted
+    prunable: ClassVar[bool] = True
+    # Whether stream() works without writing the compressed files
+    streamable: ClassVar[bool] = True
+    # Name of the link in version trees, if not the source's name
+    link_name: ClassVar[str] = ""
+    # Whether the compressed file can be transcoded to seekable zstd
+    transcodable: ClassVar[bool] = True
+    # Whether `uncompressed` is an HH-suite database to check with `validate`
+    hhsuite: ClassVar[bool] = False
 
     @classmethod
-    def _force_download(kls, url: str, dst: Path):
-        return download_file(url, dst)
+    def _force_download(kls, url: str, dst: Path, hasher: Optional[Hasher] = None):
+        return download_file(url, dst, hasher=hasher)
 
     def download(self, data_dir: Path, force=False):
         "Download compressed files"
         if force or not (
-            self.uncompressed_available(data_dir) or self.compressed_available(data_dir)
+            self.uncompressed_available(data_dir)
+            or self.compressed_available(data_dir)
+            or self.transcoded_available(data_dir)
         ):
-            self._force_download(self.url, Path(data_dir, self.compressed))
+            state = StateDB(data_dir)
+            state.clear(self.compressed)
+            state.start(self.compressed, DOWNLOADED)
+            dst = Path(data_dir, self.compressed)
+            hasher = Hasher()
+            self._force_download(self.url, dst, hasher=hasher)
+            self._check_download(data_dir, hasher.hexdigests())
+
+    def _check_download(self, data_dir: Path, digests: Dict[str, str]) -> None:
+        """Check freshly computed digests of the compressed file
+
+        Mismatching files are kept as `<name>.bad` for inspection, so that a
+        wrong checksum doesn't silently throw away a large download. Good ones
+        are added to the manifest and recorded as downloaded (and verified, if
+        checksums are known).
+        """
+        path = Path(data_dir, self.compressed)
+        state = StateDB(data_dir)
+        try:
+            check_digests(path, digests, self.checksums)
+        except ChecksumError:
+            bad = path.with_name(path.name + ".bad")
+            os.replace(path, bad)
+            logging.error(f"Checksum mismatch, kept the download as {bad}")
+            state.clear(self.compressed)
+            raise
+        Manifest(data_dir).record(self.compressed, digests)
+        size = path.stat().st_size
+        state.finish(self.compressed, DOWNLOADED, size)
+        if self.checksums:
+            state.finish(self.compressed, VERIFIED, size)
+
+    def verify(self, data_dir: Path, full=False) -> None:
+        """Check the compressed file against the expected checksums
+
+        Digests from the manifest are reused if the file is unchanged since it
+        was hashed, unless full is set. Without expected checksums, the digests
+        are only recorded and the file isn't marked as verified.
+
+        Raises:
+            ChecksumError on mismatch
+        """
+        if (
+            not self.compressed_available(data_dir)
+            or Path(data_dir, self.compressed).is_dir()
+        ):
+            return
+        manifest = Manifest(data_dir)
+        state = StateDB(data_dir)
+        path = Path(data_dir, self.compressed)
+        digests = None if full else manifest.get(self.compressed)
+        if digests is None:
+            logging.info(f"Hashing {path}")
+            with telemetry.stage("verify", path.name, total=path.stat().st_size):
+                digests = hash_file(path)
+            manifest.record(self.compressed, digests)
+        if not self.checksums:
+            logging.info(f"No checksums known for {path}, nothing to verify against")
+            return
+        try:
+            check_digests(path, digests, self.checksums)
+        except ChecksumError:
+            state.clear(self.compressed, VERIFIED)
+            raise
+        state.finish(self.compressed, VERIFIED, path.stat().st_size)
 
     @classmethod
     def _force_decompress(kls, src: Path, dst: Path) -> None:
         return decompress_tgz(src, dst)
 
+    @classmethod
+    def _force_decompress_zstd(kls, src: Path, dst: Path) -> None:
+        return decompress_zstd_tar(src, dst)
+
     def decompress(self, data_dir: Path, force=False) -> None:
-        "Decompress compressed files"
-        if not self.compressed_available(data_dir):
+        """Decompress compressed files
+
+        The seekable zstd copy is used if there is one (see `transcode`).
+        """
+        if not force and self.uncompressed_available(data_dir):
+            self._ensure_shards(data_dir)
+            return
+        transcoded = seekable.available() and self.transcoded_available(data_dir)
+        if not transcoded and not self.compressed_available(data_dir):
             raise IOError(
                 f"Compressed file not found: {Path(data_dir, self.compressed)}"
             )
-        if force or not self.uncompressed_available(data_dir):
-            self._force_decompress(
-                Path(data_dir, self.compressed), Path(data_dir, self.uncompressed)
-            )
+        state = StateDB(data_dir)
+        state.start(self.uncompressed, EXTRACTED)
+        dst = Path(data_dir, self.uncompressed)
+        if transcoded:
+            self._force_decompress_zstd(Path(data_dir, self.transcoded), dst)
+        else:
+            self._force_decompress(Path(data_dir, self.compressed), dst)
+        state.finish(self.uncompressed, EXTRACTED, path_size(dst))
 
-    def prune(self, data_dir: Path):
-        raise NotImplementedError()
+    def transcode(self, data_dir: Path, remove=False, force=False) -> None:
+        """Rewrite the compressed file as seekable zstd
 
-    def compressed_available(self, data_dir: Path):
-        "Check if compressed files are downloaded"
-        out = Path(data_dir, self.compressed)
+        Later extractions read the zstd copy on all cores, and parts of it
+        can be read directly. See `alphafold_data.seekable`.
+
+        Args:
+        - remove: delete the original compressed file afterwards. It is not
+          downloaded again while the zstd copy exists, but can no longer be
+          verified against the upstream checksums.
+        """
+        if not self.transcodable:
+            return
+        state = StateDB(data_dir)
+        if force or not self.transcoded_available(data_dir):
+            if not self.compressed_available(data_dir):
+                raise IOError(
+                    f"Compressed file not found: {Path(data_dir, self.compressed)}"
+                )
+            src = Path(data_dir, self.compressed)
+            dst = Path(data_dir, self.transcoded)
+            state.start(self.transcoded, TRANSCODED)
+            with engine.slot(engine.DISK), telemetry.stage("transcode", src.name):
+                seekable.transcode(src, dst)
+            state.finish(self.transcoded, TRANSCODED, dst.stat().st_size)
+        path = Path(data_dir, self.compressed)
+        if remove and path.exists():
+            logging.info(f"Removing {path}")
+            remove_path(path)
+            state.clear(self.compressed)
+
+    @classmethod
+    def _force_stream(
+        kls, url: str, dst: Path, tee: Optional[Path], hasher: Optional[Hasher]
+    ) -> None:
+        return stream_tgz(url, dst, tee=tee, hasher=hasher)
+
+    def stream(self, data_dir: Path, keep_compressed=False, force=False) -> None:
+        """Download and decompress in a single pass
+
+        The compressed file is only written if keep_compressed is set. If it
+        was already downloaded it gets decompressed instead.
+        """
+        if not force and self.uncompressed_available(data_dir):
+            self._ensure_shards(data_dir)
+            return
+        if not force and (
+            self.compressed_available(data_dir) or self.transcoded_available(data_dir)
+        ):
+            return self.decompress(data_dir, force=force)
+        state = StateDB(data_dir)
+        tee = Path(data_dir, self.compressed) if keep_compressed else None
+        if tee is not None:
+            state.clear(self.compressed)
+            state.start(self.compressed, DOWNLOADED)
+        state.start(self.uncompressed, EXTRACTED)
+        dst = Path(data_dir, self.uncompressed)
+        hasher = Hasher()
+        with telemetry.stage("stream", Path(self.compressed).name):
+            self._force_stream(self.url, dst, tee, hasher)
+        digests = hasher.hexdigests()
+        try:
+            if tee is not None:
+                self._check_download(data_dir, digests)
+            else:
+                check_digests(dst, digests, self.checksums)
+        except ChecksumError:
+            remove_path(dst)
+            state.clear(self.uncompressed)
+            raise
+        if self.index_fasta:
+            ensure_index(dst)
+            self._ensure_shards(data_dir)
+        state.finish(self.uncompressed, EXTRACTED, path_size(dst))
+
+    def _ensure_shards(self, data_dir: Path) -> None:
+        "Shard a FASTA extracted without them, see `set_fasta_shards`"
+        if self.index_fasta and _fasta_shards:
+            ensure_shards(Path(data_dir, self.uncompressed), _fasta_shards)
+
+    def prune(self, data_dir: Path) -> int:
+        """Delete the compressed files once they are extracted
+
+        This includes the seekable zstd copy and its member list, if any. The
+        extraction is
+        re-checked on disk first. Digests stay in the manifest, so the archive
+        size remains known for planning.
+
+        Returns:
+            number of bytes freed
+        """
+        relpaths = [self.compressed]
+        if self.transcodable:
+            members = self.transcoded.name + seekable.MEMBERS_SUFFIX
+            relpaths += [self.transcoded, self.transcoded.with_name(members)]
+        found = [
+            relpath
+            for relpath in relpaths
+            if Path(data_dir, relpath).exists() or Path(data_dir, relpath).is_symlink()
+        ]
+        if not self.prunable or not found:
+            return 0
+        if not self.uncompressed_available(data_dir, deep=True):
+            logging.debug(f"Not pruning {self.compressed}: not extracted")
+            return 0
+        state = StateDB(data_dir)
+        size = 0
+        for relpath in found:
+            path = Path(data_dir, relpath)
+            size += path_size(path)
+            logging.info(f"Pruning {path}")
+            remove_path(path)
+            state.clear(relpath)
+        try:
+            # the version directory, if now empty
+            Path(data_dir, self.compressed).parent.rmdir()
+        except OSError:
+            pass
+        return size
+
+    def fasta(self, data_dir: Path) -> FastaIndex:
+        """Open the uncompressed FASTA for lookups by record ID
+
+        The index is rebuilt if the FASTA changed since it was indexed.
+        """
+        if not self.index_fasta:
+            raise ValueError(f"{type(self).__name__} is not an indexed FASTA")
+        return FastaIndex(Path(data_dir, self.uncompressed))
+
+    def fasta_shards(self, data_dir: Path) -> Optional[List[Shard]]:
+        "The shards of the uncompressed FASTA, or None if not sharded"
+        if not self.index_fasta:
+            raise ValueError(f"{type(self).__name__} is not an indexed FASTA")
+        return read_manifest(Path(data_dir, self.uncompressed))
+
+    def link_target(self, data_dir: Path) -> Path:
+        """What version trees link to, relative to data_dir
+
+        That is the extracted directory, or the directory containing the
+        extracted file, matching AlphaFold's usual layout.
+        """
+        if Path(data_dir, self.uncompressed).is_dir():
+            return self.uncompressed
+        return self.uncompressed.parent
+
+    def remote_size(self) -> int:
+        "Size of the download in bytes, or 0 if unknown"
+        return url_size(self.url)
+
+    def local_size(self, data_dir: Path) -> int:
+        "Size of the compressed file in bytes, or 0 if not downloaded"
+        path = Path(data_dir, self.compressed)
+        return path.stat().st_size if path.is_file() else 0
+
+    def recorded_size(self, data_dir: Path) -> int:
+        "Size of the compressed file when last downloaded, or 0 if unknown"
+        return Manifest(data_dir).size(self.compressed) or 0
+
+    def estimated_size(self, data_dir: Path) -> int:
+        "Rough download size if it can't be determined beforehand, or 0"
+        return 0
 
-        # file or non-empty directory
-        return out.exists() and (out.is_file() or next(out.iterdir(), None) is not None)
+    @staticmethod
+    def _stage_available(data_dir: Path, relpath: Path, stage: str, deep: bool):
+        """Check a stage against the state database
 
-    def uncompressed_available(self, data_dir: Path):
+        Paths without any record (e.g. installs predating the database) are
+        checked on disk once and imported. With deep, the filesystem is
+        always checked and the database corrected to match.
+        """
+        state = StateDB(data_dir)
+        record = state.get(relpath, stage)
+        if not deep and record is not None:
+            return record.done
+        if record is not None and not record.done:
+            # started but never finished (or still running)
+            return False
+
+        path = Path(data_dir, relpath)
+        if not _on_disk(path):
+            if record is not None:
+                state.clear(relpath, stage)
+            return False
+        size = path_size(path)
+        if record is None:
+            state.finish(relpath, stage, size)
+        elif record.size != size:
+            logging.warning(f"{path} changed size since it was recorded")
+            state.clear(relpath, stage)
+            return False
+        return True
+
+    def compressed_available(self, data_dir: Path, deep=False):
+        "Check if compressed files are downloaded"
+        return self._stage_available(data_dir, self.compressed, DOWNLOADED, deep)
+
+    def uncompressed_available(self, data_dir: Path, deep=False):
         "Check if uncompressed files are available"
-        out = Path(data_dir, self.uncompressed)
+        return self._stage_available(data_dir, self.uncompressed, EXTRACTED, deep)
+
+    @property
+    def transcoded(self) -> Path:
+        "Path of the seekable zstd copy of the compressed file"
+        name = self.compressed.name
+        if name.endswith(".gz"):
+            name = name[: -len(".gz")]
+        return self.compressed.with_name(name + ".zst")
 
-        # file or non-empty directory
-        return out.exists() and (out.is_file() or next(out.iterdir(), None) is not None)
+    def transcoded_available(self, data_dir: Path, deep=False):
+        "Check if the compressed file was transcoded to seekable zstd"
+        if not self.transcodable:
+            return False
+        return self._stage_available(data_dir, self.transcoded, TRANSCODED, deep)
+
+    def verified(self, data_dir: Path) -> bool:
+        "Check if the compressed file passed verification"
+        return StateDB(data_dir).done(self.compressed, VERIFIED)
+
+    def validate(self, data_dir: Path, full=False) -> None:
+        """Check the extracted HH-suite database, see `alphafold_data.ffindex`
+
+        Unsorted index files are rewritten sorted. A passed check is reused
+        until the source is extracted again, unless full is set. Other
+        sources are skipped.
+
+        Raises:
+            FFIndexError if the database is inconsistent
+        """
+        if not self.hhsuite or not self.uncompressed_available(data_dir):
+            return
+        if not full and self.validated(data_dir):
+            return
+        state = StateDB(data_dir)
+        path = Path(data_dir, self.uncompressed)
+        state.start(self.uncompressed, VALIDATED)
+        with engine.slot(engine.DISK), telemetry.stage("validate", path.name):
+            with throttle.governor().threads() as threads:
+                reports = ffindex.validate(path, jobs=threads)
+        for report in reports:
+            logging.info(str(report))
+        invalid = [report for report in reports if not report.ok]
+        if invalid:
+            state.clear(self.uncompressed, VALIDATED)
+            raise FFIndexError(
+                f"{path} is inconsistent: " + "; ".join(map(str, invalid))
+            )
+        state.finish(self.uncompressed, VALIDATED, path_size(path))
+
+    def validated(self, data_dir: Path) -> bool:
+        "Check if the extraction passed `validate` since it was last extracted"
+        state = StateDB(data_dir)
+        validated = state.get(self.uncompressed, VALIDATED)
+        extracted = state.get(self.uncompressed, EXTRACTED)
+        if validated is None or extracted is None:
+            return False
+        if validated.completed is None or extracted.completed is None:
+            return False
+        return validated.completed >= extracted.completed
 
 
 class ParamSource(Source):
     version: str
+    expansion = 1.0
 
     def __init__(self, version: str):
         url = f"https://storage.googleapis.com/alphafold/alphafold_params_{version}.tar"
@@ -171,8 +731,17 @@ class ParamSource(Source):
     def _force_decompress(kls, src: Path, dst: Path) -> None:
         return decompress_tar(src, dst)
 
+    @classmethod
+    def _force_stream(
+        kls, url: str, dst: Path, tee: Optional[Path], hasher: Optional[Hasher]
+    ) -> None:
+        return stream_tar(url, dst, tee=tee, hasher=hasher)
+
 
 class BFDSource(Source):
+    expansion = 6.6
+    hhsuite = True
+
     def __init__(self, version: str):
         if version != "6a634dc6eb105c2e9b4cba7bbae93412":
             raise ValueError(f"URL not known for BDF version {version}")
@@ -193,10 +762,11 @@ class BFDSource(Source):
         )
         self.version = version
 
-    # TODO check md5 hash in download
-
 
 class MgnifySource(Source):
+    index_fasta = True
+    expansion = 1.8
+
     def __init__(self, version: str, alphafold_version="casp14_versions"):
         super().__init__(
             flag="mgnify_database_path",
@@ -215,39 +785,245 @@ class MgnifySource(Source):
 
     @classmethod
     def _force_decompress(kls, src: Path, dst: Path) -> None:
-        return decompress_gunzip(src, dst)
+        expected = int(src.stat().st_size * kls.expansion)
+        decompress_gunzip(src, dst, index=kls.index_fasta, expected=expected)
+
+    @classmethod
+    def _force_decompress_zstd(kls, src: Path, dst: Path) -> None:
+        decompress_zstd(src, dst, index=kls.index_fasta)
+
+    @classmethod
+    def _force_stream(
+        kls, url: str, dst: Path, tee: Optional[Path], hasher: Optional[Hasher]
+    ) -> None:
+        return stream_gunzip(url, dst, tee=tee, hasher=hasher)
 
 
 class PDB70Source(Source):
+    expansion = 2.9
+    hhsuite = True
+
     def __init__(self, version: str):
         super().__init__(
             flag="pdb70_database_path",
             url=f"http://wwwuser.gwdg.de/~compbiol/data/hhsuite/databases/hhsuite_dbs/"
             f"old-releases/pdb70_from_mmcif_{version}.tar.gz",
             compressed=Path(f"compressed/pdb70/{version}/" f"pdb70_from_mmcif.tar.gz"),
-            uncompressed=Path(f"uncompressed/mgnify/{version}/" f"pdb70_from_mmcif"),
+            uncompressed=Path(f"uncompressed/pdb70/{version}/" f"pdb70_from_mmcif"),
         )
         self.version = version
 
 
-# class TemplateMMcifSource(Source):
-#     def __init__(self, version: str):
-#         super().__init__(
-#             flag="template_mmcif_dir",
-#             url="rsync.ebi.ac.uk::pub/databases/pdb/data/structures/divided/mmCIF/",
-#             compressed=Path(
-#                 f"compressed/mgnify/{version}/"
-#                 "mgy_clusters_{version}.fa.gz"
-#             ),
-#             uncompressed=Path(
-#                 f"uncompressed/mgnify/{version}/"
-#                 "mgy_clusters.fa"
-#             ),
-#         )
-#         self.version = version
+class TemplateMMcifSource(Source):
+    """Divided mmCIF tree, mirrored with rsync and expanded to mmcif_files/
+
+    Versions are weekly snapshots. Each new version only transfers and
+    expands the files which changed since the previous one. The mirror is
+    kept, since the next version is synced against it.
+    """
+
+    expansion = 5.5
+    prunable = False
+    streamable = False
+    transcodable = False
+    link_name = "pdb_mmcif"
+    # Size of a full mirror, from AlphaFold's README, for fresh installs
+    full_size: ClassVar[int] = 43_000_000_000
+
+    def __init__(self, version: str, url: str = MMCIF_RSYNC_URL):
+        super().__init__(
+            flag="template_mmcif_dir",
+            url=url,
+            compressed=Path(f"compressed/pdb/{version}/raw"),
+            uncompressed=Path(f"uncompressed/pdb/{version}/mmcif_files"),
+        )
+        self.version = version
+
+    @staticmethod
+    def weekly_version(today: Optional[datetime.date] = None) -> str:
+        "Date of the most recent weekly PDB release (Wednesdays)"
+        today = today or datetime.date.today()
+        days_since = (today.weekday() - 2) % 7
+        return (today - datetime.timedelta(days=days_since)).isoformat()
+
+    def estimated_size(self, data_dir: Path) -> int:
+        """Size of the previous version's mirror, or of a full mirror
+
+        rsync can't tell the size beforehand. Since unchanged files are
+        hardlinked, this overestimates incremental updates.
+        """
+        previous = previous_version(Path(data_dir, self.compressed))
+        if previous is not None:
+            return path_size(previous)
+        return self.full_size
+
+    def download(self, data_dir: Path, force=False):
+        "Mirror the mmCIF tree, hardlinking files unchanged since the last version"
+        if not force and (
+            self.uncompressed_available(data_dir) or self.compressed_available(data_dir)
+        ):
+            return
+        state = StateDB(data_dir)
+        state.clear(self.compressed)
+        state.start(self.compressed, DOWNLOADED)
+        dst = Path(data_dir, self.compressed)
+        with telemetry.stage("download", dst.name):
+            download_rsync(self.url, dst, link_dest=previous_version(dst))
+        state.finish(self.compressed, DOWNLOADED, path_size(dst))
+
+    @classmethod
+    def _force_decompress(kls, src: Path, dst: Path) -> None:
+        with engine.slot(engine.DISK), telemetry.stage("decompress", src.name):
+            decompress_mmcif(src, dst, previous=previous_version(dst))
+
+    def stream(self, data_dir: Path, keep_compressed=False, force=False) -> None:
+        "Mirrors can't be streamed; sync and then expand"
+        self.download(data_dir, force=force)
+        self.decompress(data_dir, force=force)
+
+
+class MultiSource(Source):
+    """Several gzipped files, decompressed and concatenated into one output
+
+    The parts are downloaded concurrently into the `compressed` directory.
+    They are then inflated in order straight into the `uncompressed` file.
+    """
+
+    urls: List[str]
+    parts: List[str]
+    streamable = False
+    transcodable = False
+
+    def __init__(
+        self, flag: str, urls: List[str], compressed: Path, uncompressed: Path
+    ):
+        super().__init__(
+            flag=flag, url=urls[0], compressed=compressed, uncompressed=uncompressed
+        )
+        self.urls = urls
+        self.parts = [url.rsplit("/", 1)[-1] for url in urls]
+
+    def _part_paths(self) -> List[Path]:
+        return [Path(self.compressed, part) for part in self.parts]
+
+    def _download_part(self, data_dir: Path, url: str, relpath: Path, force: bool):
+        if not force and self._stage_available(data_dir, relpath, DOWNLOADED, False):
+            return
+        state = StateDB(data_dir)
+        state.clear(relpath)
+        state.start(relpath, DOWNLOADED)
+        dst = Path(data_dir, relpath)
+        hasher = Hasher()
+        self._force_download(url, dst, hasher=hasher)
+        Manifest(data_dir).record(relpath, hasher.hexdigests())
+        state.finish(relpath, DOWNLOADED, dst.stat().st_size)
+
+    def download(self, data_dir: Path, force=False):
+        "Download all parts concurrently. Complete parts are kept unless forced."
+        if not force and (
+            self.uncompressed_available(data_dir) or self.compressed_available(data_dir)
+        ):
+            return
+        state = StateDB(data_dir)
+        state.clear(self.compressed)
+        state.start(self.compressed, DOWNLOADED)
+        with ThreadPoolExecutor(len(self.urls)) as pool:
+            # copy the context, so parts are attributed to this source
+            futures = [
+                pool.submit(
+                    contextvars.copy_context().run,
+                    self._download_part,
+                    data_dir,
+                    url,
+                    relpath,
+                    force,
+                )
+                for url, relpath in zip(self.urls, self._part_paths())
+            ]
+            for future in futures:
+                future.result()
+        dst = Path(data_dir, self.compressed)
+        state.finish(self.compressed, DOWNLOADED, path_size(dst))
+
+    def decompress(self, data_dir: Path, force=False) -> None:
+        "Decompress and concatenate the parts"
+        if not force and self.uncompressed_available(data_dir):
+            self._ensure_shards(data_dir)
+            return
+        if not self.compressed_available(data_dir):
+            raise IOError(
+                f"Compressed files not found: {Path(data_dir, self.compressed)}"
+            )
+        state = StateDB(data_dir)
+        state.start(self.uncompressed, EXTRACTED)
+        dst = Path(data_dir, self.uncompressed)
+        srcs = [Path(data_dir, part) for part in self._part_paths()]
+        output = None
+        if self.index_fasta:
+            size = sum(src.stat().st_size for src in srcs)
+            output = _FastaOutput(dst, int(size * self.expansion))
+        with engine.slot(engine.DISK), telemetry.stage("decompress", dst.name):
+            gunzip_concat(srcs, dst, tee=output.write if output else None)
+            if output is not None:
+                output.save()
+        state.finish(self.uncompressed, EXTRACTED, path_size(dst))
+
+    def stream(self, data_dir: Path, keep_compressed=False, force=False) -> None:
+        "Parts must be concatenated in order; download, then decompress"
+        self.download(data_dir, force=force)
+        self.decompress(data_dir, force=force)
+
+    def prune(self, data_dir: Path) -> int:
+        freed = super().prune(data_dir)
+        if not Path(data_dir, self.compressed).exists():
+            state = StateDB(data_dir)
+            for part in self._part_paths():
+                state.clear(part)
+        return freed
+
+    def remote_size(self) -> int:
+        sizes = [url_size(url) for url in self.urls]
+        return sum(sizes) if all(sizes) else 0
+
+    def local_size(self, data_dir: Path) -> int:
+        paths = [Path(data_dir, part) for part in self._part_paths()]
+        return sum(path.stat().st_size for path in paths if path.is_file())
+
+    def recorded_size(self, data_dir: Path) -> int:
+        manifest = Manifest(data_dir)
+        return sum(manifest.size(part) or 0 for part in self._part_paths())
+
+    def compressed_available(self, data_dir: Path, deep=False):
+        "Check if all parts are downloaded"
+        return all(
+            self._stage_available(data_dir, part, DOWNLOADED, deep)
+            for part in self._part_paths()
+        )
+
+
+class UniprotSource(MultiSource):
+    "UniProt (TrEMBL followed by Swiss-Prot) as a single FASTA file"
+
+    index_fasta = True
+    expansion = 2.0
+
+    def __init__(self, version: str, url_base: str = UNIPROT_URL):
+        super().__init__(
+            flag="uniprot_database_path",
+            urls=[
+                f"{url_base}/uniprot_trembl.fasta.gz",
+                f"{url_base}/uniprot_sprot.fasta.gz",
+            ],
+            compressed=Path(f"compressed/uniprot/{version}"),
+            uncompressed=Path(f"uncompressed/uniprot/{version}/uniprot.fasta"),
+        )
+        self.version = version
 
 
 class Uniclust30Source(Source):
+    expansion = 4.0
+    hhsuite = True
+
     def __init__(self, version: str, alphafold_version="casp14_versions"):
         super().__init__(
             flag="uniclust30_database_path",
@@ -287,9 +1063,11 @@ class Uniclust30Source(Source):
 
 
 def latest_sources():
-    # TODO detect latest versions
-    # For now, update according to
-    # https://github.com/google-deepmind/alphafold/blob/main/scripts/
+    """Pinned versions of all sources
+
+    Kept in line with https://github.com/google-deepmind/alphafold/blob/main/scripts/
+    by hand. `alphafold_data.discovery` finds the current versions instead.
+    """
     sources: Dict[str, Source] = {
         "params": ParamSource("2022-12-06"),
         "bfd": BFDSource(
@@ -297,7 +1075,7 @@ def latest_sources():
         ),  # casp14_version. Not usually updated.
         "mgnify": MgnifySource("2022_05", alphafold_version="v2.3"),
         "pdb70": PDB70Source("200401"),
-        # "mmcif": TemplateMMcifSource(...),
+        "mmcif": TemplateMMcifSource(TemplateMMcifSource.weekly_version()),
         # "seqres": ...,
         # "uniprot": UniprotSource(...),
         "uniref30": Uniclust30Source("2021_03", alphafold_version="v2.3"),
@@ -0,0 +1,131 @@
+"""Persistent pipeline state
+
+Completed stages (downloaded, verified, transcoded, extracted, validated,
+linked) are recorded per path in a small SQLite database in the metadata
+directory of data_dir, with their size and completion time. A stage which
+was started but never finished is recorded without a completion time, so
+that half-written output is never mistaken for a finished one.
+
+SQLite serializes writers with POSIX (fcntl) locks. When data_dir is shared
+between hosts over NFS, these only work if the mount supports locking (NFSv4,
+or NFSv3 with lockd); with `nolock` mounts concurrent workers may corrupt
+the database. Leases (`alphafold_data.locking`) keep workers off the same
+source, but every worker still writes to this database.
+"""
+
+import sqlite3
+import threading
+import time
+from contextlib import closing
+from dataclasses import dataclass
+from pathlib import Path
+from typing import List, Optional, Set
+
+from .util import metadata_dir
+
+DOWNLOADED = "downloaded"
+VERIFIED = "verified"
+TRANSCODED = "transcoded"
+EXTRACTED = "extracted"
+VALIDATED = "validated"
+LINKED = "linked"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS stages (
+    path TEXT NOT NULL,
+    stage TEXT NOT NULL,
+    size INTEGER,
+    started REAL NOT NULL,
+    completed REAL,
+    PRIMARY KEY (path, stage)
+)
+"""
+
+
+@dataclass
+class StageRecord:
+    path: str
+    stage: str
+    size: Optional[int]
+    started: float
+    completed: Optional[float]
+
+    @property
+    def done(self) -> bool:
+        return self.completed is not None
+
+
+def path_size(path: Path) -> int:
+    "Size of a file, or the total size of files in a directory"
+    if path.is_file():
+        return path.stat().st_size
+    return sum(p.stat().st_size for p in path.rglob("*") if p.is_file())
+
+
+class StateDB:
+    """Stage records for one data_dir
+
+    Paths are stored relative to data_dir. Each method uses its own short
+    transaction, so instances can be shared between threads and processes.
+    """
+
+    _initialized: Set[Path] = set()
+    _init_lock = threading.Lock()
+
+    path: Path
+
+    def __init__(self, data_dir: Path):
+        self.path = metadata_dir(data_dir) / "state.sqlite"
+        with self._init_lock:
+            if self.path not in self._initialized:
+                with closing(self._connect()) as db, db:
+                    db.execute(_SCHEMA)
+                self._initialized.add(self.path)
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(str(self.path), timeout=60)
+
+    def start(self, path: Path, stage: str) -> None:
+        "Mark a stage as in progress"
+        with closing(self._connect()) as db, db:
+            db.execute(
+                "INSERT OR REPLACE INTO stages VALUES (?, ?, NULL, ?, NULL)",
+                (str(path), stage, time.time()),
+            )
+
+    def finish(self, path: Path, stage: str, size: int) -> None:
+        "Mark a stage as completed"
+        now = time.time()
+        with closing(self._connect()) as db, db:
+            db.execute(
+                "INSERT OR REPLACE INTO stages VALUES (?, ?, ?, "
+                "COALESCE((SELECT started FROM stages WHERE path=? AND stage=?), ?),"
+                " ?)",
+                (str(path), stage, size, str(path), stage, now, now),
+            )
+
+    def clear(self, path: Path, stage: Optional[str] = None) -> None:
+        "Forget one or all stages of a path"
+        with closing(self._connect()) as db, db:
+            if stage is None:
+                db.execute("DELETE FROM stages WHERE path=?", (str(path),))
+            else:
+                db.execute(
+                    "DELETE FROM stages WHERE path=? AND stage=?", (str(path), stage)
+                )
+
+    def get(self, path: Path, stage: str) -> Optional[StageRecord]:
+        with closing(self._connect()) as db:
+            row = db.execute(
+                "SELECT * FROM stages WHERE path=? AND stage=?", (str(path), stage)
+            ).fetchone()
+        return StageRecord(*row) if row is not None else None
+
+    def done(self, path: Path, stage: str) -> bool:
+        record = self.get(path, stage)
+        return record is not None and record.done
+
+    def records(self) -> List[StageRecord]:
+        with closing(self._connect()) as db:
+            rows = db.execute("SELECT * FROM stages ORDER BY path, stage").fetchall()
+        return [StageRecord(*row) for row in rows]
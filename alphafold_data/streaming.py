@@ -0,0 +1,177 @@
+"""Stream downloads straight into the decompressor
+
+This avoids writing the compressed archive to disk and reading it back. A
+copy of the compressed bytes can optionally be kept ("tee").
+"""
+
+import gzip
+import http.client
+import logging
+import shutil
+import tarfile
+import urllib.request
+import zlib
+from pathlib import Path
+from typing import BinaryIO, Callable, Iterator, Optional
+
+from . import telemetry, throttle
+from .checksum import Hasher
+from .engine import NETWORK
+from .util import remove_path
+
+_CHUNK_SIZE = 1 << 20
+_TIMEOUT = 60
+
+
+class StreamInterrupted(IOError):
+    "The stream ended before all bytes were received"
+
+
+class TeeReader:
+    """Read-only file wrapper which counts bytes and optionally copies them
+
+    Args:
+    - raw: file object to read from
+    - tee: if not None, everything read is also written here
+    - hasher: if not None, is fed everything read
+    """
+
+    raw: BinaryIO
+    tee: Optional[BinaryIO]
+    hasher: Optional[Hasher]
+    count: int
+
+    def __init__(
+        self,
+        raw: BinaryIO,
+        tee: Optional[BinaryIO] = None,
+        hasher: Optional[Hasher] = None,
+    ):
+        self.raw = raw
+        self.tee = tee
+        self.hasher = hasher
+        self.count = 0
+
+    def read(self, size: int = -1) -> bytes:
+        data = self.raw.read(size)
+        self.count += len(data)
+        throttle.consume(NETWORK, len(data))
+        if self.tee is not None:
+            self.tee.write(data)
+        if self.hasher is not None:
+            self.hasher.update(data)
+        return data
+
+    def drain(self) -> None:
+        "Read (and tee) any remaining bytes, e.g. tar padding"
+        while self.read(_CHUNK_SIZE):
+            pass
+
+
+def _safe_members(tar: tarfile.TarFile) -> Iterator[tarfile.TarInfo]:
+    "Iterate over members, refusing any that would escape the destination"
+    for member in tar:
+        path = Path(member.name)
+        if path.is_absolute() or ".." in path.parts:
+            raise tarfile.TarError(f"Unsafe path in archive: {member.name}")
+        yield member
+
+
+def _extract_tar(mode: str) -> Callable[[TeeReader, Path], None]:
+    def extract(reader: TeeReader, dst: Path) -> None:
+        dst.mkdir(parents=True)
+        with tarfile.open(fileobj=reader, mode=mode) as tar:  # type: ignore
+            tar.extractall(dst, members=_safe_members(tar))
+
+    return extract
+
+
+def _extract_gunzip(reader: TeeReader, dst: Path) -> None:
+    dst.parent.mkdir(parents=True, exist_ok=True)
+    with gzip.GzipFile(fileobj=reader, mode="rb") as gz:  # type: ignore
+        with dst.open("wb") as out:
+            shutil.copyfileobj(gz, out, _CHUNK_SIZE)
+
+
+def _stream(
+    url: str,
+    dst: Path,
+    extract: Callable[[TeeReader, Path], None],
+    tee: Optional[Path] = None,
+    hasher: Optional[Hasher] = None,
+    retries: int = 3,
+) -> None:
+    """Download url and decompress it on the fly to dst
+
+    Output goes to a `.partial` path and is renamed into place only once the
+    whole stream was received and decoded. Truncated or corrupt streams are
+    retried from the start, up to `retries` times. If a hasher is given, it
+    receives the compressed bytes of the successful attempt.
+    """
+    tmp = dst.with_name(dst.name + ".partial")
+    tee_tmp = tee.with_name(tee.name + ".partial") if tee is not None else None
+    for attempt in range(retries + 1):
+        remove_path(tmp)
+        if hasher is not None:
+            hasher.reset()
+        try:
+            logging.debug(f"Streaming {url} to {dst}")
+            with urllib.request.urlopen(url, timeout=_TIMEOUT) as response:
+                expected = int(response.headers.get("Content-Length", -1))
+                tee_file: Optional[BinaryIO] = None
+                if tee_tmp is not None:
+                    tee_tmp.parent.mkdir(parents=True, exist_ok=True)
+                    tee_file = tee_tmp.open("wb")
+                try:
+                    reader = TeeReader(response, tee_file, hasher)
+                    telemetry.report(
+                        lambda: reader.count, total=expected if expected >= 0 else None
+                    )
+                    extract(reader, tmp)
+                    reader.drain()
+                finally:
+                    if tee_file is not None:
+                        tee_file.close()
+            if expected >= 0 and reader.count != expected:
+                raise StreamInterrupted(
+                    f"Received {reader.count} of {expected} bytes from {url}"
+                )
+        except (
+            OSError,
+            EOFError,
+            tarfile.TarError,
+            zlib.error,
+            http.client.HTTPException,
+        ) as err:
+            if attempt >= retries:
+                raise
+            logging.warning(f"Restarting interrupted stream {url}: {err}")
+            telemetry.retry(url, attempt + 1, err)
+            continue
+
+        remove_path(dst)
+        tmp.rename(dst)
+        if tee is not None and tee_tmp is not None:
+            tee_tmp.rename(tee)
+        return
+
+
+def stream_tar(
+    url: str, dst: Path, tee: Optional[Path] = None, hasher: Optional[Hasher] = None
+) -> None:
+    "Stream an uncompressed tar archive into the directory dst"
+    _stream(url, dst, _extract_tar("r|"), tee=tee, hasher=hasher)
+
+
+def stream_tgz(
+    url: str, dst: Path, tee: Optional[Path] = None, hasher: Optional[Hasher] = None
+) -> None:
+    "Stream a .tar.gz archive into the directory dst"
+    _stream(url, dst, _extract_tar("r|gz"), tee=tee, hasher=hasher)
+
+
+def stream_gunzip(
+    url: str, dst: Path, tee: Optional[Path] = None, hasher: Optional[Hasher] = None
+) -> None:
+    "Stream a .gz file into the file dst"
+    _stream(url, dst, _extract_gunzip, tee=tee, hasher=hasher)
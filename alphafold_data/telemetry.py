@@ -0,0 +1,414 @@
+"""Progress and throughput telemetry
+
+Long-running stages (downloads, decompression, streaming) are wrapped in
+`stage()`. The code doing the work reports how far it got with `report()`,
+and retries with `retry()`. While a `session()` is active, a background
+thread samples every stage periodically and publishes:
+
+- `events.jsonl` in the metadata directory: stage start and end, periodic
+  progress and retries, one JSON object per line. It is rotated to
+  `events.jsonl.1` once it grows beyond `_EVENTS_MAX_SIZE`.
+- `progress.<host>.<pid>.json` in the metadata directory: a snapshot of the
+  stages of this process, with a heartbeat. Workers sharing a data_dir each
+  write their own; `read_progress` (as shown by `AFData.status`) merges those
+  still running.
+- a Prometheus textfile (`metrics.prom` in the metadata directory, or
+  `metrics_file`) for node_exporter's textfile collector, with the merged
+  stages of all running workers
+
+Stages are attributed to the source set with `source()`. Outside of a
+session all of this is a cheap no-op.
+"""
+
+import contextvars
+import json
+import logging
+import os
+import socket
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+from .util import atomic_write_text, metadata_dir
+
+EVENTS_NAME = "events.jsonl"
+METRICS_NAME = "metrics.prom"
+PROGRESS_PATTERN = "progress.*.json"
+
+_INTERVAL = 5.0
+# Progress of another host is stale after this many seconds (or three
+# intervals, if longer) without an update
+_STALE = 60.0
+_EVENTS_MAX_SIZE = 64 << 20
+
+_source: "contextvars.ContextVar[str]" = contextvars.ContextVar(
+    "afd_source", default=""
+)
+_stage: "contextvars.ContextVar[Optional[StageProgress]]" = contextvars.ContextVar(
+    "afd_stage", default=None
+)
+
+
+@dataclass
+class StageProgress:
+    """Progress of one stage of one source
+
+    Attributes:
+    - source: source name
+    - stage: e.g. "download", "decompress", "stream"
+    - name: file being processed
+    - total: expected bytes, or 0 if unknown
+    - done: bytes processed so far
+    - rate: recent throughput in bytes/s
+    - status: "running", "done" or "failed"
+    """
+
+    source: str
+    stage: str
+    name: str
+    total: int = 0
+    done: int = 0
+    rate: float = 0.0
+    status: str = "running"
+    started: float = field(default_factory=time.time)
+    finished: Optional[float] = None
+    probe: Optional[Callable[[], int]] = field(default=None, repr=False)
+    _sampled: Tuple[float, int] = (0.0, 0)
+
+    def sample(self) -> None:
+        "Update done and rate from the probe"
+        if self.probe is not None:
+            try:
+                self.done = self.probe()
+            except (OSError, ValueError):
+                # e.g. the file was already closed; keep the last value
+                return
+        now = time.monotonic()
+        last_time, last_done = self._sampled
+        if last_time:
+            self.rate = max(0.0, (self.done - last_done) / max(now - last_time, 1e-9))
+        self._sampled = (now, self.done)
+
+    @property
+    def elapsed(self) -> float:
+        return (self.finished or time.time()) - self.started
+
+    @property
+    def eta(self) -> Optional[float]:
+        "Estimated seconds remaining, if known"
+        if self.status != "running" or not self.total or not self.rate:
+            return None
+        return max(0.0, (self.total - self.done) / self.rate)
+
+    def to_dict(self) -> Dict:
+        return {
+            "source": self.source,
+            "stage": self.stage,
+            "name": self.name,
+            "total": self.total,
+            "done": self.done,
+            "rate": round(self.rate, 1),
+            "status": self.status,
+            "started": self.started,
+            "finished": self.finished,
+            "elapsed": round(self.elapsed, 3),
+            "eta": None if self.eta is None else round(self.eta, 1),
+        }
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+# Metrics of each stage, from `StageProgress.to_dict`
+_METRICS = [
+    ("stage_bytes", "gauge", "Bytes processed by the stage", lambda p: p["done"]),
+    (
+        "stage_total_bytes",
+        "gauge",
+        "Expected bytes (0 if unknown)",
+        lambda p: p["total"],
+    ),
+    ("stage_rate_bytes_per_second", "gauge", "Current throughput", lambda p: p["rate"]),
+    ("stage_running", "gauge", "1 while running", lambda p: p["status"] == "running"),
+    (
+        "stage_failed",
+        "gauge",
+        "1 if the stage failed",
+        lambda p: p["status"] == "failed",
+    ),
+    (
+        "stage_duration_seconds",
+        "gauge",
+        "Time spent in the stage",
+        lambda p: p["elapsed"],
+    ),
+]
+
+
+def _progress_name(host: str, pid: int) -> str:
+    return f"progress.{host}.{pid}.json"
+
+
+class Session:
+    "Collects stages and publishes them, see the module documentation"
+
+    def __init__(
+        self,
+        data_dir: Path,
+        metrics_file: Optional[Path] = None,
+        interval: float = _INTERVAL,
+    ):
+        directory = metadata_dir(data_dir)
+        self.data_dir = data_dir
+        self.events_path = directory / EVENTS_NAME
+        self.progress_path = directory / _progress_name(
+            socket.gethostname(), os.getpid()
+        )
+        self.metrics_path = Path(metrics_file or directory / METRICS_NAME)
+        self.interval = interval
+        self.stages: Dict[Tuple[str, str, str], StageProgress] = {}
+        self.retries: Dict[str, int] = {}
+        self.lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def emit(self, event: str, **fields) -> None:
+        record = dict(time=time.time(), event=event, **fields)
+        line = json.dumps(record) + "\n"
+        with self.lock:
+            with self.events_path.open("a") as f:
+                f.write(line)
+                size = f.tell()
+            if size > _EVENTS_MAX_SIZE:
+                os.replace(
+                    self.events_path,
+                    self.events_path.with_name(self.events_path.name + ".1"),
+                )
+
+    def begin(self, progress: StageProgress) -> None:
+        with self.lock:
+            self.stages[progress.source, progress.stage, progress.name] = progress
+        self.emit("start", **progress.to_dict())
+
+    def end(self, progress: StageProgress, status: str) -> None:
+        progress.sample()
+        progress.status = status
+        progress.finished = time.time()
+        if progress.elapsed > 0:
+            progress.rate = progress.done / progress.elapsed
+        self.emit("end", **progress.to_dict())
+        self.publish()
+
+    def retry(self, what: str, attempt: int, error: BaseException) -> None:
+        source = _source.get()
+        with self.lock:
+            self.retries[source] = self.retries.get(source, 0) + 1
+        self.emit("retry", source=source, what=what, attempt=attempt, error=str(error))
+
+    def tick(self) -> None:
+        with self.lock:
+            running = [p for p in self.stages.values() if p.status == "running"]
+        for progress in running:
+            progress.sample()
+            self.emit("progress", **progress.to_dict())
+        self.publish()
+
+    def publish(self) -> None:
+        with self.lock:
+            stages = list(self.stages.values())
+            retries = dict(self.retries)
+        progress = {
+            "host": socket.gethostname(),
+            "pid": os.getpid(),
+            "interval": self.interval,
+            "updated": time.time(),
+            "stages": [p.to_dict() for p in stages],
+            "retries": retries,
+        }
+        atomic_write_text(self.progress_path, json.dumps(progress, indent=1))
+        # every worker writes the merged view, so it's complete whoever is last
+        workers = _read_workers(self.data_dir)
+        merged: Dict[str, int] = {}
+        for worker in workers:
+            for source, count in worker.get("retries", {}).items():
+                merged[source] = merged.get(source, 0) + count
+        atomic_write_text(
+            self.metrics_path,
+            self._metrics([s for w in workers for s in w["stages"]], merged),
+        )
+
+    @staticmethod
+    def _metrics(stages: List[Dict], retries: Dict[str, int]) -> str:
+        lines = []
+        for name, kind, help, value in _METRICS:
+            lines.append(f"# HELP alphafold_data_{name} {help}")
+            lines.append(f"# TYPE alphafold_data_{name} {kind}")
+            for p in stages:
+                labels = (
+                    f'source="{_escape(p["source"])}",stage="{_escape(p["stage"])}",'
+                    f'name="{_escape(p["name"])}"'
+                )
+                lines.append(f"alphafold_data_{name}{{{labels}}} {float(value(p))}")
+        lines.append("# HELP alphafold_data_retries_total Retried transfers")
+        lines.append("# TYPE alphafold_data_retries_total counter")
+        for source, count in sorted(retries.items()):
+            lines.append(
+                f'alphafold_data_retries_total{{source="{_escape(source)}"}} {count}'
+            )
+        lines.append("# HELP alphafold_data_last_update_timestamp_seconds Last update")
+        lines.append("# TYPE alphafold_data_last_update_timestamp_seconds gauge")
+        lines.append(f"alphafold_data_last_update_timestamp_seconds {time.time()}")
+        return "\n".join(lines) + "\n"
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            try:
+                self.tick()
+            except OSError as err:
+                logging.debug(f"Publishing progress failed: {err}")
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._thread.join()
+        self.publish()
+        # the final state stays in the metrics, but the process isn't running
+        try:
+            self.progress_path.unlink()
+        except FileNotFoundError:
+            pass
+
+
+_session: Optional[Session] = None
+_session_depth = 0
+_session_lock = threading.Lock()
+
+
+@contextmanager
+def session(
+    data_dir: Path, metrics_file: Optional[Path] = None, interval: float = _INTERVAL
+) -> Iterator[Session]:
+    """Publish telemetry for everything run inside this block
+
+    Nested sessions share the outermost one.
+    """
+    global _session, _session_depth
+    with _session_lock:
+        if _session is None:
+            _session = Session(data_dir, metrics_file, interval)
+            _session.start()
+        _session_depth += 1
+        current = _session
+    try:
+        yield current
+    finally:
+        with _session_lock:
+            _session_depth -= 1
+            if _session_depth == 0:
+                _session = None
+                current.stop()
+
+
+@contextmanager
+def source(name: str) -> Iterator[None]:
+    "Attribute stages started in this block to the named source"
+    token = _source.set(name)
+    try:
+        yield
+    finally:
+        _source.reset(token)
+
+
+@contextmanager
+def stage(
+    stage: str, name: str, total: int = 0, probe: Optional[Callable[[], int]] = None
+) -> Iterator[StageProgress]:
+    """Track a stage of the current source
+
+    Args:
+    - stage: e.g. "download"
+    - name: what is processed, usually a file name
+    - total: expected number of bytes, if known
+    - probe: returns the number of bytes done so far. Can also be set later
+      from inside the stage with `report`.
+    """
+    progress = StageProgress(_source.get(), stage, name, total=total, probe=probe)
+    current = _session
+    token = _stage.set(progress)
+    if current is not None:
+        current.begin(progress)
+    try:
+        yield progress
+    except BaseException:
+        if current is not None:
+            current.end(progress, "failed")
+        raise
+    else:
+        if current is not None:
+            current.end(progress, "done")
+    finally:
+        _stage.reset(token)
+
+
+def report(probe: Callable[[], int], total: Optional[int] = None) -> None:
+    "Set how progress of the current stage is measured"
+    progress = _stage.get()
+    if progress is not None:
+        progress.probe = probe
+        if total is not None:
+            progress.total = total
+
+
+def retry(what: str, attempt: int, error: BaseException) -> None:
+    "Record a retried transfer"
+    if _session is not None:
+        _session.retry(what, attempt, error)
+
+
+def _running(progress: Dict) -> bool:
+    """Whether the update which wrote progress is still running
+
+    Processes on this host are probed directly. The pid of another host means
+    nothing here, so its update counts as running while the heartbeat is
+    recent (which assumes roughly synchronized clocks).
+    """
+    if progress.get("host") == socket.gethostname():
+        try:
+            os.kill(progress["pid"], 0)
+        except ProcessLookupError:
+            return False
+        except PermissionError:
+            pass  # running as another user
+        return True
+    stale = max(_STALE, 3 * progress.get("interval", _INTERVAL))
+    return time.time() - progress["updated"] < stale
+
+
+def _read_workers(data_dir: Path) -> List[Dict]:
+    """Progress snapshots of the processes working on data_dir
+
+    Snapshots left by processes on this host which are gone are removed.
+    """
+    workers = []
+    for path in sorted(metadata_dir(data_dir).glob(PROGRESS_PATTERN)):
+        try:
+            progress = json.loads(path.read_text())
+            if _running(progress):
+                workers.append(progress)
+            elif progress.get("host") == socket.gethostname():
+                logging.debug(f"Removing {path} of a finished process")
+                path.unlink()
+        except (OSError, ValueError, KeyError, TypeError):
+            continue  # e.g. removed in the meantime
+    return workers
+
+
+def read_progress(data_dir: Path) -> List[Dict]:
+    "Stages of the updates currently running on data_dir, if any"
+    return [stage for worker in _read_workers(data_dir) for stage in worker["stages"]]
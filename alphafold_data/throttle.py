@@ -0,0 +1,286 @@
+"""Bandwidth and CPU limits shared by all running stages
+
+Updates often run on nodes which are busy with predictions at the same time.
+The governor keeps them from saturating the node:
+
+- network and disk bandwidth are capped with token buckets, shared by every
+  concurrently running source. Data moved in-process (the native
+  downloader, streaming, gunzip, tar extraction) draws from the buckets
+  chunk by chunk. External tools (curl, aria2c, rsync) can't draw from a
+  bucket; each is instead started with its own limit, an equal share of
+  the rate per slot of the execution engine. Their rate is fixed when they
+  start, so a schedule only applies to tools started later.
+- decompression threads come from a fixed budget, split between the
+  concurrent extractions.
+- rates can depend on the time of day, e.g. `08:00-20:00=20M,200M` allows
+  20 MiB/s during the day and 200 MiB/s otherwise.
+
+Without limits (the default) all of this is a cheap no-op.
+"""
+
+import datetime
+import math
+import os
+import re
+import threading
+import time
+from contextlib import contextmanager
+from typing import BinaryIO, Iterator, List, NamedTuple, Optional, Union
+
+from . import engine
+from .engine import DISK, NETWORK
+from .util import parse_size
+
+
+class Window(NamedTuple):
+    "A daily period with its own rate, in minutes since midnight"
+
+    start: int
+    end: int
+    rate: int
+
+    def __contains__(self, minute: object) -> bool:
+        if self.start <= self.end:
+            return self.start <= minute < self.end  # type: ignore
+        # wraps around midnight
+        return minute >= self.start or minute < self.end  # type: ignore
+
+
+def _minutes(text: str) -> int:
+    hours, minutes = text.split(":")
+    if not (0 <= int(hours) <= 24 and 0 <= int(minutes) < 60):
+        raise ValueError(f"Invalid time {text!r}")
+    return int(hours) * 60 + int(minutes)
+
+
+class Schedule:
+    """A rate limit in bytes/s, possibly varying with the local time of day
+
+    Parsed from a comma-separated list of `HH:MM-HH:MM=RATE` windows and at
+    most one plain `RATE` for the rest of the day, with rates as for
+    `util.parse_size` (`20M` is 20 MiB/s). The first matching window wins.
+    A rate of 0, or an empty specification, means no limit.
+
+    Raises:
+        ValueError for invalid specifications
+    """
+
+    windows: List[Window]
+    default: int
+
+    def __init__(self, spec: str = ""):
+        self.spec = spec
+        self.windows = []
+        self.default = 0
+        defaults = 0
+        for part in filter(None, (p.strip() for p in spec.split(","))):
+            match = re.fullmatch(r"(\d+:\d\d)\s*-\s*(\d+:\d\d)\s*=\s*(.+)", part)
+            if match:
+                start, end, rate = match.groups()
+                window = Window(_minutes(start), _minutes(end), parse_size(rate))
+                self.windows.append(window)
+            else:
+                self.default = parse_size(part)
+                defaults += 1
+        if defaults > 1:
+            raise ValueError(f"More than one default rate in {spec!r}")
+
+    def rate(self, now: Optional[datetime.datetime] = None) -> int:
+        "Limit in bytes/s at the time now (default: the current time), 0 if none"
+        if not self.windows:
+            return self.default
+        now = now or datetime.datetime.now()
+        minute = now.hour * 60 + now.minute
+        for window in self.windows:
+            if minute in window:
+                return window.rate
+        return self.default
+
+    def __bool__(self) -> bool:
+        return bool(self.default) or any(w.rate for w in self.windows)
+
+    def __str__(self) -> str:
+        return self.spec or "unlimited"
+
+
+class TokenBucket:
+    """Rate limiter shared between threads
+
+    Callers take tokens after moving data, and sleep off any debt, so the
+    long-term rate holds however many threads share the bucket. Up to one
+    second worth of unused tokens is saved up for bursts.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._tokens = 0.0
+        self._updated = time.monotonic()
+
+    def consume(self, amount: int, rate: float) -> None:
+        "Take amount tokens, refilled at rate per second, sleeping off any debt"
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(rate, self._tokens + (now - self._updated) * rate)
+            self._updated = now
+            self._tokens -= amount
+            wait = -self._tokens / rate
+        if wait > 0:
+            time.sleep(wait)
+
+
+class ThreadBudget:
+    """Decompression threads available to all concurrent extractions
+
+    Args:
+    - total: number of threads, 0 for no limit
+    """
+
+    def __init__(self, total: int = 0):
+        self.total = total
+        self._free = total
+        self._cond = threading.Condition()
+        self._held = threading.local()
+
+    @contextmanager
+    def take(self, wanted: int, parallel: int = 1) -> Iterator[int]:
+        """Reserve up to wanted threads (at least one)
+
+        Args:
+        - wanted: threads the extraction can use
+        - parallel: expected number of concurrent extractions; each gets at
+          most an equal share of the total
+
+        Nested reservations on the same thread share the outer one.
+
+        Yields:
+            the number of threads granted
+        """
+        if not self.total:
+            yield wanted
+            return
+        held = getattr(self._held, "count", 0)
+        if held:
+            yield min(wanted, held)
+            return
+        share = max(1, self.total // max(1, parallel))
+        with self._cond:
+            while self._free < 1:
+                self._cond.wait()
+            granted = max(1, min(wanted, share, self._free))
+            self._free -= granted
+        self._held.count = granted
+        try:
+            yield granted
+        finally:
+            self._held.count = 0
+            with self._cond:
+                self._free += granted
+                self._cond.notify_all()
+
+
+class Governor:
+    """Limits on network, disk and CPU use, see the module documentation
+
+    Args:
+    - network: network rate limit, as for `Schedule`
+    - disk: rate limit for extracted data written to disk, as for `Schedule`
+    - threads: total decompression threads, 0 for no limit. They are split
+      evenly between the engine's disk slots.
+    """
+
+    def __init__(
+        self,
+        network: Union[str, Schedule] = "",
+        disk: Union[str, Schedule] = "",
+        threads: int = 0,
+    ):
+        self.schedules = {NETWORK: _schedule(network), DISK: _schedule(disk)}
+        self.buckets = {kind: TokenBucket() for kind in self.schedules}
+        self.budget = ThreadBudget(threads)
+        self._reserved = {kind: 0 for kind in self.schedules}
+        self._lock = threading.Lock()
+
+    def limited(self, kind: str) -> bool:
+        "Whether there is any rate limit of this kind"
+        return bool(self.schedules[kind])
+
+    @staticmethod
+    def _slots(kind: str) -> int:
+        return max(1, engine.default_engine().limits[kind])
+
+    def rate(self, kind: str) -> float:
+        """Current rate for in-process work in bytes/s, 0 if unlimited
+
+        That is the limit less the shares of running tools, but never less
+        than one share.
+        """
+        limit = self.schedules[kind].rate()
+        if not limit:
+            return 0.0
+        with self._lock:
+            reserved = self._reserved[kind]
+        return max(limit - reserved, limit / self._slots(kind))
+
+    def consume(self, kind: str, amount: int) -> None:
+        "Account for amount bytes moved, waiting if over the rate"
+        rate = self.rate(kind)
+        if rate:
+            self.buckets[kind].consume(amount, rate)
+
+    @contextmanager
+    def tool(self, kind: str) -> Iterator[int]:
+        """Reserve bandwidth for an external tool while it runs
+
+        Yields its rate limit in bytes/s (0 if unlimited): the current limit
+        split evenly between the engine's slots of this kind (see
+        `engine.Engine`), so that tools together stay within the limit. The
+        share is taken from the bucket until the tool exits.
+        """
+        share = math.ceil(self.schedules[kind].rate() / self._slots(kind))
+        with self._lock:
+            self._reserved[kind] += share
+        try:
+            yield share
+        finally:
+            with self._lock:
+                self._reserved[kind] -= share
+
+    def threads(self, wanted: Optional[int] = None):
+        "Reserve decompression threads, see `ThreadBudget.take`"
+        return self.budget.take(wanted or os.cpu_count() or 1, self._slots(DISK))
+
+
+class Throttled:
+    "Reader drawing from the current governor's bucket for everything read"
+
+    def __init__(self, raw: BinaryIO, kind: str):
+        self.raw = raw
+        self.kind = kind
+
+    def read(self, size: int = -1) -> bytes:
+        data = self.raw.read(size)
+        consume(self.kind, len(data))
+        return data
+
+
+def _schedule(spec: Union[str, Schedule]) -> Schedule:
+    return spec if isinstance(spec, Schedule) else Schedule(spec)
+
+
+_governor = Governor()
+
+
+def set_governor(governor: Optional[Governor]) -> None:
+    "Apply governor to all following work, or remove all limits with None"
+    global _governor
+    _governor = governor or Governor()
+
+
+def governor() -> Governor:
+    "The governor in effect"
+    return _governor
+
+
+def consume(kind: str, amount: int) -> None:
+    "Account for data moved, see `Governor.consume`"
+    _governor.consume(kind, amount)
@@ -0,0 +1,217 @@
+"""Parallel, resumable tar extraction
+
+The archive is decompressed once as a stream (see `gunzip.open_inflated`).
+Member data is handed to a pool of writer threads: small files are written
+whole, large files are preallocated and written in big chunks with
+positional writes.
+
+Existing files are unlinked before they are rewritten, never truncated, since
+they may be hardlinked to other versions (see `alphafold_data.dedup`).
+
+Every finished member is appended to a journal in the destination directory.
+If extraction is interrupted, the next run skips members which are already
+in the journal (and still have the right size) instead of rewriting them.
+The journal is removed once the whole archive was extracted.
+"""
+
+import json
+import logging
+import os
+import tarfile
+import threading
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from pathlib import Path
+from typing import BinaryIO, Deque, Dict, List, Optional
+
+from . import telemetry
+from .gunzip import open_inflated
+from .util import preallocate
+
+JOURNAL_NAME = ".afd-extract.journal"
+
+_BUFFER_SIZE = 16 << 20
+# Members at least this large are preallocated and written in chunks
+_LARGE_MEMBER = 64 << 20
+
+
+class _Journal:
+    "Append-only record of completely extracted members"
+
+    path: Path
+    done: Dict[str, int]
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.done = {}
+        self._lock = threading.Lock()
+        if path.exists():
+            with path.open() as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        break  # torn final write
+                    self.done[entry["name"]] = entry["size"]
+        self._file = path.open("a")
+
+    def is_done(self, member: tarfile.TarInfo, target: Path) -> bool:
+        if self.done.get(member.name) != member.size:
+            return False
+        try:
+            return target.stat().st_size == member.size
+        except FileNotFoundError:
+            return False
+
+    def record(self, member: tarfile.TarInfo) -> None:
+        with self._lock:
+            entry = {"name": member.name, "size": member.size}
+            self._file.write(json.dumps(entry) + "\n")
+            self._file.flush()
+
+    def close(self) -> None:
+        self._file.close()
+
+    def remove(self) -> None:
+        self.close()
+        self.path.unlink()
+
+
+def _finish(path: Path, member: tarfile.TarInfo) -> None:
+    os.chmod(path, member.mode)
+    os.utime(path, (member.mtime, member.mtime))
+
+
+class _Extractor:
+    def __init__(self, dst: Path, writers: int, journal: _Journal):
+        self.dst = dst
+        self.journal = journal
+        self.pool = ThreadPoolExecutor(writers, thread_name_prefix="untar")
+        self.max_pending = 4 * writers
+        self.pending: Deque[Future] = deque()
+        self.written = 0
+        self.skipped = 0
+        self.bytes = 0  # of members read from the archive
+
+    def _submit(self, func, *args) -> Future:
+        future = self.pool.submit(func, *args)
+        self.pending.append(future)
+        return future
+
+    def _throttle(self) -> None:
+        "Wait for the oldest writes while too many are queued"
+        while len(self.pending) > self.max_pending:
+            self.pending.popleft().result()
+
+    def wait(self) -> None:
+        while self.pending:
+            self.pending.popleft().result()
+
+    def _write_small(self, target: Path, member: tarfile.TarInfo, data: bytes):
+        with target.open("wb") as f:
+            f.write(data)
+        _finish(target, member)
+        self.journal.record(member)
+
+    def _extract_file(self, tar: tarfile.TarFile, member: tarfile.TarInfo):
+        target = self.dst / member.name
+        self.bytes += member.size
+        if self.journal.is_done(member, target):
+            self.skipped += 1
+            return
+        target.parent.mkdir(parents=True, exist_ok=True)
+        if target.is_symlink() or target.exists():
+            # a fresh inode, rather than writing through to linked copies
+            target.unlink()
+        source = tar.extractfile(member)
+        assert source is not None
+        if member.size < _LARGE_MEMBER:
+            self._submit(self._write_small, target, member, source.read())
+            self._throttle()
+        else:
+            fd = os.open(target, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            chunks: List[Future] = []
+            try:
+                preallocate(fd, member.size)
+                offset = 0
+                for data in iter(lambda: source.read(_BUFFER_SIZE), b""):
+                    chunks.append(self._submit(os.pwrite, fd, data, offset))
+                    offset += len(data)
+                    self._throttle()
+                for chunk in chunks:
+                    chunk.result()
+            except BaseException:
+                # no queued write may run once fd is closed (or reused)
+                for chunk in chunks:
+                    chunk.cancel()
+                wait(chunks)
+                raise
+            finally:
+                os.close(fd)
+            _finish(target, member)
+            self.journal.record(member)
+        self.written += 1
+
+    def extract(self, fileobj: BinaryIO) -> None:
+        with tarfile.open(fileobj=fileobj, mode="r|", bufsize=_BUFFER_SIZE) as tar:
+            for member in tar:
+                path = Path(member.name)
+                if path.is_absolute() or ".." in path.parts:
+                    raise tarfile.TarError(f"Unsafe path in archive: {member.name}")
+                if member.isreg():
+                    self._extract_file(tar, member)
+                elif member.isdir():
+                    (self.dst / member.name).mkdir(parents=True, exist_ok=True)
+                else:
+                    # links and special files: let tarfile handle them, after
+                    # any link targets have been written
+                    self.wait()
+                    target = self.dst / member.name
+                    if target.is_symlink() or target.exists():
+                        target.unlink()
+                    tar.extract(member, self.dst)
+            self.wait()
+
+    def close(self) -> None:
+        self.pool.shutdown()
+
+
+def extract_tar_stream(fileobj: BinaryIO, dst: Path, writers: int = 4) -> None:
+    """Extract a tar stream into the directory dst
+
+    Args:
+    - fileobj: uncompressed tar data. Only read() is used.
+    - dst: output directory
+    - writers: number of writer threads
+    """
+    dst.mkdir(parents=True, exist_ok=True)
+    journal = _Journal(dst / JOURNAL_NAME)
+    if journal.done:
+        logging.info(f"Resuming extraction to {dst} ({len(journal.done)} done)")
+    extractor = _Extractor(dst, writers, journal)
+    telemetry.report(lambda: extractor.bytes)
+    try:
+        extractor.extract(fileobj)
+    except BaseException:
+        journal.close()
+        raise
+    finally:
+        extractor.close()
+    journal.remove()
+    logging.info(
+        f"Extracted {extractor.written} files to {dst}"
+        f" ({extractor.skipped} already done)"
+    )
+
+
+def extract_tgz(
+    src: Path, dst: Path, writers: int = 4, threads: Optional[int] = None
+) -> None:
+    "Extract a .tar.gz archive into the directory dst"
+    with open_inflated(src, threads=threads) as stream:
+        extract_tar_stream(stream, dst, writers=writers)
+
+
+def extraction_incomplete(dst: Path) -> bool:
+    "Check whether an extraction into dst was started but not finished"
+    return Path(dst, JOURNAL_NAME).exists()
@@ -0,0 +1,87 @@
+"""Small helpers shared between modules."""
+
+import functools
+import logging
+import os
+import re
+import shutil
+import socket
+import threading
+import urllib.error
+import urllib.request
+from pathlib import Path
+from urllib.parse import urlsplit
+
+
+def host_of(url: str) -> str:
+    """Host name of a URL
+
+    Handles both regular URLs and rsync's `host::module/path` syntax.
+    """
+    if "://" not in url and "::" in url:
+        return url.split("::", 1)[0]
+    return urlsplit(url).hostname or ""
+
+
+@functools.lru_cache(maxsize=None)
+def url_size(url: str, timeout: float = 30) -> int:
+    """Size of a remote file in bytes, from its Content-Length
+
+    Returns 0 if the size can't be determined.
+    """
+    if urlsplit(url).scheme not in ("http", "https"):
+        return 0
+    request = urllib.request.Request(url, method="HEAD")
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            return int(response.headers.get("Content-Length", 0))
+    except (OSError, ValueError) as err:
+        logging.debug(f"Unable to get size of {url}: {err}")
+        return 0
+
+
+def parse_size(size: str) -> int:
+    """Parse sizes like 512M, 1.5T or 200GB (powers of 1024)
+
+    Raises:
+        ValueError for unparseable sizes
+    """
+    match = re.fullmatch(r"(\d+(?:\.\d*)?)\s*([KMGTP]?)I?B?", size.strip().upper())
+    if not match:
+        raise ValueError(f"Invalid size {size!r}")
+    return int(float(match.group(1)) * 1024 ** " KMGTP".index(match.group(2) or " "))
+
+
+def preallocate(fd: int, size: int) -> None:
+    "Reserve disk space for an open file, falling back to a sparse file"
+    if size <= 0:
+        return
+    try:
+        os.posix_fallocate(fd, 0, size)
+    except (AttributeError, OSError):
+        # not supported on this platform/filesystem
+        os.ftruncate(fd, size)
+
+
+def atomic_write_text(path: Path, text: str) -> None:
+    "Replace the contents of path atomically"
+    # unique across threads, processes and hosts sharing the directory
+    unique = f"{socket.gethostname()}.{os.getpid()}.{threading.get_ident()}"
+    tmp = path.with_name(f"{path.name}.{unique}.tmp")
+    tmp.write_text(text)
+    os.replace(tmp, path)
+
+
+def metadata_dir(data_dir: Path) -> Path:
+    "Directory for bookkeeping files inside data_dir"
+    path = Path(data_dir, ".alphafold_data")
+    path.mkdir(parents=True, exist_ok=True)
+    return path
+
+
+def remove_path(path: Path) -> None:
+    "Delete a file, symlink or directory tree, if it exists"
+    if path.is_dir() and not path.is_symlink():
+        shutil.rmtree(path)
+    elif path.exists() or path.is_symlink():
+        path.unlink()
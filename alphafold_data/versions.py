@@ -0,0 +1,108 @@
+"""Versioned symlink trees
+
+AlphaFold is pointed at `versions/latest`, which links to a dated tree of
+symlinks into `uncompressed/`:
+
+    versions/latest -> 2024-01-31
+    versions/2024-01-31/mgnify -> ../../uncompressed/mgnify/2022_05
+    versions/2024-01-31/pdb70 -> ../../uncompressed/pdb70/200401/pdb70_from_mmcif
+
+A new tree is built under a temporary name and renamed into place, and
+`latest` is switched with a rename too, so readers never see a partial tree.
+Switching versions only touches metadata; the databases (and their pages in
+the cache) stay where they are. Links are relative, so data_dir can be
+mounted at different paths on different nodes.
+"""
+
+import datetime
+import logging
+import os
+import shutil
+from pathlib import Path
+from typing import Dict, Optional
+
+VERSIONS_DIR = "versions"
+LATEST = "latest"
+
+
+def _links(tree: Path) -> Dict[str, str]:
+    return {
+        entry.name: os.readlink(str(entry))
+        for entry in tree.iterdir()
+        if entry.is_symlink()
+    }
+
+
+def build_version(data_dir: Path, links: Dict[str, Path], name: str) -> Path:
+    """Create versions/<name> with the given links
+
+    If a tree called name already exists with other links, a suffix is
+    added to the name. An identical existing tree is reused.
+
+    Args:
+    - data_dir: install directory
+    - links: link name to target, relative to data_dir
+    - name: version name, usually the date
+
+    Returns:
+        path of the tree
+    """
+    versions = Path(data_dir, VERSIONS_DIR)
+    versions.mkdir(parents=True, exist_ok=True)
+    targets = {
+        link: os.path.join(os.pardir, os.pardir, str(target))
+        for link, target in links.items()
+    }
+    tree = versions / name
+    suffix = 1
+    while tree.is_dir():
+        if _links(tree) == targets:
+            return tree
+        suffix += 1
+        tree = versions / f"{name}.{suffix}"
+
+    tmp = versions / f".{tree.name}.partial"
+    if tmp.exists():
+        shutil.rmtree(tmp)
+    tmp.mkdir()
+    for link, target in sorted(targets.items()):
+        os.symlink(target, str(tmp / link))
+    os.rename(tmp, tree)
+    return tree
+
+
+def switch_latest(data_dir: Path, tree: Path) -> None:
+    "Point versions/latest at tree, atomically"
+    versions = Path(data_dir, VERSIONS_DIR)
+    tmp = versions / f".{LATEST}.{os.getpid()}.tmp"
+    if tmp.is_symlink():
+        tmp.unlink()
+    os.symlink(tree.name, str(tmp))
+    os.replace(tmp, versions / LATEST)
+    logging.info(f"{versions / LATEST} -> {tree.name}")
+
+
+def latest_version(data_dir: Path) -> Optional[str]:
+    "Name of the tree versions/latest points at, if any"
+    try:
+        return os.readlink(str(Path(data_dir, VERSIONS_DIR, LATEST)))
+    except OSError:
+        return None
+
+
+def link_version(
+    data_dir: Path, links: Dict[str, Path], name: Optional[str] = None
+) -> Path:
+    """Build a version tree and make it the latest
+
+    Args:
+    - data_dir: install directory
+    - links: link name to target, relative to data_dir
+    - name: version name. Defaults to today's date.
+
+    Returns:
+        path of the tree
+    """
+    tree = build_version(data_dir, links, name or datetime.date.today().isoformat())
+    switch_latest(data_dir, tree)
+    return tree
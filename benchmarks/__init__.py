@@ -0,0 +1,13 @@
+"""Benchmarks for the download and decompression backends
+
+Synthetic fixtures (see `benchmarks.fixtures`) are served from a local HTTP
+server and processed by every backend and every Source type. Run with::
+
+    make bench
+    python -m benchmarks.run run --size 4G --suite gunzip --suite untar
+
+Results are appended to `benchmarks/results.jsonl`. To check a release for
+regressions against an earlier run::
+
+    python -m benchmarks.run compare old.jsonl benchmarks/results.jsonl
+"""
@@ -0,0 +1,164 @@
+"""Synthetic, reproducible archives for benchmarking
+
+Fixtures are generated from a fixed seed, so every run (on any machine, for
+any release) downloads and decompresses identical data. They are cached in
+`<fixture dir>/<size>-<seed>/` and only generated when missing.
+
+`size` is the uncompressed size of each fixture in bytes. The layouts mimic
+the real databases:
+
+- params.tar: a few large incompressible files (model parameters)
+- big.tar.gz: a few large FASTA-like files (bfd, uniclust30)
+- small.tar.gz: many small text files in subdirectories (pdb70, mmCIF)
+- mgnify.fa.gz: a single gzipped FASTA
+- uniprot_trembl.fasta.gz, uniprot_sprot.fasta.gz: FASTA parts (uniprot)
+"""
+
+import gzip
+import io
+import random
+import tarfile
+import tempfile
+from contextlib import contextmanager
+from pathlib import Path
+from typing import BinaryIO, Callable, Dict, Iterator, Union
+
+AMINO_ACIDS = b"ACDEFGHIKLMNPQRSTVWY"
+
+_POOL_SIZE = 1 << 20
+_SMALL_FILE_SIZE = 8 << 10
+
+
+def _sequence_pool(rng: random.Random) -> bytes:
+    return bytes(rng.choice(AMINO_ACIDS) for _ in range(_POOL_SIZE))
+
+
+def fasta_records(
+    rng: random.Random, size: int, prefix: str = "BENCH"
+) -> Iterator[bytes]:
+    "FASTA records with random sequences, totalling at least size bytes"
+    pool = _sequence_pool(rng)
+    written = 0
+    i = 0
+    while written < size:
+        length = rng.randrange(50, 1500)
+        start = rng.randrange(0, _POOL_SIZE - length)
+        seq = pool[start : start + length]
+        lines = b"\n".join(seq[j : j + 60] for j in range(0, length, 60))
+        record = b">%s%09d synthetic protein length=%d\n%s\n" % (
+            prefix.encode(),
+            i,
+            length,
+            lines,
+        )
+        written += len(record)
+        i += 1
+        yield record
+
+
+def random_bytes(rng: random.Random, size: int) -> Iterator[bytes]:
+    "Incompressible data, in chunks"
+    while size > 0:
+        n = min(size, 1 << 20)
+        yield rng.getrandbits(8 * n).to_bytes(n, "little")
+        size -= n
+
+
+def _write_chunks(f: Union[BinaryIO, gzip.GzipFile], chunks: Iterator[bytes]) -> None:
+    for chunk in chunks:
+        f.write(chunk)
+
+
+def _add_member(tar: tarfile.TarFile, name: str, chunks: Iterator[bytes]) -> None:
+    "Add a member without holding it in memory"
+    with tempfile.TemporaryFile() as tmp:
+        _write_chunks(tmp, chunks)
+        info = tarfile.TarInfo(name)
+        info.size = tmp.tell()
+        info.mtime = 0
+        tmp.seek(0)
+        tar.addfile(info, tmp)
+
+
+@contextmanager
+def _tgz(path: Path) -> Iterator[tarfile.TarFile]:
+    "tar.gz with a fixed timestamp, so the archive is byte-for-byte reproducible"
+    with gzip.GzipFile(path, "wb", mtime=0) as gz, tarfile.open(
+        fileobj=gz, mode="w"
+    ) as tar:
+        yield tar
+
+
+def _params(path: Path, size: int, rng: random.Random) -> None:
+    with tarfile.open(path, "w") as tar:
+        for i in range(4):
+            _add_member(tar, f"params_model_{i + 1}.npz", random_bytes(rng, size // 4))
+
+
+def _big_tgz(path: Path, size: int, rng: random.Random) -> None:
+    with _tgz(path) as tar:
+        for name in ("db_a3m.ffdata", "db_hhm.ffdata", "db_cs219.ffdata"):
+            _add_member(tar, f"db/{name}", fasta_records(rng, size // 3))
+
+
+def _add_small(tar: tarfile.TarFile, i: int, data: bytes) -> None:
+    pdb_id = f"{i:04x}"
+    info = tarfile.TarInfo(f"small/{pdb_id[1:3]}/{pdb_id}.cif")
+    info.size = len(data)
+    info.mtime = 0
+    tar.addfile(info, io.BytesIO(data))
+
+
+def _small_tgz(path: Path, size: int, rng: random.Random) -> None:
+    with _tgz(path) as tar:
+        files = 0
+        data = b""
+        for record in fasta_records(rng, size, "PDB"):
+            data += record
+            if len(data) >= rng.randrange(1, 2 * _SMALL_FILE_SIZE):
+                _add_small(tar, files, data)
+                files += 1
+                data = b""
+        if data:
+            _add_small(tar, files, data)
+
+
+def _fasta_gz(size_fraction: float, prefix: str) -> Callable:
+    def build(path: Path, size: int, rng: random.Random) -> None:
+        with gzip.GzipFile(path, "wb", mtime=0) as f:
+            _write_chunks(f, fasta_records(rng, int(size * size_fraction), prefix))
+
+    return build
+
+
+FIXTURES: Dict[str, Callable[[Path, int, random.Random], None]] = {
+    "params.tar": _params,
+    "big.tar.gz": _big_tgz,
+    "small.tar.gz": _small_tgz,
+    "mgnify.fa.gz": _fasta_gz(1, "MGYP"),
+    "uniprot_trembl.fasta.gz": _fasta_gz(0.9, "tr|A"),
+    "uniprot_sprot.fasta.gz": _fasta_gz(0.1, "sp|P"),
+}
+
+
+def fixture_dir(root: Path, size: int, seed: int) -> Path:
+    return Path(root, f"{size}-{seed}")
+
+
+def ensure_fixtures(root: Path, size: int, seed: int = 0) -> Path:
+    """Generate any missing fixtures
+
+    Returns:
+        the directory containing the fixtures
+    """
+    directory = fixture_dir(root, size, seed)
+    directory.mkdir(parents=True, exist_ok=True)
+    for i, (name, build) in enumerate(FIXTURES.items()):
+        path = directory / name
+        if path.exists():
+            continue
+        tmp = path.with_name(path.name + ".partial")
+        # each fixture gets its own stream, so they don't depend on each other
+        build(tmp, size, random.Random(seed * 1000 + i))
+        tmp.rename(path)
+    return directory
@@ -0,0 +1,340 @@
+"""Benchmark runner
+
+Every run executes in a fresh subprocess, so its CPU time and peak RSS
+(including external tools such as curl, aria2c, pigz or tar) can be measured
+with `wait4`. Fixtures are served from a local HTTP server in the parent
+process, which is not counted.
+
+Results are appended as JSON lines; `compare` reports throughput regressions
+between two result files.
+"""
+
+import json
+import logging
+import os
+import platform
+import re
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from dataclasses import asdict, dataclass
+from datetime import datetime, timezone
+from pathlib import Path
+from subprocess import STDOUT, Popen, run
+from typing import Dict, List, Tuple
+
+import click
+
+from alphafold_data import __version__
+from alphafold_data.gunzip import gunzip
+from alphafold_data.sources import (
+    MgnifySource,
+    ParamSource,
+    PDB70Source,
+    Source,
+    Uniclust30Source,
+    UniprotSource,
+    available_downloaders,
+    downloaders,
+)
+from alphafold_data.state import path_size
+from alphafold_data.untar import extract_tgz
+
+from .fixtures import ensure_fixtures
+from .server import serve
+
+SUITES = ("download", "gunzip", "untar", "source")
+
+
+@dataclass
+class Case:
+    """One benchmark
+
+    Attributes:
+    - suite: one of SUITES
+    - name: fixture (or, for the source suite, source) name
+    - backend: implementation being measured
+    """
+
+    suite: str
+    name: str
+    backend: str
+
+
+def _available(suite: str, backend: str) -> bool:
+    if (suite, backend) == ("download", "aria2c"):
+        return "aria2c" in available_downloaders()
+    if (suite, backend) == ("download", "curl"):
+        return shutil.which(os.environ.get("CURL_EXE", "curl")) is not None
+    if (suite, backend) == ("gunzip", "pigz"):
+        return shutil.which(os.environ.get("PIGZ_EXE", "pigz")) is not None
+    if (suite, backend) == ("untar", "tar"):
+        return shutil.which("tar") is not None
+    return True
+
+
+def all_cases() -> List[Case]:
+    cases = [
+        Case("download", name, backend)
+        for name in ("params.tar", "mgnify.fa.gz", "small.tar.gz")
+        for backend in downloaders
+    ]
+    cases += [
+        Case("gunzip", "mgnify.fa.gz", backend)
+        for backend in ("pigz", "threaded", "serial")
+    ]
+    cases += [
+        Case("untar", name, backend)
+        for name in ("big.tar.gz", "small.tar.gz")
+        for backend in ("tar", "extract_tgz")
+    ]
+    cases += [
+        Case("source", name, backend)
+        for name in ("params", "mgnify", "pdb70", "uniclust30", "uniprot")
+        for backend in ("download", "stream")
+    ]
+    return cases
+
+
+def _source(name: str, url: str) -> Source:
+    "Source of the given type, pointing at the fixtures"
+    if name == "uniprot":
+        return UniprotSource("bench", url_base=url)
+    source: Source
+    if name == "params":
+        source, fixture = ParamSource("bench"), "params.tar"
+    elif name == "mgnify":
+        source, fixture = MgnifySource("bench"), "mgnify.fa.gz"
+    elif name == "pdb70":
+        source, fixture = PDB70Source("bench"), "small.tar.gz"
+    elif name == "uniclust30":
+        source, fixture = Uniclust30Source("bench"), "big.tar.gz"
+    else:
+        raise ValueError(f"Unknown source {name}")
+    source.url = f"{url}/{fixture}"
+    return source
+
+
+def run_case(case: Case, fixtures: Path, url: str, workdir: Path) -> int:
+    """Run a single benchmark in this process
+
+    Returns:
+        number of bytes produced (downloaded, or written uncompressed)
+    """
+    if case.suite == "download":
+        dst = workdir / case.name
+        downloaders[case.backend](f"{url}/{case.name}", dst)
+        return dst.stat().st_size
+    if case.suite == "gunzip":
+        stats = gunzip(fixtures / case.name, workdir / "out", backend=case.backend)
+        return stats.uncompressed_bytes
+    if case.suite == "untar":
+        dst = workdir / "out"
+        if case.backend == "tar":
+            dst.mkdir()
+            result = run(["tar", "-xzf", str(fixtures / case.name), "-C", str(dst)])
+            result.check_returncode()
+        else:
+            extract_tgz(fixtures / case.name, dst)
+        return path_size(dst)
+    if case.suite == "source":
+        source = _source(case.name, url)
+        if case.backend == "stream":
+            source.stream(workdir)
+        else:
+            source.download(workdir)
+            source.decompress(workdir)
+        return path_size(workdir / source.uncompressed)
+    raise ValueError(f"Unknown suite {case.suite}")
+
+
+def _git_commit() -> str:
+    try:
+        result = run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True
+        )
+    except FileNotFoundError:
+        return ""
+    return result.stdout.strip() if result.returncode == 0 else ""
+
+
+def measure(case: Case, fixtures: Path, url: str, workdir: Path) -> Dict:
+    """Run a benchmark in a subprocess and measure its resource usage
+
+    Throughput is based on the time taken by the benchmarked operation
+    itself, excluding interpreter startup.
+    """
+    result = workdir.with_name(workdir.name + ".json")
+    args = dict(
+        asdict(case),
+        fixtures=str(fixtures),
+        url=url,
+        workdir=str(workdir),
+        result=str(result),
+    )
+    cmd = [sys.executable, "-m", "benchmarks.run", "case", json.dumps(args)]
+    start = time.monotonic()
+    with tempfile.TemporaryFile() as log:
+        proc = Popen(cmd, stdout=log, stderr=STDOUT)
+        _pid, status, usage = os.wait4(proc.pid, 0)
+        proc.returncode = os.WEXITSTATUS(status) if os.WIFEXITED(status) else -1
+        if proc.returncode != 0:
+            log.seek(0)
+            sys.stderr.write(log.read().decode(errors="replace"))
+            raise RuntimeError(f"{case} failed with status {proc.returncode}")
+    process_seconds = time.monotonic() - start
+    measured = json.loads(result.read_text())
+    result.unlink()
+    return {
+        "bytes": measured["bytes"],
+        "wall_seconds": round(measured["seconds"], 3),
+        "process_seconds": round(process_seconds, 3),
+        "user_seconds": round(usage.ru_utime, 3),
+        "system_seconds": round(usage.ru_stime, 3),
+        "max_rss_mb": round(usage.ru_maxrss / 1024, 1),  # kB on Linux
+        "throughput_mbps": round(
+            measured["bytes"] / 1e6 / max(measured["seconds"], 1e-9), 2
+        ),
+    }
+
+
+def parse_size(size: str) -> int:
+    "Parse sizes like 512M or 4G"
+    match = re.fullmatch(r"(\d+)([KMGT]?)", size.strip().upper())
+    if not match:
+        raise click.BadParameter(f"Invalid size {size}")
+    return int(match.group(1)) << (10 * " KMGT".index(match.group(2) or " "))
+
+
+@click.group()
+def main():
+    "Benchmarks for the alphafold_data download and decompression backends"
+    logging.basicConfig(level=logging.WARNING)
+
+
+@main.command("run")
+@click.option("--size", default="256M", help="Uncompressed size of each fixture")
+@click.option("--seed", default=0, help="Seed for the fixtures")
+@click.option("--repeat", default=3, help="Runs per benchmark")
+@click.option(
+    "--suite",
+    "suites",
+    multiple=True,
+    type=click.Choice(SUITES),
+    help="Suites to run (default all)",
+)
+@click.option(
+    "--fixtures",
+    type=click.Path(file_okay=False),
+    default=os.path.join(tempfile.gettempdir(), "alphafold-data-bench"),
+    help="Cache directory for the generated fixtures",
+)
+@click.option(
+    "--output",
+    type=click.Path(dir_okay=False),
+    default="benchmarks/results.jsonl",
+    help="Results are appended to this file",
+)
+def run_benchmarks(size, seed, repeat, suites, fixtures, output):
+    "Run the benchmarks and append the results to OUTPUT"
+    fixtures, output = Path(fixtures), Path(output)
+    size_bytes = parse_size(size)
+    click.echo(f"Preparing fixtures in {fixtures}")
+    fixture_dir = ensure_fixtures(fixtures, size_bytes, seed)
+    common = {
+        "version": __version__,
+        "commit": _git_commit(),
+        "host": platform.node(),
+        "python": platform.python_version(),
+        "cpus": os.cpu_count(),
+        "size": size_bytes,
+        "seed": seed,
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+    }
+    cases = [c for c in all_cases() if not suites or c.suite in suites]
+    output.parent.mkdir(parents=True, exist_ok=True)
+    with serve(fixture_dir) as url, output.open("a") as out:
+        for case in cases:
+            if not _available(case.suite, case.backend):
+                click.echo(f"{case.suite:8} {case.name:16} {case.backend:12} skipped")
+                continue
+            for i in range(repeat):
+                workdir = Path(tempfile.mkdtemp(prefix="afd-bench-"))
+                try:
+                    result = measure(case, fixture_dir, url, workdir)
+                finally:
+                    shutil.rmtree(workdir, ignore_errors=True)
+                record = dict(asdict(case), run=i, **result, **common)
+                out.write(json.dumps(record) + "\n")
+                out.flush()
+                click.echo(
+                    f"{case.suite:8} {case.name:16} {case.backend:12}"
+                    f" {result['throughput_mbps']:9.1f} MB/s"
+                    f" {result['wall_seconds']:8.2f}s wall"
+                    f" {result['user_seconds'] + result['system_seconds']:8.2f}s cpu"
+                    f" {result['max_rss_mb']:8.1f} MB rss"
+                )
+
+
+Key = Tuple[str, str, str, int]
+
+
+def _medians(path: Path) -> Dict[Key, float]:
+    runs: Dict[Key, List[float]] = defaultdict(list)
+    with path.open() as f:
+        for line in f:
+            r = json.loads(line)
+            key = (r["suite"], r["name"], r["backend"], r["size"])
+            runs[key].append(r["throughput_mbps"])
+    return {key: statistics.median(values) for key, values in runs.items()}
+
+
+@main.command()
+@click.argument("baseline", type=click.Path(exists=True, dir_okay=False))
+@click.argument("current", type=click.Path(exists=True, dir_okay=False))
+@click.option(
+    "--tolerance", default=0.1, help="Allowed relative drop in median throughput"
+)
+def compare(baseline, current, tolerance):
+    "Compare median throughput between two result files"
+    old = _medians(Path(baseline))
+    new = _medians(Path(current))
+    regressions = 0
+    for key in sorted(old.keys() & new.keys()):
+        change = new[key] / old[key] - 1 if old[key] else 0.0
+        flag = ""
+        if change < -tolerance:
+            flag = "  REGRESSION"
+            regressions += 1
+        suite, name, backend, _size = key
+        click.echo(
+            f"{suite:8} {name:16} {backend:12} {old[key]:9.1f} -> {new[key]:9.1f}"
+            f" MB/s ({change:+.0%}){flag}"
+        )
+    if regressions:
+        raise click.ClickException(f"{regressions} benchmarks regressed")
+
+
+@main.command(hidden=True)
+@click.argument("args")
+def case(args):
+    "Run one benchmark (used by `run`, in a subprocess)"
+    params = json.loads(args)
+    start = time.monotonic()
+    produced = run_case(
+        Case(params["suite"], params["name"], params["backend"]),
+        Path(params["fixtures"]),
+        params["url"],
+        Path(params["workdir"]),
+    )
+    seconds = time.monotonic() - start
+    Path(params["result"]).write_text(
+        json.dumps({"bytes": produced, "seconds": seconds})
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+"""Local HTTP server for the fixtures and the tests
+
+Supports single Range requests, which the segmented downloaders need.
+"""
+
+import http.server
+import re
+import threading
+from contextlib import contextmanager
+from functools import partial
+from pathlib import Path
+from typing import Iterator
+
+
+class RangeHandler(http.server.SimpleHTTPRequestHandler):
+    """Static file handler with support for single Range requests
+
+    Paths listed in `server.truncate` are cut short (once each) to simulate
+    dropped connections. GET requests are logged in `server.requests`.
+    """
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_head(self):
+        path = self.translate_path(self.path)
+        try:
+            f = open(path, "rb")
+        except OSError:
+            self.send_error(404)
+            return None
+        size = f.seek(0, 2)
+        start, end = 0, size - 1
+        match = re.match(r"bytes=(\d+)-(\d*)", self.headers.get("Range", ""))
+        if match:
+            start = int(match.group(1))
+            end = min(int(match.group(2) or end), end)
+            self.send_response(206)
+            self.send_header("Content-Range", f"bytes {start}-{end}/{size}")
+        else:
+            self.send_response(200)
+        self.send_header("Content-Length", str(end - start + 1))
+        self.send_header("Accept-Ranges", "bytes")
+        self.send_header("Last-Modified", self.date_time_string(0))
+        self.end_headers()
+        f.seek(start)
+        self._remaining = end - start + 1
+        if self.command == "GET":
+            if self.path in self.server.truncate:  # type: ignore
+                self.server.truncate.discard(self.path)  # type: ignore
+                self._remaining //= 2
+                self.close_connection = True
+            self.server.requests.append(self.path)  # type: ignore
+        return f
+
+    def copyfile(self, source, outputfile):
+        while self._remaining > 0:
+            data = source.read(min(self._remaining, 1 << 20))
+            if not data:
+                break
+            outputfile.write(data)
+            self._remaining -= len(data)
+
+
+def start(root: Path) -> http.server.ThreadingHTTPServer:
+    """Serve the files in root from a background thread
+
+    The server's base URL is in `server.url`. Stop it with `stop`.
+    """
+    server = http.server.ThreadingHTTPServer(
+        ("127.0.0.1", 0), partial(RangeHandler, directory=str(root))
+    )
+    server.root = root  # type: ignore
+    server.truncate = set()  # type: ignore
+    server.requests = []  # type: ignore
+    server.url = f"http://127.0.0.1:{server.server_address[1]}"  # type: ignore
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server
+
+
+def stop(server: http.server.ThreadingHTTPServer) -> None:
+    server.shutdown()
+    server.server_close()
+
+
+@contextmanager
+def serve(root: Path) -> Iterator[str]:
+    """Serve the files in root
+
+    Yields the base URL.
+    """
+    server = start(root)
+    try:
+        yield server.url  # type: ignore
+    finally:
+        stop(server)
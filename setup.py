@@ -34,6 +34,12 @@ doc_requirements = ["Sphinx>1.8", "myst-parser==0.13.5"]
 
 dev_requirements = ["bump2version", "twine"]
 
+# Seekable zstd archives (alphafold_data.seekable)
+zstd_requirements = ["zstandard"]
+
+# Faster HH-suite database checks (alphafold_data.ffindex)
+numpy_requirements = ["numpy"]
+
 setup(
     author="Spencer Bliven",
     author_email="spencer.bliven@gmail.com",
@@ -59,6 +65,8 @@ setup(
     extras_require={
         "tests": test_requirements,
         "docs": doc_requirements,
+        "zstd": zstd_requirements,
+        "numpy": numpy_requirements,
         "dev": dev_requirements + test_requirements + doc_requirements,
     },
     license="BSD license",
@@ -0,0 +1,25 @@
+"""Shared fixtures"""
+
+import pytest
+
+from alphafold_data import sources
+from benchmarks.server import start, stop
+
+
+@pytest.fixture
+def http_server(tmp_path):
+    """Serve tmp_path/"www" over HTTP
+
+    Yields the server. Its base URL is in `server.url`.
+    """
+    root = tmp_path / "www"
+    root.mkdir()
+    server = start(root)
+    yield server
+    stop(server)
+
+
+@pytest.fixture
+def native(monkeypatch):
+    "Download with the built-in downloader instead of aria2c/wget"
+    monkeypatch.setattr(sources, "_file_downloader", sources.download_native)
@@ -0,0 +1,73 @@
+"""Tests for `alphafold_data.adaptive`."""
+
+import os
+import time
+
+import pytest
+
+from alphafold_data import adaptive
+from alphafold_data.adaptive import AdaptiveDownloader, HostProfile, choose_backend
+
+
+@pytest.fixture
+def small_probes(monkeypatch):
+    monkeypatch.setattr(adaptive, "_PROBE_MIN_SIZE", 10000)
+    monkeypatch.setattr(adaptive, "_PROBE_BYTES", 4096)
+    monkeypatch.setattr(adaptive, "_MAX_CONNECTIONS", 4)
+
+
+def test_choose_backend():
+    available = ["aria2c", "native", "curl"]
+    profile = HostProfile(connections=8)
+    assert choose_backend(profile, available) == "aria2c"
+    profile.rates["aria2c"] = 50e6
+    assert choose_backend(profile, available) == "native"
+    profile.rates["native"] = 80e6
+    assert choose_backend(profile, available) == "native"
+    # single connection hosts don't need a segmented downloader
+    assert choose_backend(HostProfile(connections=1), available) == "curl"
+
+
+def test_probe(http_server, small_probes):
+    (http_server.root / "db.tar").write_bytes(os.urandom(100000))
+
+    profile = adaptive.probe(f"{http_server.url}/db.tar", 100000)
+
+    assert 1 <= profile.connections <= 4
+    assert str(profile.connections) in profile.probe_rates
+    assert http_server.requests
+
+
+def test_adaptive_downloader(tmp_path, http_server, small_probes, monkeypatch):
+    data = os.urandom(100000)
+    (http_server.root / "db.tar").write_bytes(data)
+    url = f"{http_server.url}/db.tar"
+    calls = []
+    probes = []
+
+    def measure(url, size, connections):
+        probes.append(connections)
+        return min(connections, 2) * 1e6  # no gain beyond 2 connections
+
+    monkeypatch.setattr(adaptive, "_measure", measure)
+
+    def fake(name, delay):
+        def download(url, dst, hasher=None, connections=1):
+            calls.append((name, connections))
+            time.sleep(delay)
+            dst.write_bytes(data)
+
+        return download
+
+    backends = {"aria2c": fake("aria2c", 0.2), "native": fake("native", 0)}
+    downloader = AdaptiveDownloader(tmp_path, backends)
+    for i in range(3):
+        downloader(url, tmp_path / f"out{i}")
+    assert probes == [1, 2, 4]
+    assert calls == [("aria2c", 2), ("native", 2), ("native", 2)]
+
+    # later runs start from what was learned, without probing again
+    calls.clear()
+    AdaptiveDownloader(tmp_path, backends)(url, tmp_path / "again")
+    assert calls == [("native", 2)]
+    assert probes == [1, 2, 4]
@@ -2,11 +2,14 @@
 
 """Tests for `alphafold_data` package."""
 
+import gzip
+
 import pytest
 
 from click.testing import CliRunner
 
 from alphafold_data import alphafold_data, cli
+from alphafold_data.sources import MgnifySource
 
 
 @pytest.fixture
@@ -34,3 +37,19 @@ def test_command_line_interface():
     help_result = runner.invoke(cli.main, ["--help"])
     assert help_result.exit_code == 0
     assert "--help  Show this message and exit." in help_result.output
+
+
+def test_decompress_failures(tmp_path):
+    "A failing source doesn't stop the others from being extracted"
+    afd = alphafold_data.AFData(tmp_path)
+    afd._sources = {version: MgnifySource(version) for version in ("v1", "v2", "v3")}
+    for version in ("v1", "v3"):
+        src = tmp_path / afd._sources[version].compressed
+        src.parent.mkdir(parents=True)
+        src.write_bytes(gzip.compress(f">{version}\nMKV\n".encode()))
+    # v2 was never downloaded
+    assert not afd.decompress()
+    for version in ("v1", "v3"):
+        out = tmp_path / afd._sources[version].uncompressed
+        assert out.read_bytes() == f">{version}\nMKV\n".encode()
+    assert not (tmp_path / afd._sources["v2"].uncompressed).exists()
@@ -0,0 +1,69 @@
+"""Tests for `alphafold_data.cache`."""
+
+import gzip
+import stat
+
+import pytest
+
+from alphafold_data import sources
+from alphafold_data.cache import DownloadCache, validator
+from alphafold_data.checksum import Manifest
+from alphafold_data.sources import MgnifySource
+
+
+@pytest.fixture
+def cache(tmp_path, monkeypatch, native):
+    cache = DownloadCache(tmp_path / "cache")
+    monkeypatch.setattr(sources, "_download_cache", cache)
+    return cache
+
+
+def _source(http_server):
+    (http_server.root / "mgnify.fa.gz").write_bytes(gzip.compress(b">a\nMKV\n" * 100))
+    source = MgnifySource("2022_05")
+    source.url = f"{http_server.url}/mgnify.fa.gz"
+    return source
+
+
+def test_shared_download(tmp_path, http_server, cache):
+    source = _source(http_server)
+    first, second = tmp_path / "node1", tmp_path / "node2"
+    source.download(first)
+    assert http_server.requests == ["/mgnify.fa.gz"]
+    assert cache.get(source.url, validator(source.url)) is not None
+
+    source.download(second)
+    assert http_server.requests == ["/mgnify.fa.gz"]
+    a, b = first / source.compressed, second / source.compressed
+    assert a.read_bytes() == b.read_bytes()
+    assert a.stat().st_ino == b.stat().st_ino  # hardlinked
+    # so it mustn't be modified in place
+    assert stat.S_IMODE(a.stat().st_mode) == 0o444
+    assert Manifest(second).get(source.compressed) == Manifest(first).get(
+        source.compressed
+    )
+
+
+def test_stale_or_corrupt(tmp_path, http_server, cache, monkeypatch):
+    source = _source(http_server)
+    source.download(tmp_path / "node1")
+    cached = tmp_path / "node1" / source.compressed
+
+    # a new upstream version isn't served from the cache
+    monkeypatch.setattr(sources, "validator", lambda url: 'etag:"v2"')
+    source.download(tmp_path / "node2")
+    assert len(http_server.requests) == 2
+
+    # corrupt entries are ignored and replaced by a fresh download
+    entry = cache._path(source.url, 'etag:"v2"')
+    data = bytearray(entry.read_bytes())
+    data[-1] ^= 0xFF
+    entry.chmod(0o644)
+    entry.write_bytes(data)
+    source.download(tmp_path / "node3")
+    assert len(http_server.requests) == 3
+    assert (tmp_path / "node3" / source.compressed).read_bytes() == cached.read_bytes()
+    entry = cache.get(source.url, 'etag:"v2"')
+    assert entry is not None and entry.digests == Manifest(tmp_path / "node3").get(
+        source.compressed
+    )
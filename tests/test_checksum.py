@@ -0,0 +1,77 @@
+"""Tests for `alphafold_data.checksum`."""
+
+import hashlib
+import os
+from pathlib import Path
+
+import pytest
+
+from alphafold_data.checksum import ChecksumError, Hasher, Manifest
+from alphafold_data.segmented import download_native
+from alphafold_data.sources import MgnifySource
+from alphafold_data.state import DOWNLOADED, StateDB
+
+
+def test_hash_during_download(http_server, tmp_path):
+    data = os.urandom(50000)
+    (http_server.root / "file.bin").write_bytes(data)
+    hasher = Hasher()
+    download_native(f"{http_server.url}/file.bin", tmp_path / "file.bin", 3, hasher)
+    assert hasher.hexdigests() == {
+        "md5": hashlib.md5(data).hexdigest(),
+        "sha256": hashlib.sha256(data).hexdigest(),
+    }
+
+
+def test_verify(tmp_path, monkeypatch):
+    source = MgnifySource("2022_05")
+    path = tmp_path / source.compressed
+    path.parent.mkdir(parents=True)
+    path.write_bytes(b"data")
+    source.checksums = {"md5": hashlib.md5(b"data").hexdigest()}
+
+    source.verify(tmp_path)
+    assert Manifest(tmp_path).get(source.compressed)["md5"] == source.checksums["md5"]
+
+    # unchanged files are not re-read
+    monkeypatch.setattr(Hasher, "update_from_file", None)
+    source.verify(tmp_path)
+    with pytest.raises(TypeError):
+        source.verify(tmp_path, full=True)
+    monkeypatch.undo()
+
+    path.write_bytes(b"corrupt")
+    with pytest.raises(ChecksumError):
+        source.verify(tmp_path)
+
+
+def test_verify_without_checksums(tmp_path):
+    source = MgnifySource("2022_05")
+    path = tmp_path / source.compressed
+    path.parent.mkdir(parents=True)
+    path.write_bytes(b"data")
+    StateDB(tmp_path).finish(source.compressed, DOWNLOADED, 4)
+
+    source.verify(tmp_path)
+    # digests are recorded, but there was nothing to check them against
+    assert (
+        Manifest(tmp_path).get(source.compressed)["md5"]
+        == hashlib.md5(b"data").hexdigest()
+    )
+    assert not source.verified(tmp_path)
+
+
+def test_download_mismatch(http_server, tmp_path, monkeypatch):
+    monkeypatch.setenv("AFD_DOWNLOADER", "native")
+    monkeypatch.setattr("alphafold_data.sources._file_downloader", None)
+    (http_server.root / "mgy.fa.gz").write_bytes(b"data")
+    source = MgnifySource("2022_05")
+    source.url = f"{http_server.url}/mgy.fa.gz"
+    source.checksums = {"sha256": "0" * 64}
+
+    with pytest.raises(ChecksumError):
+        source.download(tmp_path)
+    path = Path(tmp_path, source.compressed)
+    assert not path.exists()
+    # kept for inspection
+    assert path.with_name(path.name + ".bad").read_bytes() == b"data"
@@ -0,0 +1,66 @@
+"""Tests for `alphafold_data.dedup`."""
+
+import io
+import os
+import stat
+import tarfile
+
+from alphafold_data.dedup import dedup
+from alphafold_data.untar import extract_tgz
+
+
+def test_dedup(tmp_path):
+    shared = os.urandom(100000)
+    old = tmp_path / "uncompressed/params/2021-10-27"
+    new = tmp_path / "uncompressed/params/2022-12-06"
+    for i, version in enumerate((old, new)):
+        version.mkdir(parents=True)
+        (version / "params_model_1.npz").write_bytes(shared)
+        (version / "params_model_2.npz").write_bytes(os.urandom(100001 + i))
+    (old / "small.txt").write_text("tiny")
+    (new / "small.txt").write_text("tiny")
+
+    report = dedup(tmp_path, methods=("hardlink",))
+
+    assert report.duplicates == 1
+    assert report.bytes_saved == len(shared)
+    assert report.hashed == 2
+    a = (old / "params_model_1.npz").stat()
+    b = (new / "params_model_1.npz").stat()
+    assert (a.st_ino, a.st_nlink) == (b.st_ino, 3)
+    assert (new / "params_model_1.npz").read_bytes() == shared
+    assert stat.S_IMODE(b.st_mode) == 0o444
+
+    # a third version is linked against the store, using cached digests
+    third = tmp_path / "uncompressed/params/2023-01-01"
+    third.mkdir()
+    (third / "params_model_1.npz").write_bytes(shared)
+    report = dedup(tmp_path)
+    assert report.duplicates == 1
+    assert report.hashed == 1
+    assert sum(report.methods.values()) == 1
+
+
+def _tgz(path, files):
+    with tarfile.open(path, "w:gz") as tar:
+        for name, data in files.items():
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            tar.addfile(info, io.BytesIO(data))
+
+
+def test_reextract_after_dedup(tmp_path):
+    shared = os.urandom(100000)
+    _tgz(tmp_path / "old.tar.gz", {"db/data.bin": shared})
+    _tgz(tmp_path / "new.tar.gz", {"db/data.bin": b"0123456789"})
+    v1 = tmp_path / "uncompressed/pdb70/v1"
+    v2 = tmp_path / "uncompressed/pdb70/v2"
+    extract_tgz(tmp_path / "old.tar.gz", v1)
+    extract_tgz(tmp_path / "old.tar.gz", v2)
+    assert dedup(tmp_path, methods=("hardlink",)).duplicates == 1
+
+    extract_tgz(tmp_path / "new.tar.gz", v1)
+    assert (v1 / "db/data.bin").read_bytes() == b"0123456789"
+    # the linked copies are untouched
+    assert (v2 / "db/data.bin").read_bytes() == shared
+    assert dedup(tmp_path, methods=("hardlink",)).duplicates == 0
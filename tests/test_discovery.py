@@ -0,0 +1,131 @@
+"""Tests for `alphafold_data.discovery`."""
+
+import hashlib
+import http.server
+import threading
+
+import pytest
+
+from alphafold_data import discovery
+from alphafold_data.discovery import discover_sources
+from alphafold_data.sources import UniprotSource, latest_sources
+
+SCRIPTS = {
+    "/scripts/download_alphafold_params.sh": 'SOURCE_URL="https://storage.'
+    'googleapis.com/alphafold/alphafold_params_2030-01-01.tar"',
+    "/scripts/download_mgnify.sh": 'SOURCE_URL="https://storage.googleapis.com/'
+    'alphafold-databases/v3.0/mgy_clusters_2029_10.fa.gz"',
+    "/scripts/download_pdb70.sh": 'SOURCE_URL="http://wwwuser.gwdg.de/~compbiol/'
+    'data/hhsuite/databases/hhsuite_dbs/old-releases/pdb70_from_mmcif_290101.tar.gz"',
+    "/scripts/download_uniref30.sh": 'SOURCE_URL="https://storage.googleapis.com/'
+    'alphafold-databases/v3.0/UniRef30_2029_02.tar.gz"',
+    "/uniprot/reldate.txt": "UniProt Knowledgebase Release 2029_03 consists of:",
+}
+
+
+class _Handler(http.server.BaseHTTPRequestHandler):
+    "Serves SCRIPTS with ETags, answering conditional requests with 304"
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        body = self.server.docs.get(self.path)  # type: ignore
+        if body is None:
+            self.send_error(404)
+            return
+        etag = '"' + hashlib.md5(body.encode()).hexdigest() + '"'
+        if self.headers.get("If-None-Match") == etag:
+            self.server.statuses.append(304)  # type: ignore
+            self.send_response(304)
+            self.end_headers()
+            return
+        self.server.statuses.append(200)  # type: ignore
+        self.send_response(200)
+        self.send_header("ETag", etag)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body.encode())
+
+
+@pytest.fixture
+def upstream():
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+    server.docs = dict(SCRIPTS)  # type: ignore
+    server.statuses = []  # type: ignore
+    server.url = f"http://127.0.0.1:{server.server_address[1]}"  # type: ignore
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def _discover(tmp_path, url):
+    return discover_sources(
+        tmp_path, scripts_url=f"{url}/scripts", uniprot_url=f"{url}/uniprot"
+    )
+
+
+def test_discover(tmp_path, upstream):
+    sources = _discover(tmp_path, upstream.url)
+    assert sources["params"].version == "2030-01-01"
+    assert sources["mgnify"].url.endswith("/v3.0/mgy_clusters_2029_10.fa.gz")
+    assert sources["pdb70"].version == "290101"
+    assert sources["uniref30"].version == "2029_02"
+    assert sources["bfd"].version == latest_sources()["bfd"].version
+    # only pinned sources are looked up; UniProt isn't installed by default
+    assert sources.keys() == latest_sources().keys()
+    assert upstream.statuses == [200] * 4
+
+    # unchanged documents are revalidated, not downloaded
+    upstream.statuses.clear()
+    assert _discover(tmp_path, upstream.url)["mgnify"].version == "2029_10"
+    assert upstream.statuses == [304] * 4
+
+    upstream.docs["/scripts/download_mgnify.sh"] = (
+        "alphafold-databases/v3.1/mgy_clusters_2030_01.fa.gz"
+    )
+    assert _discover(tmp_path, upstream.url)["mgnify"].version == "2030_01"
+
+
+def test_offline(tmp_path, upstream):
+    _discover(tmp_path, upstream.url)
+    upstream.docs.clear()  # 404 for everything
+
+    # cached documents are used when upstream fails
+    assert _discover(tmp_path, upstream.url)["pdb70"].version == "290101"
+
+    # without a cache, the pinned versions are used
+    sources = _discover(tmp_path / "fresh", upstream.url)
+    assert sources["pdb70"].version == latest_sources()["pdb70"].version
+    assert "uniprot" not in sources
+
+
+def test_cached_only(tmp_path, upstream):
+    # nothing looked up yet: the pinned versions, without any requests
+    sources = discover_sources(tmp_path, scripts_url=upstream.url, offline=True)
+    assert sources["pdb70"].version == latest_sources()["pdb70"].version
+    assert upstream.statuses == []
+
+    _discover(tmp_path, upstream.url)
+    upstream.statuses.clear()
+    sources = discover_sources(
+        tmp_path,
+        scripts_url=f"{upstream.url}/scripts",
+        uniprot_url=f"{upstream.url}/uniprot",
+        offline=True,
+    )
+    assert sources["pdb70"].version == "290101"
+    assert upstream.statuses == []
+
+
+def test_pinned_uniprot(tmp_path, upstream, monkeypatch):
+    "Sources are only re-versioned if they are pinned"
+    pinned = latest_sources()
+    pinned["uniprot"] = UniprotSource("2023_01")
+    monkeypatch.setattr(discovery, "latest_sources", lambda: dict(pinned))
+
+    sources = _discover(tmp_path, upstream.url)
+    assert sources["uniprot"].version == "2029_03"
+    assert sources["uniprot"].urls[0].startswith(f"{upstream.url}/uniprot/")
+    assert sources.keys() == pinned.keys()
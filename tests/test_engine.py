@@ -0,0 +1,90 @@
+"""Tests for `alphafold_data.engine`."""
+
+import logging
+import signal
+import subprocess
+import threading
+import time
+
+import pytest
+
+from alphafold_data.engine import DISK, NETWORK, Engine
+
+
+def test_output(caplog):
+    caplog.set_level(logging.DEBUG)
+    engine = Engine()
+    result = engine.run(["sh", "-c", "echo out; printf 'a\\rb\\n' >&2; exit 3"])
+    assert result.returncode == 3
+    assert result.stderr == "a\nb"
+    with pytest.raises(subprocess.CalledProcessError) as err:
+        result.check_returncode()
+    assert err.value.stderr == "a\nb"
+    assert "sh: out" in caplog.messages
+
+    with pytest.raises(FileNotFoundError):
+        engine.run(["afd-no-such-tool"])
+
+
+def _timed(engine, kinds):
+    threads = [
+        threading.Thread(target=engine.run, args=(["sleep", "0.3"], kind))
+        for kind in kinds
+    ]
+    start = time.monotonic()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return time.monotonic() - start
+
+
+def test_limits():
+    engine = Engine(network=1, disk=2)
+    # two disk slots: 4 stages in two rounds
+    assert 0.6 <= _timed(engine, [DISK] * 4) < 0.9
+    # network and disk stages overlap
+    assert _timed(engine, [NETWORK, DISK]) < 0.5
+    with engine.slot(DISK), engine.slot(DISK):
+        assert _timed(engine, [NETWORK]) < 0.5
+
+
+def test_cancel():
+    engine = Engine()
+    results = []
+    thread = threading.Thread(
+        target=lambda: results.append(engine.run(["sleep", "30"], NETWORK))
+    )
+    thread.start()
+    time.sleep(0.2)
+    engine.cancel()
+    thread.join(5)
+    assert results[0].returncode < 0
+
+
+@pytest.mark.skipif(not hasattr(signal, "setitimer"), reason="needs setitimer")
+def test_slot_interrupted():
+    engine = Engine(disk=1)
+
+    def interrupt(signum, frame):
+        raise KeyboardInterrupt
+
+    previous = signal.signal(signal.SIGALRM, interrupt)
+    try:
+        with engine.slot(DISK):
+            signal.setitimer(signal.ITIMER_REAL, 0.2)
+            with pytest.raises(KeyboardInterrupt):
+                with engine.slot(DISK):
+                    pass
+    finally:
+        signal.signal(signal.SIGALRM, previous)
+
+    # the abandoned request didn't take the slot once it was released
+    acquired = threading.Event()
+
+    def use_slot():
+        with engine.slot(DISK):
+            acquired.set()
+
+    threading.Thread(target=use_slot, daemon=True).start()
+    assert acquired.wait(5)
@@ -0,0 +1,51 @@
+"""Tests for `alphafold_data.fasta`."""
+
+import gzip
+import os
+
+import pytest
+
+from alphafold_data import fasta
+from alphafold_data.fasta import FastaIndex, FastaIndexer, index_current, index_path
+from alphafold_data.gunzip import gunzip
+
+
+@pytest.fixture
+def records():
+    return [b">MGYP%06d description %d\nMKV\nLAA\n" % (i, i) for i in range(3000)]
+
+
+def test_index_built_while_decompressing(tmp_path, records, monkeypatch):
+    monkeypatch.setattr(fasta, "_RUN_RECORDS", 500)  # exercise the merge
+    src = tmp_path / "db.fa.gz"
+    src.write_bytes(gzip.compress(b"".join(records)))
+    dst = tmp_path / "db.fa"
+
+    indexer = FastaIndexer()
+    chunks = []
+    gunzip(src, dst, backend="serial", tee=chunks.append)
+    data = b"".join(chunks)
+    for i in range(0, len(data), 7):  # headers split across chunks
+        indexer.write(data[i : i + 7])
+    indexer.save(dst)
+
+    assert index_current(dst)
+    with FastaIndex(dst) as index:
+        assert len(index) == len(records)
+        assert index["MGYP000000"] == records[0]
+        assert index.get("MGYP002999") == records[-1]
+        assert "MGYP1" not in index
+
+
+def test_index_rebuilt_when_fasta_changes(tmp_path, records):
+    path = tmp_path / "db.fa"
+    path.write_bytes(b"".join(records[:10]))
+    with FastaIndex(path) as index:
+        assert "MGYP000020" not in index
+
+    path.write_bytes(b"".join(records[:30]))
+    os.utime(path, ns=(0, 0))
+    assert not index_current(path)
+    with FastaIndex(path) as index:
+        assert index["MGYP000020"] == records[20]
+    assert index_path(path).exists()
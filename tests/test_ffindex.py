@@ -0,0 +1,142 @@
+"""Tests for `alphafold_data.ffindex`."""
+
+import pytest
+
+from alphafold_data import ffindex
+from alphafold_data.ffindex import FFIndexError, validate, validate_pair
+from alphafold_data.sources import PDB70Source
+from alphafold_data.state import VALIDATED, StateDB
+
+
+@pytest.fixture(params=["numpy", "python"])
+def backend(request, monkeypatch):
+    "Run with numpy (if installed) and with the pure Python fallback"
+    if request.param == "numpy":
+        pytest.importorskip("numpy")
+    else:
+        monkeypatch.setattr(ffindex, "numpy", None)
+    return request.param
+
+
+def _write_db(directory, name, records, shuffle=False):
+    "Write an ffindex/ffdata pair, returning the paths"
+    directory.mkdir(parents=True, exist_ok=True)
+    data = b""
+    entries = []
+    for key, record in records.items():
+        entries.append(b"%s\t%d\t%d\n" % (key, len(data), len(record) + 1))
+        data += record + b"\0"
+    if shuffle:
+        entries.reverse()
+    ffindex_path = directory / f"{name}.ffindex"
+    ffdata_path = directory / f"{name}.ffdata"
+    ffindex_path.write_bytes(b"".join(entries))
+    ffdata_path.write_bytes(data)
+    return ffindex_path, ffdata_path
+
+
+@pytest.fixture
+def records():
+    return {b"%04d" % i: b"#A3M\n>seq%d\nMKV\n" % i for i in range(100)}
+
+
+def test_valid(tmp_path, records, backend):
+    index, data = _write_db(tmp_path, "db_a3m", records)
+    report = validate_pair(index, data)
+    assert report.ok and not report.resorted
+    assert report.entries == 100
+
+
+def test_truncated(tmp_path, records, backend):
+    index, data = _write_db(tmp_path, "db_a3m", records)
+    with data.open("r+b") as f:
+        f.truncate(data.stat().st_size - 30)
+
+    report = validate_pair(index, data)
+    assert not report.ok
+    assert report.invalid == 2
+    assert report.errors[0].startswith("0098 at ")
+
+    data.write_bytes(b"")
+    assert validate_pair(index, data).invalid == 100
+
+
+def test_missing_terminator(tmp_path, records, backend):
+    index, data = _write_db(tmp_path, "db_a3m", records)
+    raw = bytearray(data.read_bytes())
+    raw[raw.index(b"\0")] = ord("\n")
+    data.write_bytes(bytes(raw))
+
+    assert validate_pair(index, data).invalid == 1
+
+
+def test_resort(tmp_path, records, backend):
+    index, data = _write_db(tmp_path, "db_hhm", records, shuffle=True)
+    report = validate_pair(index, data, repair=False)
+    assert report.ok and not report.resorted
+
+    report = validate_pair(index, data)
+    assert report.ok and report.resorted
+    names = [line.split(b"\t")[0] for line in index.read_bytes().splitlines()]
+    assert names == sorted(records)
+    assert not validate_pair(index, data).resorted
+
+
+def test_blocks(tmp_path, records, backend, monkeypatch):
+    "Indexes larger than a block, resorted with sort(1)"
+    monkeypatch.setattr(ffindex, "_CHUNK_SIZE", 100)
+    monkeypatch.setattr(ffindex, "_SORT_IN_MEMORY", 100)
+    index, data = _write_db(tmp_path, "db_a3m", records, shuffle=True)
+    with data.open("r+b") as f:
+        f.truncate(data.stat().st_size - 30)
+
+    report = validate_pair(index, data)
+    assert report.entries == 100
+    assert report.invalid == 2 and report.resorted
+    names = [line.split(b"\t")[0] for line in index.read_bytes().splitlines()]
+    assert names == sorted(records)
+
+    index.write_bytes(index.read_bytes() + b"broken\n")
+    with pytest.raises(FFIndexError, match="line 101"):
+        validate_pair(index, data)
+
+
+def test_resort_without_final_newline(tmp_path, backend):
+    index, data = _write_db(tmp_path, "db_hhm", {b"b": b"x", b"a": b"y"})
+    index.write_bytes(b"b\t0\t2\na\t2\t2")
+
+    assert validate_pair(index, data).resorted
+    assert index.read_bytes() == b"a\t2\t2\nb\t0\t2\n"
+    report = validate_pair(index, data)
+    assert report.ok and not report.resorted
+
+
+def test_malformed(tmp_path, records):
+    index, data = _write_db(tmp_path, "db_cs219", records)
+    index.write_bytes(index.read_bytes() + b"broken\n")
+    with pytest.raises(FFIndexError, match="line 101"):
+        validate_pair(index, data)
+    with pytest.raises(FFIndexError):
+        validate(tmp_path / "empty")
+
+
+def test_source_validate(tmp_path, records):
+    data_dir = tmp_path / "data"
+    source = PDB70Source("200401")
+    db = data_dir / source.uncompressed / "pdb70"
+    _write_db(db, "pdb70_a3m", records)
+    _, hhm = _write_db(db, "pdb70_hhm", records, shuffle=True)
+    (db / "pdb70_clu.tsv").write_text("")
+
+    source.validate(data_dir)
+    assert source.validated(data_dir)
+    assert StateDB(data_dir).done(source.uncompressed, VALIDATED)
+
+    # checked again after a new extraction
+    StateDB(data_dir).finish(source.uncompressed, "extracted", 0)
+    assert not source.validated(data_dir)
+    with hhm.open("r+b") as f:
+        f.truncate(10)
+    with pytest.raises(FFIndexError, match="pdb70_hhm"):
+        source.validate(data_dir)
+    assert not source.validated(data_dir)
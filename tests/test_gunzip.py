@@ -0,0 +1,74 @@
+"""Tests for `alphafold_data.gunzip`."""
+
+import gzip
+import os
+import struct
+import zlib
+
+import pytest
+
+from alphafold_data.gunzip import gunzip
+
+
+def _bgzf(data, block=50000):
+    "Minimal BGZF writer"
+    out = b""
+    for i in range(0, len(data) + 1, block):
+        chunk = data[i : i + block]
+        deflate = zlib.compressobj(6, zlib.DEFLATED, -15)
+        body = deflate.compress(chunk) + deflate.flush()
+        header = b"\x1f\x8b\x08\x04" + b"\0" * 4 + b"\0\xff"
+        header += struct.pack("<H2sHH", 6, b"BC", 2, 18 + len(body) + 8 - 1)
+        out += header + body + struct.pack("<II", zlib.crc32(chunk), len(chunk))
+    return out
+
+
+@pytest.fixture
+def data():
+    return b"".join(b">seq%d\nACDEFGHIKLMNPQRSTVWY\n" % i for i in range(40000))
+
+
+@pytest.mark.parametrize("backend", ["threaded", "serial"])
+def test_gunzip(tmp_path, data, backend):
+    src = tmp_path / "seq.fa.gz"
+    src.write_bytes(gzip.compress(data[:1000]) + gzip.compress(data[1000:]))
+    dst = tmp_path / "out" / "seq.fa"
+
+    stats = gunzip(src, dst, backend=backend)
+
+    assert dst.read_bytes() == data
+    assert stats.uncompressed_bytes == len(data)
+    assert stats.compressed_bytes == src.stat().st_size
+    assert not (tmp_path / "out" / "seq.fa.partial").exists()
+
+
+def test_gunzip_bgzf(tmp_path, data):
+    src = tmp_path / "seq.fa.gz"
+    src.write_bytes(_bgzf(data))
+    assert gzip.decompress(src.read_bytes()) == data
+
+    gunzip(src, tmp_path / "seq.fa", backend="threaded", threads=4)
+    assert (tmp_path / "seq.fa").read_bytes() == data
+
+
+def test_gunzip_truncated(tmp_path):
+    src = tmp_path / "seq.fa.gz"
+    src.write_bytes(gzip.compress(os.urandom(100000))[:-1000])
+    with pytest.raises(EOFError):
+        gunzip(src, tmp_path / "seq.fa", backend="threaded")
+    assert not (tmp_path / "seq.fa").exists()
+    assert not (tmp_path / "seq.fa.partial").exists()
+
+
+@pytest.mark.parametrize("bgzf", [False, True])
+def test_gunzip_zero_padding(tmp_path, data, bgzf):
+    "Trailing zeros (e.g. from tape blocks) are ignored, like gzip does"
+    src = tmp_path / "seq.fa.gz"
+    compressed = _bgzf(data) if bgzf else gzip.compress(data)
+    src.write_bytes(compressed + b"\0" * 3000)
+    gunzip(src, tmp_path / "seq.fa", backend="threaded", threads=4)
+    assert (tmp_path / "seq.fa").read_bytes() == data
+
+    src.write_bytes(compressed + b"\0" * 3000 + b"garbage")
+    with pytest.raises((OSError, zlib.error)):
+        gunzip(src, tmp_path / "seq.fa", backend="threaded", threads=4)
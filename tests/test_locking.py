@@ -0,0 +1,140 @@
+"""Tests for `alphafold_data.locking`."""
+
+import gzip
+import multiprocessing
+import os
+import threading
+import time
+
+from alphafold_data.alphafold_data import AFData
+from alphafold_data.checksum import Manifest
+from alphafold_data.locking import Leases
+from alphafold_data.sources import MgnifySource
+
+
+def test_exclusive(tmp_path):
+    leases = Leases(tmp_path)
+    with leases.try_acquire("mgnify") as lease:
+        assert Leases(tmp_path).try_acquire("mgnify") is None
+        assert [info.key for info in leases.held()] == ["mgnify"]
+        assert lease.owner == leases.held()[0].owner
+    assert leases.held() == []
+    leases.try_acquire("mgnify").release()
+
+
+def test_abandoned(tmp_path):
+    leases = Leases(tmp_path, ttl=0.2)
+    dead = leases.try_acquire("bfd")
+    time.sleep(0.3)
+    # the heartbeat keeps the lease alive
+    assert leases.try_acquire("bfd") is None
+
+    # a worker which stopped heartbeating loses its lease
+    dead._stop.set()
+    dead._thread.join()
+    old = time.time() - 10
+    os.utime(dead.path, (old, old))
+    taken = leases.try_acquire("bfd")
+    assert taken is not None
+    dead.release()
+    assert dead.lost
+    assert leases.held()[0].owner == taken.owner
+    taken.release()
+
+
+def _worker(data_dir, urls, start):
+    time.sleep(max(0, start - time.time()))
+    afd = AFData(data_dir, jobs=2, downloader="native")
+    afd._sources = {}
+    for version, url in urls.items():
+        afd._sources[version] = MgnifySource(version)
+        afd._sources[version].url = url
+    assert afd.download() and afd.decompress()
+
+
+def test_workers(tmp_path, http_server):
+    urls = {}
+    for i in range(6):
+        (http_server.root / f"{i}.fa.gz").write_bytes(gzip.compress(os.urandom(200000)))
+        urls[f"v{i}"] = f"{http_server.url}/{i}.fa.gz"
+    data_dir = tmp_path / "data"
+    data_dir.mkdir()
+
+    ctx = multiprocessing.get_context("spawn")
+    start = time.time() + 2
+    workers = [
+        ctx.Process(target=_worker, args=(data_dir, urls, start)) for _ in range(3)
+    ]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join(60)
+        assert worker.exitcode == 0
+
+    # every file was downloaded exactly once
+    assert sorted(http_server.requests) == sorted(f"/{i}.fa.gz" for i in range(6))
+    manifest = Manifest(data_dir)
+    for version in urls:
+        source = MgnifySource(version)
+        assert source.uncompressed_available(data_dir, deep=True)
+        assert manifest.get(source.compressed) is not None
+    assert Leases(data_dir).held() == []
+
+
+def _recorder(data_dir, worker, start):
+    time.sleep(max(0, start - time.time()))
+    manifest = Manifest(data_dir)
+    for i in range(25):
+        relpath = f"{worker}-{i}"
+        (data_dir / relpath).write_text(relpath)
+        manifest.record(relpath, {"md5": relpath})
+
+
+def test_shared_manifest(tmp_path):
+    ctx = multiprocessing.get_context("spawn")
+    start = time.time() + 2
+    workers = [
+        ctx.Process(target=_recorder, args=(tmp_path, worker, start))
+        for worker in range(4)
+    ]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join(60)
+        assert worker.exitcode == 0
+
+    # no update was lost
+    recorded = Manifest(tmp_path).get_many(
+        f"{worker}-{i}" for worker in range(4) for i in range(25)
+    )
+    assert len(recorded) == 100
+
+
+def test_force_after_other_worker(tmp_path, monkeypatch):
+    source = MgnifySource("v1")
+    src = tmp_path / source.compressed
+    src.parent.mkdir(parents=True)
+    src.write_bytes(gzip.compress(b">a\nMKV\n"))
+    afd = AFData(tmp_path)
+    afd._sources = {"mgnify": source}
+    extracted = []
+    force_decompress = MgnifySource._force_decompress
+    monkeypatch.setattr(
+        MgnifySource,
+        "_force_decompress",
+        classmethod(lambda kls, s, d: extracted.append(d) or force_decompress(s, d)),
+    )
+
+    lease = Leases(tmp_path).try_acquire("mgnify")
+
+    def other_worker():
+        time.sleep(0.5)
+        source.decompress(tmp_path)
+        lease.release()
+
+    other = threading.Thread(target=other_worker)
+    other.start()
+    assert afd.decompress(force=True)
+    other.join()
+    # extracted by the other worker only, not again
+    assert len(extracted) == 1
@@ -0,0 +1,74 @@
+"""Tests for `alphafold_data.mmcif`."""
+
+import gzip
+import os
+import shutil
+
+import pytest
+
+from alphafold_data.mmcif import decompress_mmcif, download_rsync, previous_version
+
+
+def _write_cif(root, pdb_id, content):
+    path = root / pdb_id[1:3] / f"{pdb_id}.cif.gz"
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(gzip.compress(content))
+    return path
+
+
+def test_decompress_incremental(tmp_path, monkeypatch):
+    old_raw = tmp_path / "compressed/pdb/2023-01-04/raw"
+    _write_cif(old_raw, "1abc", b"data_1abc\n")
+    _write_cif(old_raw, "2xyz", b"data_2xyz\n")
+    old_out = tmp_path / "uncompressed/pdb/2023-01-04/mmcif_files"
+    decompress_mmcif(old_raw, old_out)
+    assert (old_out / "1abc.cif").read_bytes() == b"data_1abc\n"
+
+    # next week: one changed, one new, one obsolete
+    new_raw = tmp_path / "compressed/pdb/2023-01-11/raw"
+    shutil.copytree(old_raw, new_raw)  # preserves mtimes, like rsync -t
+    os.unlink(new_raw / "xy/2xyz.cif.gz")
+    _write_cif(new_raw, "1abc", b"data_1abc\nchanged\n")
+    _write_cif(new_raw, "3new", b"data_3new\n")
+    new_out = tmp_path / "uncompressed/pdb/2023-01-11/mmcif_files"
+    assert previous_version(new_out) == old_out
+
+    decompress_mmcif(new_raw, new_out, previous=previous_version(new_out))
+    assert sorted(p.name for p in new_out.glob("*.cif")) == ["1abc.cif", "3new.cif"]
+    assert (new_out / "1abc.cif").read_bytes() == b"data_1abc\nchanged\n"
+
+    # nothing changed: nothing is expanded again
+    expanded = []
+    monkeypatch.setattr(
+        "alphafold_data.mmcif._expand", lambda src, dst: expanded.append(src)
+    )
+    decompress_mmcif(new_raw, new_out)
+    assert expanded == []
+
+
+def test_previous_version_links(tmp_path):
+    old_raw = tmp_path / "compressed/pdb/2023-01-04/raw"
+    _write_cif(old_raw, "1abc", b"data_1abc\n")
+    old_out = tmp_path / "uncompressed/pdb/2023-01-04/mmcif_files"
+    decompress_mmcif(old_raw, old_out)
+
+    new_raw = tmp_path / "compressed/pdb/2023-01-11/raw"
+    shutil.copytree(old_raw, new_raw)
+    new_out = tmp_path / "uncompressed/pdb/2023-01-11/mmcif_files"
+    decompress_mmcif(new_raw, new_out, previous=old_out)
+    assert (new_out / "1abc.cif").stat().st_ino == (old_out / "1abc.cif").stat().st_ino
+
+
+@pytest.mark.skipif(shutil.which("rsync") is None, reason="rsync not installed")
+def test_download_rsync(tmp_path):
+    upstream = tmp_path / "upstream"
+    _write_cif(upstream, "1abc", b"data_1abc\n")
+    first = tmp_path / "2023-01-04/raw"
+    download_rsync(f"{upstream}/", first)
+
+    _write_cif(upstream, "3new", b"data_3new\n")
+    second = tmp_path / "2023-01-11/raw"
+    download_rsync(f"{upstream}/", second, link_dest=first)
+    old = (first / "ab/1abc.cif.gz").stat()
+    assert (second / "ab/1abc.cif.gz").stat().st_ino == old.st_ino
+    assert (second / "ne/3new.cif.gz").exists()
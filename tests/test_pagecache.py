@@ -0,0 +1,76 @@
+"""Tests for `alphafold_data.pagecache`."""
+
+import os
+
+import pytest
+
+from alphafold_data import pagecache
+from alphafold_data.alphafold_data import AFData
+from alphafold_data.pagecache import residency, warm
+from alphafold_data.sources import MgnifySource, ParamSource
+
+
+@pytest.fixture
+def tree(tmp_path):
+    root = tmp_path / "db"
+    (root / "sub").mkdir(parents=True)
+    (root / "a.ffdata").write_bytes(os.urandom(300 << 10))
+    (root / "sub" / "b.ffindex").write_bytes(os.urandom(100 << 10))
+    (root / "empty").write_bytes(b"")
+    return root
+
+
+def test_residency(tree):
+    report = residency(tree)
+    assert report.size == 400 << 10
+    if not pagecache.supported():
+        assert report.fraction is None
+        return
+    # just written, so (at least partly) cached
+    assert report.cached is not None and 0 < report.cached <= report.size
+    assert str(report).endswith("%)")
+
+
+def test_warm(tree, monkeypatch):
+    monkeypatch.setattr(pagecache, "_RANGE_SIZE", 64 << 10)
+    monkeypatch.setattr(pagecache, "_BUFFER_SIZE", 16 << 10)
+    calls = []
+    real = pagecache._warm_range
+
+    def recording(path, offset, length):
+        calls.append((path.name, offset, length))
+        return real(path, offset, length)
+
+    monkeypatch.setattr(pagecache, "_warm_range", recording)
+
+    report = warm([tree / "sub", tree], budget=250 << 10, jobs=3)
+
+    # in the order given, until the budget is used up
+    assert report.bytes == 250 << 10
+    assert report.skipped == 250 << 10
+    assert report.files == 2
+    assert sorted(calls) == [
+        ("a.ffdata", 0, 64 << 10),
+        ("a.ffdata", 64 << 10, 64 << 10),
+        ("a.ffdata", 128 << 10, 22 << 10),
+        ("b.ffindex", 0, 64 << 10),
+        ("b.ffindex", 64 << 10, 36 << 10),
+    ]
+    if pagecache.supported():
+        assert residency(tree / "sub").fraction == 1.0
+
+
+def test_afdata_warm(tmp_path):
+    afd = AFData(tmp_path)
+    afd._sources = {"params": ParamSource("2022-12-06"), "mgnify": MgnifySource("v1")}
+    params = tmp_path / afd._sources["params"].uncompressed
+    params.mkdir(parents=True)
+    (params / "params_model_1.npz").write_bytes(os.urandom(1000))
+
+    report = afd.warm(budget=1 << 20)
+    assert report.files == 1 and report.bytes == 1000
+    table = afd.residency().splitlines()
+    assert len(table) == 2
+    assert table[1].split()[0] == "params"
+    with pytest.raises(ValueError):
+        afd.warm(["pdb70"])
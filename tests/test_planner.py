@@ -0,0 +1,156 @@
+"""Tests for `alphafold_data.planner`."""
+
+import gzip
+from types import SimpleNamespace
+
+import pytest
+
+from alphafold_data import planner, sources
+from alphafold_data.alphafold_data import AFData
+from alphafold_data.planner import Plan, PlanError, PlanItem, plan_update
+from alphafold_data.sources import MgnifySource, TemplateMMcifSource, latest_sources
+from alphafold_data.state import DOWNLOADED, EXTRACTED, StateDB
+
+
+def test_peak():
+    items = [
+        PlanItem("a", download=50, extract=100, prune=True),
+        PlanItem("b", download=20, extract=80, prune=True),
+        PlanItem("c", download=10, extract=10),
+    ]
+    plan = Plan(items, budget=250)
+    assert plan.permanent == 200
+    assert plan.peak == 250
+    assert plan.capacity == 50
+    assert plan.costs() == {"a": 50, "b": 20, "c": 0}
+    plan.check()
+
+    plan.budget = 249
+    assert not plan.fits
+    with pytest.raises(PlanError):
+        plan.check()
+
+
+def test_unknown_size():
+    plan = Plan([PlanItem("a", download=10), PlanItem("b", known=False)], 100)
+    assert plan.fits and plan.unknown == ["b"]
+    with pytest.raises(PlanError, match="b unknown"):
+        plan.check()
+    plan.check(allow_unknown=True)
+
+
+def _mgnify(http_server, version):
+    data = f">{version}\nMKV\n".encode() * 2000
+    (http_server.root / f"{version}.fa.gz").write_bytes(gzip.compress(data))
+    source = MgnifySource(version)
+    source.url = f"{http_server.url}/{version}.fa.gz"
+    return source, data
+
+
+def test_update_prune(tmp_path, http_server, native):
+    data_dir = tmp_path / "data"
+    data_dir.mkdir()
+    afd = AFData(data_dir, jobs=2)
+    afd._sources = {}
+    expected = {}
+    for version in ("v1", "v2"):
+        afd._sources[version], expected[version] = _mgnify(http_server, version)
+
+    plan = afd.plan(prune=True)
+    assert sorted(item.name for item in plan.items) == ["v1", "v2"]
+    assert all(item.prune and item.download for item in plan.items)
+
+    # refuses to start if the plan doesn't fit
+    assert not afd.update(prune=True, disk_budget=plan.peak - 1)
+    assert http_server.requests == []
+
+    # or if a size is unknown, unless allowed
+    missing = MgnifySource("v3")
+    missing.url = f"{http_server.url}/missing.fa.gz"
+    afd._sources["v3"] = missing
+    assert afd.plan().unknown == ["v3"]
+    assert not afd.update()
+    assert http_server.requests == []
+    del afd._sources["v3"]
+
+    assert afd.update(prune=True, disk_budget=plan.peak)
+    state = StateDB(data_dir)
+    for version, source in afd._sources.items():
+        assert (data_dir / source.uncompressed).read_bytes() == expected[version]
+        assert not (data_dir / source.compressed).exists()
+        assert not (data_dir / source.compressed).parent.exists()
+        assert state.get(source.compressed, DOWNLOADED) is None
+        assert state.done(source.uncompressed, EXTRACTED)
+
+    # nothing left to do
+    http_server.requests.clear()
+    assert afd.plan(prune=True).peak == 0
+    assert afd.update()
+    assert http_server.requests == []
+
+
+def test_prune_requires_extraction(tmp_path, http_server, native):
+    source, _ = _mgnify(http_server, "v1")
+    source.download(tmp_path)
+    assert source.prune(tmp_path) == 0
+    assert source.compressed_available(tmp_path, deep=True)
+
+    source.decompress(tmp_path)
+    size = source.local_size(tmp_path)
+    assert source.prune(tmp_path) == size
+    assert not source.compressed_available(tmp_path, deep=True)
+    assert source.uncompressed_available(tmp_path, deep=True)
+    # decompressing again is a no-op
+    source.decompress(tmp_path)
+
+
+def test_transcoded(tmp_path, http_server, native):
+    pytest.importorskip("zstandard")
+    source, data = _mgnify(http_server, "v1")
+    source.download(tmp_path)
+    source.transcode(tmp_path, remove=True)
+    assert not source.compressed_available(tmp_path)
+
+    # sized from the seek table, not downloaded again
+    (item,) = plan_update({"v1": source}, tmp_path).items
+    assert item.known and item.download == 0
+    assert item.extract == len(data)
+
+    source.decompress(tmp_path)
+    zst = tmp_path / source.transcoded
+    members = zst.with_name(zst.name + ".members.json")
+    size = zst.stat().st_size
+    assert source.prune(tmp_path) == size
+    assert not zst.exists() and not source.transcoded_available(tmp_path)
+    assert not members.exists()
+    assert (tmp_path / source.uncompressed).read_bytes() == data
+
+
+def test_latest_sources(tmp_path, monkeypatch):
+    "Every pinned source can be planned, including the rsync mirror"
+    monkeypatch.setattr(
+        sources, "url_size", lambda url: 1 << 30 if url.startswith("http") else 0
+    )
+    afd = AFData(tmp_path)
+    assert afd._sources.keys() == latest_sources().keys()
+    plan = afd.plan()
+    assert plan.unknown == []
+    (mmcif,) = [item for item in plan.items if item.name == "mmcif"]
+    assert mmcif.download == TemplateMMcifSource.full_size
+
+    # starts without --allow-unknown, if there is space
+    free = SimpleNamespace(total=1 << 50, free=1 << 50)
+    monkeypatch.setattr(planner.shutil, "disk_usage", lambda path: free)
+    started = []
+    monkeypatch.setattr(afd, "_run_parallel", lambda *args, **kw: started.append(1))
+    afd.update()
+    assert started
+
+
+def test_mmcif_estimate(tmp_path):
+    source = TemplateMMcifSource("2023-01-11")
+    assert source.estimated_size(tmp_path) == TemplateMMcifSource.full_size
+    previous = tmp_path / "compressed/pdb/2023-01-04/raw/ab"
+    previous.mkdir(parents=True)
+    (previous / "1abc.cif.gz").write_bytes(b"x" * 1000)
+    assert source.estimated_size(tmp_path) == 1000
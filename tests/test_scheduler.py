@@ -0,0 +1,68 @@
+"""Tests for `alphafold_data.scheduler`."""
+
+import threading
+import time
+
+from alphafold_data.scheduler import Job, Scheduler
+
+
+def _recorder():
+    lock = threading.Lock()
+    state = {"active": 0, "peak": 0, "hosts": {}, "host_peak": {}, "order": []}
+
+    def make(name, host):
+        def func():
+            with lock:
+                state["order"].append(name)
+                state["active"] += 1
+                state["peak"] = max(state["peak"], state["active"])
+                count = state["hosts"].get(host, 0) + 1
+                state["hosts"][host] = count
+                state["host_peak"][host] = max(state["host_peak"].get(host, 0), count)
+            time.sleep(0.05)
+            with lock:
+                state["active"] -= 1
+                state["hosts"][host] -= 1
+
+        return func
+
+    return state, make
+
+
+def test_limits():
+    state, make = _recorder()
+    jobs = [Job(f"a{i}", make(f"a{i}", "a"), host="a") for i in range(5)]
+    jobs += [Job(f"b{i}", make(f"b{i}", "b"), host="b") for i in range(5)]
+    results = Scheduler(max_workers=3, per_host=2).run(jobs)
+
+    assert set(results) == {job.name for job in jobs}
+    assert all(err is None for err in results.values())
+    assert state["peak"] == 3
+    assert state["host_peak"] == {"a": 2, "b": 2}
+
+
+def test_largest_first():
+    state, make = _recorder()
+    jobs = [Job(str(size), make(str(size), ""), size=size) for size in (1, 30, 2)]
+    Scheduler(max_workers=1).run(jobs)
+    assert state["order"] == ["30", "2", "1"]
+
+
+def test_failures():
+    def fail():
+        raise IOError("boom")
+
+    results = Scheduler().run([Job("ok", lambda: None), Job("bad", fail)])
+    assert results["ok"] is None
+    assert isinstance(results["bad"], IOError)
+
+
+def test_capacity():
+    state, make = _recorder()
+    jobs = [Job(f"j{i}", make(f"j{i}", str(i)), cost=6) for i in range(3)]
+    jobs.append(Job("huge", make("huge", ""), cost=11))
+    results = Scheduler(max_workers=3, per_host=0, capacity=10).run(jobs)
+
+    assert state["peak"] == 1
+    assert all(results[f"j{i}"] is None for i in range(3))
+    assert isinstance(results["huge"], ValueError)
@@ -0,0 +1,158 @@
+"""Tests for `alphafold_data.seekable`."""
+
+import gzip
+import io
+import os
+import tarfile
+
+import pytest
+
+from alphafold_data import seekable
+from alphafold_data.seekable import SeekTable
+from alphafold_data.sources import MgnifySource, PDB70Source
+from alphafold_data.state import DOWNLOADED, TRANSCODED, StateDB
+
+FRAME = 1000
+
+
+@pytest.fixture
+def zstandard():
+    return pytest.importorskip("zstandard")
+
+
+@pytest.fixture
+def fasta():
+    return b"".join(b">seq%d\nACDEFGHIKLMNPQRSTVWY\n" % i for i in range(2000))
+
+
+def test_seek_table(tmp_path):
+    table = SeekTable.from_sizes([(10, 100), (20, 100), (5, 30)])
+    path = tmp_path / "table.zst"
+    path.write_bytes(bytes(35) + table.to_bytes())
+    assert SeekTable.load(path) == table
+    assert table.frame_at(0) == 0
+    assert table.frame_at(199) == 1
+    assert table.frame_at(200) == 2
+    assert table.size == 230
+
+    path.write_bytes(bytes(36) + table.to_bytes())
+    with pytest.raises(ValueError):
+        SeekTable.load(path)
+
+
+def test_transcode(tmp_path, fasta, zstandard):
+    src = tmp_path / "seq.fa.gz"
+    src.write_bytes(gzip.compress(fasta))
+    dst = tmp_path / "seq.fa.zst"
+
+    stats = seekable.transcode(src, dst, frame_size=FRAME, threads=4)
+    assert stats.uncompressed_bytes == len(fasta)
+    table = SeekTable.load(dst)
+    assert table.frames == -(-len(fasta) // FRAME)
+
+    # a plain zstd file for other readers too
+    reader = zstandard.ZstdDecompressor().stream_reader(dst.open("rb"))
+    assert reader.read() == fasta
+
+    out = tmp_path / "seq.fa"
+    seekable.decompress(dst, out, threads=3)
+    assert out.read_bytes() == fasta
+
+    record = b">seq1234\nACDEFGHIKLMNPQRSTVWY\n"
+    assert seekable.read_range(dst, fasta.index(record), len(record)) == record
+    with seekable.open_seekable(dst) as f:
+        f.seek(-5, io.SEEK_END)
+        assert f.read() == fasta[-5:]
+        f.seek(FRAME - 3)
+        assert f.read(6) == fasta[FRAME - 3 : FRAME + 3]
+    assert seekable.members(dst) == {}
+
+
+def test_tar_members(tmp_path, zstandard):
+    files = {f"db/file{i}": os.urandom(i * 300) for i in range(10)}
+    src = tmp_path / "db.tar.gz"
+    with tarfile.open(src, "w:gz") as tar:
+        for name, data in files.items():
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            tar.addfile(info, io.BytesIO(data))
+    dst = tmp_path / "db.tar.zst"
+
+    seekable.transcode(src, dst, frame_size=FRAME)
+
+    assert set(seekable.members(dst)) == set(files)
+    assert seekable.read_member(dst, "db/file7") == files["db/file7"]
+    with pytest.raises(KeyError):
+        seekable.read_member(dst, "db/missing")
+    with seekable.open_decompressed(dst) as stream:
+        with tarfile.open(fileobj=stream, mode="r|") as tar:
+            assert [m.name for m in tar] == list(files)
+
+
+def test_source_transcode(tmp_path, fasta, zstandard):
+    data_dir = tmp_path / "data"
+    source = MgnifySource("2022_05")
+    src = data_dir / source.compressed
+    src.parent.mkdir(parents=True)
+    src.write_bytes(gzip.compress(fasta))
+    assert source.transcoded.name == "mgy_clusters_2022_05.fa.zst"
+
+    source.transcode(data_dir, remove=True)
+
+    state = StateDB(data_dir)
+    assert state.done(source.transcoded, TRANSCODED)
+    assert not state.done(source.compressed, DOWNLOADED)
+    assert not src.exists()
+    # not downloaded again; extracted from the zstd copy, with its index
+    source.download(data_dir)
+    source.decompress(data_dir)
+    assert (data_dir / source.uncompressed).read_bytes() == fasta
+    with source.fasta(data_dir) as index:
+        assert index["seq42"] == b">seq42\nACDEFGHIKLMNPQRSTVWY\n"
+
+
+def test_source_transcode_tar(tmp_path, zstandard):
+    data_dir = tmp_path / "data"
+    source = PDB70Source("200401")
+    src = data_dir / source.compressed
+    src.parent.mkdir(parents=True)
+    with tarfile.open(src, "w:gz") as tar:
+        info = tarfile.TarInfo("pdb70/pdb70_a3m.ffindex")
+        info.size = 4
+        tar.addfile(info, io.BytesIO(b"1 0\n"))
+
+    source.transcode(data_dir)
+    assert src.exists()
+    source.decompress(data_dir)
+
+    out = data_dir / source.uncompressed / "pdb70" / "pdb70_a3m.ffindex"
+    assert out.read_bytes() == b"1 0\n"
+
+    # the member list goes with the archive
+    zst = data_dir / source.transcoded
+    members = zst.with_name(zst.name + seekable.MEMBERS_SUFFIX)
+    assert seekable.members(zst) and members.exists()
+    assert source.prune(data_dir) > 0
+    assert not src.exists() and not zst.exists() and not members.exists()
+
+
+def test_truncated(tmp_path, fasta, zstandard):
+    "No partial output is left behind when reading the input fails"
+    src = tmp_path / "seq.fa.gz"
+    src.write_bytes(gzip.compress(fasta)[:-1000])
+    dst = tmp_path / "seq.fa.zst"
+    with pytest.raises(EOFError):
+        seekable.transcode(src, dst, frame_size=FRAME)
+    assert not dst.exists()
+    assert not (tmp_path / "seq.fa.zst.partial").exists()
+
+    src.write_bytes(gzip.compress(fasta))
+    seekable.transcode(src, dst, frame_size=FRAME)
+    data = bytearray(dst.read_bytes())
+    data[FRAME // 2 : FRAME] = bytes(FRAME // 2)
+    dst.write_bytes(data)
+    out = tmp_path / "seq.fa"
+    with pytest.raises(zstandard.ZstdError):
+        seekable.decompress(dst, out)
+    assert not out.exists()
+    assert not (tmp_path / "seq.fa.partial").exists()
@@ -0,0 +1,133 @@
+"""Tests for `alphafold_data.shards`."""
+
+import gzip
+import os
+
+import pytest
+
+from alphafold_data.shards import (
+    FastaSharder,
+    ensure_shards,
+    read_manifest,
+    shards_current,
+    shards_dir,
+)
+from alphafold_data.sources import MgnifySource, set_fasta_shards
+
+
+@pytest.fixture
+def records():
+    return [b">MGYP%06d\n" % i + b"MKVLAA\n" * (i % 7 + 1) for i in range(1000)]
+
+
+@pytest.fixture
+def sharding():
+    "Enable sharding for the test, disabling it afterwards"
+    yield set_fasta_shards
+    set_fasta_shards(0)
+
+
+def _check(fasta, shards, records):
+    data = fasta.read_bytes()
+    directory = shards_dir(fasta)
+    assert sorted(os.listdir(directory)) == sorted(
+        [shard.path for shard in shards] + ["manifest.json"]
+    )
+    assert shards[0].start == 0
+    assert shards[-1].end == len(data)
+    for shard, after in zip(shards, shards[1:]):
+        assert shard.end == after.start
+    for shard in shards:
+        content = (directory / shard.path).read_bytes()
+        assert content == data[shard.start : shard.end]
+        assert content.startswith(b">")
+        assert content.count(b">") == shard.records
+    assert sum(shard.records for shard in shards) == len(records)
+
+
+def test_sharder(tmp_path, records):
+    data = b"".join(records)
+    fasta = tmp_path / "db.fa"
+    fasta.write_bytes(data)
+
+    sharder = FastaSharder(fasta, 4, len(data))
+    for i in range(0, len(data), 13):  # records split across chunks
+        sharder.write(data[i : i + 13])
+    shards = sharder.save()
+
+    assert [shard.path for shard in shards] == [f"db.{i:03d}.fa" for i in range(4)]
+    _check(fasta, shards, records)
+    for shard in shards:
+        assert abs((shard.end - shard.start) - len(data) / 4) < 100
+    assert read_manifest(fasta) == shards
+    assert shards_current(fasta, 4)
+    assert not shards_current(fasta, 3)
+    assert not shards_dir(fasta).with_name("db.shards.partial").exists()
+
+
+def test_sharder_bad_estimate(tmp_path, records):
+    data = b"".join(records)
+    fasta = tmp_path / "db.fa"
+    fasta.write_bytes(data)
+
+    # far too small: shards have a minimum size, the last one takes the rest
+    sharder = FastaSharder(fasta, 8, len(data) // 10)
+    sharder.write(data)
+    _check(fasta, sharder.save(), records)
+
+    # far too large: fewer shards
+    sharder = FastaSharder(fasta, 8, len(data) * 4)
+    sharder.write(data)
+    shards = sharder.save()
+    assert len(shards) == 2
+    _check(fasta, shards, records)
+
+
+def test_more_shards_than_records(tmp_path, records):
+    data = b"".join(records[:3])
+    fasta = tmp_path / "db.fa"
+    fasta.write_bytes(data)
+
+    sharder = FastaSharder(fasta, 10, len(data))
+    for byte in range(len(data)):
+        sharder.write(data[byte : byte + 1])
+    shards = sharder.save()
+    assert [shard.records for shard in shards] == [1, 1, 1]
+    _check(fasta, shards, records[:3])
+
+
+def test_ensure_shards(tmp_path, records):
+    fasta = tmp_path / "db.fa"
+    fasta.write_bytes(b"".join(records))
+    assert read_manifest(fasta) is None
+
+    ensure_shards(fasta, 3)
+    _check(fasta, read_manifest(fasta), records)
+
+    # rebuilt when the FASTA changes
+    fasta.write_bytes(b"".join(records[:500]))
+    assert not shards_current(fasta, 3)
+    ensure_shards(fasta, 3)
+    _check(fasta, read_manifest(fasta), records[:500])
+
+
+def test_source_shards(tmp_path, records, sharding):
+    data_dir = tmp_path / "data"
+    source = MgnifySource("2022_05")
+    src = data_dir / source.compressed
+    src.parent.mkdir(parents=True)
+    src.write_bytes(gzip.compress(b"".join(records)))
+    sharding(4)
+
+    source.decompress(data_dir)
+
+    fasta = data_dir / source.uncompressed
+    shards = source.fasta_shards(data_dir)
+    assert shards is not None and len(shards) == 4
+    _check(fasta, shards, records)
+    assert shards_current(fasta, 4)
+
+    # added to an existing extraction
+    sharding(2)
+    source.decompress(data_dir)
+    assert len(source.fasta_shards(data_dir)) == 2
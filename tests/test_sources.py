@@ -0,0 +1,43 @@
+"""Tests for `alphafold_data.sources`."""
+
+import gzip
+
+from alphafold_data.fasta import index_current
+from alphafold_data.sources import UniprotSource
+from alphafold_data.state import DOWNLOADED, EXTRACTED, StateDB
+
+
+def test_uniprot_concatenates_parts(tmp_path, http_server, native):
+    trembl = b">tr|A0A000\nMSKGEE\n" * 1000
+    sprot = b">sp|P00001\nMKVLAA\n" * 1000
+    (http_server.root / "uniprot_trembl.fasta.gz").write_bytes(
+        gzip.compress(trembl[:500]) + gzip.compress(trembl[500:])
+    )
+    (http_server.root / "uniprot_sprot.fasta.gz").write_bytes(gzip.compress(sprot))
+    data_dir = tmp_path / "data"
+    source = UniprotSource("2023_01", url_base=http_server.url)
+
+    source.download(data_dir)
+    assert source.compressed_available(data_dir)
+    assert source.local_size(data_dir) == source.remote_size()
+    source.decompress(data_dir)
+
+    out = data_dir / "uncompressed/uniprot/2023_01/uniprot.fasta"
+    assert out.read_bytes() == trembl + sprot
+    assert index_current(out)
+    with source.fasta(data_dir) as index:
+        assert index["sp|P00001"] == b">sp|P00001\nMKVLAA\n"
+    state = StateDB(data_dir)
+    assert state.done(source.compressed, DOWNLOADED)
+    assert state.done(source.uncompressed, EXTRACTED)
+
+    # a missing part is downloaded again, complete ones are kept
+    part = source.compressed / "uniprot_sprot.fasta.gz"
+    (data_dir / part).unlink()
+    out.unlink()
+    state.clear(part)
+    state.clear(source.uncompressed)
+    http_server.requests.clear()
+    source.stream(data_dir)
+    assert http_server.requests == ["/uniprot_sprot.fasta.gz"]
+    assert out.read_bytes() == trembl + sprot
@@ -0,0 +1,42 @@
+"""Tests for `alphafold_data.state`."""
+
+from pathlib import Path
+
+from alphafold_data.sources import MgnifySource
+from alphafold_data.state import DOWNLOADED, EXTRACTED, StateDB
+
+
+def test_records(tmp_path):
+    state = StateDB(tmp_path)
+    path = Path("compressed/x.gz")
+    state.start(path, DOWNLOADED)
+    assert not state.done(path, DOWNLOADED)
+    state.finish(path, DOWNLOADED, 10)
+    record = state.get(path, DOWNLOADED)
+    assert record.done and record.size == 10 and record.completed >= record.started
+    state.clear(path)
+    assert state.get(path, DOWNLOADED) is None
+
+
+def test_available(tmp_path):
+    source = MgnifySource("2022_05")
+    out = tmp_path / source.uncompressed
+    out.parent.mkdir(parents=True)
+    out.write_text(">a\nAC\n")
+    state = StateDB(tmp_path)
+
+    # unknown paths are checked on disk and imported
+    assert source.uncompressed_available(tmp_path)
+    assert state.get(source.uncompressed, EXTRACTED).size == 6
+
+    # afterwards the database is authoritative until a deep check
+    out.unlink()
+    assert source.uncompressed_available(tmp_path)
+    assert not source.uncompressed_available(tmp_path, deep=True)
+    assert state.get(source.uncompressed, EXTRACTED) is None
+
+    # half-written output is not available
+    out.write_text(">a\n")
+    state.start(source.uncompressed, EXTRACTED)
+    assert not source.uncompressed_available(tmp_path)
+    assert not source.uncompressed_available(tmp_path, deep=True)
@@ -0,0 +1,42 @@
+"""Tests for `alphafold_data.streaming`."""
+
+import gzip
+import io
+import os
+import tarfile
+
+from alphafold_data.streaming import stream_gunzip, stream_tgz
+
+
+def _make_tgz(path, files):
+    with tarfile.open(path, "w:gz") as tar:
+        for name, data in files.items():
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            tar.addfile(info, io.BytesIO(data))
+
+
+def test_stream_tgz(http_server, tmp_path):
+    files = {"db/a.ffdata": os.urandom(300000), "db/b.ffindex": b"b\t0\t1\n"}
+    _make_tgz(http_server.root / "db.tar.gz", files)
+
+    dst = tmp_path / "out" / "db"
+    tee = tmp_path / "compressed" / "db.tar.gz"
+    stream_tgz(f"{http_server.url}/db.tar.gz", dst, tee=tee)
+
+    for name, data in files.items():
+        assert (dst / name).read_bytes() == data
+    assert tee.read_bytes() == (http_server.root / "db.tar.gz").read_bytes()
+    assert not dst.with_name("db.partial").exists()
+
+
+def test_stream_gunzip_restarts(http_server, tmp_path):
+    data = os.urandom(500000)
+    (http_server.root / "seq.fa.gz").write_bytes(gzip.compress(data))
+    http_server.truncate.add("/seq.fa.gz")
+
+    dst = tmp_path / "seq.fa"
+    stream_gunzip(f"{http_server.url}/seq.fa.gz", dst)
+
+    assert dst.read_bytes() == data
+    assert http_server.requests == ["/seq.fa.gz", "/seq.fa.gz"]
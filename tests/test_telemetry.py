@@ -0,0 +1,130 @@
+"""Tests for `alphafold_data.telemetry`."""
+
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+
+from alphafold_data import segmented, telemetry
+from alphafold_data.sources import download_file
+from alphafold_data.util import metadata_dir
+
+
+def _events(data_dir):
+    path = metadata_dir(data_dir) / telemetry.EVENTS_NAME
+    return [json.loads(line) for line in path.read_text().splitlines()]
+
+
+def test_stage_events_and_metrics(tmp_path, http_server, monkeypatch):
+    monkeypatch.setattr(segmented, "_MIN_SEGMENT_SIZE", 10000)
+    monkeypatch.setattr(segmented, "_RETRIES", 1)
+    monkeypatch.setattr(segmented.time, "sleep", lambda _: None)
+    data = os.urandom(50000)
+    (http_server.root / "db.fa.gz").write_bytes(data)
+    http_server.truncate.add("/db.fa.gz")
+    url = f"{http_server.url}/db.fa.gz"
+
+    with telemetry.session(tmp_path, interval=0.01):
+        with telemetry.source("mgnify"):
+            download_file(url, tmp_path / "db.fa.gz")
+            # an unrelated report outside any stage is ignored
+            telemetry.report(lambda: 1)
+
+    events = _events(tmp_path)
+    kinds = [e["event"] for e in events]
+    assert kinds[0] == "start" and "retry" in kinds and kinds[-1] == "end"
+    end = events[-1]
+    assert end["source"] == "mgnify" and end["stage"] == "download"
+    assert end["done"] == end["total"] == len(data)
+    assert end["status"] == "done"
+
+    metrics = (metadata_dir(tmp_path) / telemetry.METRICS_NAME).read_text()
+    labels = 'source="mgnify",stage="download",name="db.fa.gz"'
+    assert f"alphafold_data_stage_bytes{{{labels}}} {float(len(data))}" in metrics
+    assert 'alphafold_data_retries_total{source="mgnify"} 1' in metrics
+
+
+def test_read_progress(tmp_path):
+    assert telemetry.read_progress(tmp_path) == []
+    with telemetry.session(tmp_path, interval=0.01) as session:
+        with telemetry.stage("decompress", "x.tar.gz", total=100) as progress:
+            telemetry.report(lambda: 40)
+            session.tick()
+            (running,) = telemetry.read_progress(tmp_path)
+            assert running["status"] == "running"
+            assert running["done"] == 40
+        assert progress.status == "done"
+    # failures are recorded and re-raised
+    try:
+        with telemetry.session(tmp_path):
+            with telemetry.stage("download", "y"):
+                raise IOError("boom")
+    except IOError:
+        pass
+    assert _events(tmp_path)[-1]["status"] == "failed"
+
+
+def _worker(tmp_path, host, pid, name, updated=None):
+    "Progress file of another worker"
+    progress = {
+        "host": host,
+        "pid": pid,
+        "interval": 5.0,
+        "updated": time.time() if updated is None else updated,
+        "stages": [
+            telemetry.StageProgress("mgnify", "download", name, done=7).to_dict()
+        ],
+        "retries": {"mgnify": 2},
+    }
+    path = metadata_dir(tmp_path) / f"progress.{host}.{pid}.json"
+    path.write_text(json.dumps(progress))
+    return path
+
+
+def test_progress_of_other_hosts(tmp_path):
+    # a finished process on this host
+    exited = subprocess.Popen([sys.executable, "-c", "pass"])
+    exited.wait()
+    dead = _worker(tmp_path, socket.gethostname(), exited.pid, "a")
+    assert telemetry.read_progress(tmp_path) == []
+    assert not dead.exists()  # cleaned up
+
+    # pids of other hosts aren't probed, only the heartbeat counts
+    _worker(tmp_path, "elsewhere", exited.pid, "b")
+    (stage,) = telemetry.read_progress(tmp_path)
+    assert stage["name"] == "b"
+    _worker(tmp_path, "elsewhere", exited.pid, "b", updated=time.time() - 3600)
+    assert telemetry.read_progress(tmp_path) == []
+
+
+def test_workers_merged(tmp_path):
+    "Workers sharing a data_dir don't overwrite each other's progress"
+    _worker(tmp_path, "node2", 1234, "other.fa.gz")
+    with telemetry.session(tmp_path, interval=0.01) as session:
+        with telemetry.stage("decompress", "x.tar.gz", total=100):
+            session.tick()
+            names = sorted(s["name"] for s in telemetry.read_progress(tmp_path))
+            assert names == ["other.fa.gz", "x.tar.gz"]
+            metrics = (metadata_dir(tmp_path) / telemetry.METRICS_NAME).read_text()
+            assert 'name="other.fa.gz"} 7.0' in metrics
+            assert 'name="x.tar.gz"' in metrics
+            assert 'alphafold_data_retries_total{source="mgnify"} 2' in metrics
+    # only the other worker is left
+    (stage,) = telemetry.read_progress(tmp_path)
+    assert stage["name"] == "other.fa.gz"
+
+
+def test_events_rotation(tmp_path, monkeypatch):
+    monkeypatch.setattr(telemetry, "_EVENTS_MAX_SIZE", 1000)
+    session = telemetry.Session(tmp_path)
+    for i in range(100):
+        session.emit("retry", attempt=i)
+    events = metadata_dir(tmp_path) / telemetry.EVENTS_NAME
+    assert events.stat().st_size <= 1000
+    rotated = events.with_name(telemetry.EVENTS_NAME + ".1")
+    assert 1000 < rotated.stat().st_size < 1100
+    last = [json.loads(line)["attempt"] for line in rotated.read_text().splitlines()]
+    assert last[-1] < 99
+    assert _events(tmp_path)[-1]["attempt"] == 99
@@ -0,0 +1,150 @@
+"""Tests for `alphafold_data.throttle`."""
+
+import datetime
+import gzip
+import os
+import stat
+import tarfile
+import threading
+import time
+
+import pytest
+
+from alphafold_data.engine import DISK, NETWORK, default_engine
+from alphafold_data.gunzip import gunzip
+from alphafold_data.sources import decompress_tar, download_curl
+from alphafold_data.throttle import Governor, Schedule, ThreadBudget, set_governor
+
+
+@pytest.fixture
+def governed():
+    "Install a governor for the test, removing it afterwards"
+    yield set_governor
+    set_governor(None)
+
+
+def _at(hour, minute=0):
+    return datetime.datetime(2024, 1, 1, hour, minute)
+
+
+def test_schedule():
+    assert not Schedule("")
+    assert not Schedule("0")
+    assert Schedule("1.5M").rate() == 1536 * 1024
+
+    schedule = Schedule("08:00-20:00=20M, 22:00-06:00=0, 100M")
+    assert schedule
+    assert schedule.rate(_at(8)) == 20 << 20
+    assert schedule.rate(_at(19, 59)) == 20 << 20
+    assert schedule.rate(_at(20)) == 100 << 20
+    assert schedule.rate(_at(23)) == 0
+    assert schedule.rate(_at(5, 59)) == 0
+    assert schedule.rate(_at(6)) == 100 << 20
+
+    for spec in ["fast", "10M,20M", "8:00-25:00=1M", "8:00-9:00"]:
+        with pytest.raises(ValueError):
+            Schedule(spec)
+
+
+def test_bucket():
+    governor = Governor(network="1M")
+    chunk = 64 << 10
+
+    def move():
+        for _ in range(8):
+            governor.consume(NETWORK, chunk)
+
+    threads = [threading.Thread(target=move) for _ in range(3)]
+    start = time.monotonic()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    # 1.5 MiB at 1 MiB/s, shared by all threads
+    assert 1.3 < time.monotonic() - start < 2.5
+
+    start = time.monotonic()
+    governor.consume(DISK, 1 << 30)
+    assert time.monotonic() - start < 0.1
+
+
+def test_tool_share():
+    slots = default_engine().limits[NETWORK]
+    governor = Governor(network=f"{slots * 8}M")
+    assert governor.rate(NETWORK) == slots * 8 << 20
+    with governor.tool(NETWORK) as rate:
+        assert rate == 8 << 20
+        assert governor.rate(NETWORK) == max((slots - 1) * 8, 8) << 20
+    assert governor.rate(NETWORK) == slots * 8 << 20
+
+    with Governor().tool(NETWORK) as rate:
+        assert rate == 0
+
+
+def test_thread_budget():
+    budget = ThreadBudget(4)
+    release = threading.Event()
+    granted = []
+
+    def hold(wanted):
+        with budget.take(wanted, parallel=2) as threads:
+            granted.append(threads)
+            release.wait()
+
+    holders = [threading.Thread(target=hold, args=(8,)) for _ in range(3)]
+    for holder in holders:
+        holder.start()
+    holders[2].join(0.3)
+    # each gets half, the third waits for one to finish
+    assert granted == [2, 2]
+    release.set()
+    for holder in holders:
+        holder.join(1)
+    assert granted == [2, 2, 2]
+
+    # nested reservations share the outer one
+    with budget.take(3) as outer, budget.take(8) as nested:
+        assert (outer, nested) == (3, 3)
+
+    with ThreadBudget(0).take(16) as unlimited:
+        assert unlimited == 16
+
+
+def test_gunzip_throttled(tmp_path, governed):
+    src = tmp_path / "zeros.gz"
+    src.write_bytes(gzip.compress(bytes(3 << 20)))
+    governed(Governor(disk="2M"))
+
+    start = time.monotonic()
+    gunzip(src, tmp_path / "zeros", backend="threaded")
+    assert time.monotonic() - start > 1.2
+
+
+def test_curl_limit(tmp_path, http_server, governed, monkeypatch):
+    (http_server.root / "file").write_bytes(b"x" * 1000)
+    args = tmp_path / "args"
+    wrapper = tmp_path / "curl"
+    wrapper.write_text(f'#!/bin/sh\necho "$@" > {args}\nexec curl "$@"\n')
+    wrapper.chmod(wrapper.stat().st_mode | stat.S_IXUSR)
+    monkeypatch.setenv("CURL_EXE", str(wrapper))
+    slots = default_engine().limits[NETWORK]
+    governed(Governor(network=f"{slots}M"))
+
+    download_curl(f"{http_server.url}/file", tmp_path / "file")
+
+    assert (tmp_path / "file").read_bytes() == b"x" * 1000
+    assert f"--limit-rate {1 << 20} " in args.read_text()
+
+
+def test_tar_throttled(tmp_path, governed):
+    (tmp_path / "in").mkdir()
+    (tmp_path / "in" / "params.npz").write_bytes(os.urandom(1000))
+    with tarfile.open(tmp_path / "params.tar", "w") as tar:
+        tar.add(tmp_path / "in" / "params.npz", arcname="params.npz")
+    governed(Governor(disk="100M"))
+
+    decompress_tar(tmp_path / "params.tar", tmp_path / "out")
+
+    assert (tmp_path / "out" / "params.npz").read_bytes() == (
+        tmp_path / "in" / "params.npz"
+    ).read_bytes()
@@ -0,0 +1,102 @@
+"""Tests for `alphafold_data.untar`."""
+
+import io
+import os
+import tarfile
+import time
+
+import pytest
+
+from alphafold_data import untar
+from alphafold_data.untar import JOURNAL_NAME, extract_tgz
+
+
+@pytest.fixture
+def archive(tmp_path, monkeypatch):
+    # exercise the chunked path without huge fixtures
+    monkeypatch.setattr(untar, "_LARGE_MEMBER", 100000)
+    monkeypatch.setattr(untar, "_BUFFER_SIZE", 30000)
+    files = {
+        "pdb70/pdb70_a3m.ffdata": os.urandom(250000),
+        "pdb70/pdb70_a3m.ffindex": b"1abc\t0\t250000\n",
+    }
+    files.update({f"pdb70/small/{i}.txt": b"x" * i for i in range(50)})
+    path = tmp_path / "pdb70.tar.gz"
+    with tarfile.open(path, "w:gz") as tar:
+        for name, data in files.items():
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            info.mode = 0o640
+            tar.addfile(info, io.BytesIO(data))
+        link = tarfile.TarInfo("pdb70/link")
+        link.type = tarfile.SYMTYPE
+        link.linkname = "pdb70_a3m.ffindex"
+        tar.addfile(link)
+    return path, files
+
+
+def test_extract_tgz(tmp_path, archive):
+    src, files = archive
+    dst = tmp_path / "out"
+    extract_tgz(src, dst, writers=3)
+
+    for name, data in files.items():
+        assert (dst / name).read_bytes() == data
+    assert (dst / "pdb70/pdb70_a3m.ffdata").stat().st_mode & 0o777 == 0o640
+    assert os.readlink(dst / "pdb70/link") == "pdb70_a3m.ffindex"
+    assert not (dst / JOURNAL_NAME).exists()
+
+
+def test_resume(tmp_path, archive, monkeypatch):
+    src, files = archive
+    dst = tmp_path / "out"
+    dst.mkdir()
+    (dst / "pdb70").mkdir()
+    done = "pdb70/pdb70_a3m.ffdata"
+    (dst / done).write_bytes(files[done])
+    (dst / JOURNAL_NAME).write_text(f'{{"name": "{done}", "size": 250000}}\n')
+
+    written = []
+    write_small = untar._Extractor._write_small
+
+    def record(self, target, member, data):
+        written.append(member.name)
+        return write_small(self, target, member, data)
+
+    monkeypatch.setattr(untar._Extractor, "_write_small", record)
+    monkeypatch.setattr(untar, "_LARGE_MEMBER", 1 << 30)
+    extract_tgz(src, dst)
+
+    assert done not in written
+    assert len(written) == len(files) - 1
+    assert not (dst / JOURNAL_NAME).exists()
+
+
+@pytest.mark.skipif(not os.path.isdir("/proc/self/fd"), reason="needs /proc")
+def test_truncated_archive(tmp_path, archive, monkeypatch):
+    src, files = archive
+    src.write_bytes(src.read_bytes()[: src.stat().st_size // 2])
+    closed = set()
+    late = []
+    pwrite = os.pwrite
+    close = os.close
+
+    def slow_pwrite(fd, data, offset):
+        time.sleep(0.05)
+        if fd in closed:
+            late.append(offset)
+        return pwrite(fd, data, offset)
+
+    def tracked_close(fd):
+        # os is patched globally; only track the large member
+        if os.readlink(f"/proc/self/fd/{fd}").endswith(".ffdata"):
+            closed.add(fd)
+        close(fd)
+
+    monkeypatch.setattr(untar.os, "pwrite", slow_pwrite)
+    monkeypatch.setattr(untar.os, "close", tracked_close)
+
+    with pytest.raises((EOFError, OSError, tarfile.TarError)):
+        extract_tgz(src, tmp_path / "out", writers=1)
+    # no write ran on the file after it was closed
+    assert late == []
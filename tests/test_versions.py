@@ -0,0 +1,50 @@
+"""Tests for `alphafold_data.versions`."""
+
+import os
+
+from alphafold_data.alphafold_data import AFData
+from alphafold_data.sources import MgnifySource, ParamSource
+from alphafold_data.state import LINKED, StateDB
+from alphafold_data.versions import latest_version
+
+
+def _install(data_dir, source, name="data"):
+    path = data_dir / source.uncompressed
+    if path.suffix == ".fa":
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(f">{name}\nMKV\n")
+    else:
+        path.mkdir(parents=True, exist_ok=True)
+        (path / "params_model_1.npz").write_text(name)
+
+
+def test_link(tmp_path):
+    afd = AFData(tmp_path)
+    afd._sources = {"params": ParamSource("2022-12-06"), "mgnify": MgnifySource("v1")}
+    _install(tmp_path, afd._sources["params"])
+    assert not afd.link(name="2024-01-01")
+    assert latest_version(tmp_path) is None
+
+    _install(tmp_path, afd._sources["mgnify"], "v1")
+    assert afd.link(name="2024-01-01")
+    latest = tmp_path / "versions/latest"
+    assert (latest / "mgnify/mgy_clusters_v1.fa").read_text() == ">v1\nMKV\n"
+    assert (latest / "params/params_model_1.npz").read_text() == "data"
+    assert not os.path.isabs(os.readlink(latest / "mgnify"))
+    assert StateDB(tmp_path).done(afd._sources["mgnify"].uncompressed, LINKED)
+
+    # relinking unchanged sources reuses the tree
+    assert afd.link(name="2024-01-01")
+    assert sorted(p.name for p in (tmp_path / "versions").iterdir()) == [
+        "2024-01-01",
+        "latest",
+    ]
+
+    # a new version gets a new tree; the old one is untouched
+    afd._sources["mgnify"] = MgnifySource("v2")
+    _install(tmp_path, afd._sources["mgnify"], "v2")
+    assert afd.link(name="2024-01-01")
+    assert latest_version(tmp_path) == "2024-01-01.2"
+    assert (latest / "mgnify/mgy_clusters_v2.fa").read_text() == ">v2\nMKV\n"
+    old = tmp_path / "versions/2024-01-01/mgnify/mgy_clusters_v1.fa"
+    assert old.read_text() == ">v1\nMKV\n"